@@ -0,0 +1,52 @@
+import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.models.database import AsyncDB, get_async_db
+from app.schemas.schemas import TrendReport, CategoryBreakdown, SpendingForecast, Principal
+from app.crud.analytics import monthly_trends, category_breakdown, spending_forecast
+from app.core.dependencies import get_current_user
+
+router = APIRouter()
+
+@router.get("/analytics/trends", response_model=TrendReport)
+async def read_trends(
+    months: int = Query(default=12, ge=1, le=120),
+    window: int = Query(default=3, ge=1, le=24),
+    end_date: Optional[datetime.date] = None,
+    db: AsyncDB = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    讀取每月收支趨勢：月增減、移動平均及收支比，至 end_date 所在月份為止（預設為本月）。
+    """
+    return await db.run_blocking(monthly_trends, current_user.id, months=months, window=window, end_date=end_date)
+
+@router.get("/analytics/categories", response_model=CategoryBreakdown)
+async def read_category_breakdown(
+    type: str = "expense",
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    db: AsyncDB = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    讀取指定期間內各分類的筆數、總額、占比、平均及百分位數。
+    """
+    if type not in ("income", "expense"):
+        raise HTTPException(status_code=400, detail="type must be income or expense")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    return await db.run_blocking(category_breakdown, current_user.id, trans_type=type, start_date=start_date, end_date=end_date)
+
+@router.get("/analytics/forecast", response_model=SpendingForecast)
+async def read_forecast(
+    months: int = Query(default=3, ge=1, le=24),
+    history: int = Query(default=12, ge=1, le=120),
+    db: AsyncDB = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    預測本月剩餘天數及未來數月的支出。
+    """
+    return await db.run_blocking(spending_forecast, current_user.id, months=months, history=history)
@@ -1,47 +1,65 @@
 import logging
-import json
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from fastapi.responses import JSONResponse
 
-from app.models.database import get_db
-from app.models.models import User, Transaction, Category
-from app.schemas.schemas import UserCreate, UserBase, Token, UserDataExport, UserDataImport, TransactionModel, CategoryModel
-from app.crud.crud import get_user_by_username, create_user, create_user_transaction, create_user_category
-from app.core.security import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.models.database import AsyncDB, get_async_db, group_commit_stats, SHARD_COUNT
+from app.schemas.schemas import UserCreate, UserBase, Token, UserDataImport, Principal
+from app.crud.crud import (
+    get_user_by_username, create_user, update_user_password_hash, delete_user_and_data,
+    iter_user_data_export, import_user_data_records, import_user_data_ndjson
+)
+from app.crud.shards import assign_user_shard
+from app.crud.jobs import submit_job, user_data_ndjson
+from app.api.jobs import job_accepted
+from app.core.security import (
+    hash_password_async, verify_and_update_password_async, hashing_pool,
+    create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+)
 from app.core.dependencies import get_current_user
+from app.core.streaming import stream_with_session, encode_chunks, gzip_chunks
+from app.core.cache import principal_cache
 import datetime
 
 router = APIRouter()
 
 @router.post("/register", response_model=UserBase)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: UserCreate, db: AsyncDB = Depends(get_async_db)):
     """
     註冊新使用者。
     """
     logging.info(f"嘗試註冊使用者: {user.username}")
-    db_user = get_user_by_username(db, username=user.username)
+    db_user = await db.run(get_user_by_username, username=user.username)
     if db_user:
         logging.warning(f"使用者名稱 {user.username} 已存在。")
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_user = create_user(db=db, user=user)
+    hashed_password = await hash_password_async(user.password)
+    db_user = await db.run(create_user, user=user, hashed_password=hashed_password)
+    if SHARD_COUNT:
+        await db.run(assign_user_shard, db_user.id)
     logging.info(f"使用者 {user.username} 註冊成功，ID: {db_user.id}")
     return db_user
 
 @router.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncDB = Depends(get_async_db)):
     """
     使用者登入並獲取 JWT Token。
     """
-    user = get_user_by_username(db, username=form_data.username)
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await db.run(get_user_by_username, username=form_data.username)
+    password_ok, new_hash = (False, None)
+    if user:
+        password_ok, new_hash = await verify_and_update_password_async(form_data.password, user.hashed_password)
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # 密碼雜湊的演算法或成本參數已變更，登入成功時順便升級
+        await db.run(update_user_password_hash, user.id, new_hash)
+        logging.info(f"使用者 {user.username} 的密碼雜湊已升級")
     access_token_expires = datetime.timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -49,127 +67,133 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.delete("/delete-account")
-def delete_user_account(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def delete_user_account(
+    background: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncDB = Depends(get_async_db)
 ):
     """
     刪除當前使用者的帳號及所有相關資料。
+    background=true 時改由背景工作執行並立即回傳 202：帳號先被刪除，交易紀錄再分批刪除，不會長時間佔用資料庫寫入鎖。
     """
+    if background:
+        job = await db.run_blocking(submit_job, current_user.id, "delete_account")
+        logging.info(f"使用者 {current_user.username} 的帳號刪除已排入背景工作 {job['id']}")
+        return job_accepted(job)
     try:
-        user_id = current_user.id
-        
-        # 刪除使用者的所有交易紀錄
-        db.query(Transaction).filter(Transaction.user_id == user_id).delete()
-        
-        # 刪除使用者的所有自訂分類
-        db.query(Category).filter(Category.user_id == user_id).delete()
-        
-        # 刪除使用者帳號
-        db.delete(current_user)
-        db.commit()
+        # 刪除使用者的交易紀錄、自訂分類、統計彙總、全文檢索索引及帳號
+        await db.run(delete_user_and_data, current_user.id)
         
         logging.info(f"使用者 {current_user.username} 的帳號及所有相關資料已成功刪除")
         return {"message": "帳號及所有相關資料已成功刪除"}
         
     except Exception as e:
-        db.rollback()
         logging.error(f"刪除使用者帳號時發生錯誤: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="刪除帳號時發生錯誤，請稍後再試"
         )
 
-@router.get("/export-data", response_model=UserDataExport)
-def export_user_data(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+@router.get("/export-data")
+async def export_user_data(
+    format: str = Query(default="json", pattern="^(json|ndjson)$"),
+    gzip: bool = False,
+    background: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncDB = Depends(get_async_db)
 ):
     """
     匯出當前使用者的所有資料（交易紀錄和自訂分類）。
+    以串流方式分批讀取並輸出：format=json 為與 UserDataExport 相同的 JSON 文件，
+    format=ndjson 為每行一筆紀錄，可用 /auth/import-data/ndjson 匯入；gzip=true 時即時壓縮。
+    background=true 時改由背景工作寫入檔案並立即回傳 202，完成後由 /api/jobs/{id}/result 下載。
     """
-    try:
-        user_id = current_user.id
-        
-        # 獲取使用者的所有交易紀錄
-        transactions = db.query(Transaction).filter(Transaction.user_id == user_id).all()
-        
-        # 獲取使用者的所有自訂分類
-        custom_categories = db.query(Category).filter(Category.user_id == user_id).all()
-        
-        # 格式化資料
-        user_data = UserDataExport(
-            username=current_user.username,
-            transactions=[TransactionModel.model_validate(t) for t in transactions],
-            custom_categories=[CategoryModel.model_validate(c) for c in custom_categories]
-        )
-        
-        logging.info(f"使用者 {current_user.username} 的資料已成功匯出")
-        return user_data
-        
-    except Exception as e:
-        logging.error(f"匯出使用者資料時發生錯誤: {str(e)}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="匯出資料時發生錯誤，請稍後再試"
-        )
+    if background:
+        params = {"format": format, "gzip": gzip, "username": current_user.username}
+        job = await db.run_blocking(submit_job, current_user.id, "data_export", params, readonly=False)
+        logging.info(f"使用者 {current_user.username} 的資料匯出已排入背景工作 {job['id']}")
+        return job_accepted(job)
+    body = encode_chunks(stream_with_session(iter_user_data_export, current_user, format, session_factory=db.new_session))
+    filename = f"stashup-data.{format}"
+    if gzip:
+        response = StreamingResponse(gzip_chunks(body), media_type="application/gzip")
+        filename += ".gz"
+    else:
+        response = StreamingResponse(body, media_type="application/x-ndjson" if format == "ndjson" else "application/json")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    logging.info(f"使用者 {current_user.username} 開始匯出資料 ({format})")
+    return response
 
 @router.post("/import-data")
-def import_user_data(
+async def import_user_data(
     user_data: UserDataImport,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    background: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncDB = Depends(get_async_db)
 ):
     """
     匯入使用者資料（交易紀錄和自訂分類）。
+    已存在的相同交易會被略過，重複匯入同一份備份不會產生重複資料。
+    background=true 時改由背景工作分批匯入並立即回傳 202，匯入結果見工作的 result。
     """
+    if background:
+        job = await db.run_blocking(submit_job, current_user.id, "data_import", source=user_data_ndjson(user_data))
+        logging.info(f"使用者 {current_user.username} 的資料匯入已排入背景工作 {job['id']}")
+        return job_accepted(job)
     try:
-        user_id = current_user.id
-        imported_count = {"transactions": 0, "categories": 0}
-        
-        # 匯入自訂分類
-        for category_data in user_data.custom_categories:
-            existing_category = db.query(Category).filter(
-                Category.user_id == user_id,
-                Category.name == category_data.name,
-                Category.type == category_data.type
-            ).first()
-            
-            if not existing_category:
-                new_category = Category(
-                    name=category_data.name,
-                    type=category_data.type,
-                    user_id=user_id
-                )
-                db.add(new_category)
-                imported_count["categories"] += 1
-        
-        # 匯入交易紀錄
-        for transaction_data in user_data.transactions:
-            new_transaction = Transaction(
-                type=transaction_data.type,
-                description=transaction_data.description,
-                amount=transaction_data.amount,
-                category=transaction_data.category,
-                date=transaction_data.date,
-                user_id=user_id
-            )
-            db.add(new_transaction)
-            imported_count["transactions"] += 1
-        
-        db.commit()
+        imported_count = await db.run_blocking(import_user_data_records, user_data, current_user.id)
         
         logging.info(f"使用者 {current_user.username} 成功匯入資料: {imported_count}")
         return {
             "message": "資料匯入成功",
             "imported_transactions": imported_count["transactions"],
-            "imported_categories": imported_count["categories"]
+            "imported_categories": imported_count["categories"],
+            "skipped_transactions": imported_count["skipped_transactions"],
+            "budget_alerts": imported_count["budget_alerts"]
         }
         
     except Exception as e:
-        db.rollback()
         logging.error(f"匯入使用者資料時發生錯誤: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"匯入資料時發生錯誤: {str(e)}"
         )
+
+@router.post("/import-data/ndjson")
+async def import_user_data_stream(
+    file: UploadFile = File(...),
+    background: bool = False,
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncDB = Depends(get_async_db)
+):
+    """
+    匯入 /auth/export-data?format=ndjson 匯出的資料檔（可為 gzip 壓縮）。
+    以串流方式逐行解析並分批寫入，已存在的相同交易會被略過，格式錯誤的行會被略過並回報。
+    background=true 時改由背景工作匯入並立即回傳 202。
+    """
+    if background:
+        job = await db.run_blocking(submit_job, current_user.id, "data_import", source=file.file)
+        logging.info(f"使用者 {current_user.username} 的資料匯入已排入背景工作 {job['id']}")
+        return job_accepted(job)
+    stats = await db.run_blocking(import_user_data_ndjson, file.file, current_user.id)
+    logging.info(f"使用者 {current_user.username} 成功匯入資料: {stats['transactions']} 筆交易，略過 {stats['skipped_transactions']} 筆")
+    return {
+        "message": "資料匯入成功",
+        "imported_transactions": stats["transactions"],
+        "imported_categories": stats["categories"],
+        "skipped_transactions": stats["skipped_transactions"],
+        "failed": stats["failed"],
+        "errors": stats["errors"],
+        "budget_alerts": stats["budget_alerts"]
+    }
+
+@router.get("/cache-stats")
+async def read_cache_stats(current_user: Principal = Depends(get_current_user)):
+    """
+    讀取身分驗證快取的命中統計、密碼雜湊工作池與群組提交寫入器的狀態。
+    """
+    return {
+        "principal_cache": principal_cache.stats(),
+        "hashing_pool": hashing_pool.stats(),
+        "group_commit": group_commit_stats(),
+    }
@@ -0,0 +1,55 @@
+import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.models.database import AsyncDB, get_async_db
+from app.schemas.schemas import BudgetCreate, BudgetModel, Principal
+from app.crud.budgets import get_budgets, create_budget, update_budget, delete_budget
+from app.core.dependencies import get_current_user
+
+router = APIRouter()
+
+def _month_start(month: Optional[str]) -> datetime.date:
+    """
+    Parse a "YYYY-MM" query parameter into the first day of that month (default: the current month).
+    """
+    if month is None:
+        return datetime.date.today().replace(day=1)
+    try:
+        return datetime.datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be in YYYY-MM format")
+
+@router.get("/budgets", response_model=List[BudgetModel])
+async def read_budgets(month: Optional[str] = Query(default=None, description="YYYY-MM"), db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    讀取所有預算及指定月份（預設為本月）的支出、剩餘金額與狀態（ok、warning、exceeded）。
+    """
+    return await db.run(get_budgets, current_user.id, _month_start(month))
+
+@router.post("/budgets", response_model=BudgetModel)
+async def create_user_budget(budget: BudgetCreate, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    為支出類別建立每月預算；warn_percent 為發出警告的百分比（預設 80）。
+    """
+    return await db.write(create_budget, budget=budget, user_id=current_user.id, month=_month_start(None))
+
+@router.put("/budgets/{budget_id}", response_model=BudgetModel)
+async def update_user_budget(budget_id: int, budget: BudgetCreate, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    更新預算的類別、金額或警告百分比。
+    """
+    db_budget = await db.write(update_budget, budget_id=budget_id, budget=budget, user_id=current_user.id, month=_month_start(None))
+    if db_budget is None:
+        raise HTTPException(status_code=404, detail="Budget not found")
+    return db_budget
+
+@router.delete("/budgets/{budget_id}", response_model=BudgetModel)
+async def delete_user_budget(budget_id: int, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    刪除預算。
+    """
+    db_budget = await db.write(delete_budget, budget_id=budget_id, user_id=current_user.id, month=_month_start(None))
+    if db_budget is None:
+        raise HTTPException(status_code=404, detail="Budget not found")
+    return db_budget
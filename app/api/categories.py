@@ -1,48 +1,58 @@
 from typing import List, Dict
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 
-from app.models.database import get_db
-from app.models.models import User
-from app.schemas.schemas import CategoryCreate, CategoryModel
-from app.crud.crud import get_categories, create_user_category, update_user_category, delete_user_category
+from app.models.database import AsyncDB, get_async_db
+from app.schemas.schemas import CategoryCreate, CategoryModel, CategoryWriteResult, Principal
+from app.crud.crud import get_categories_with_etag, peek_categories_etag, create_user_category, update_user_category, delete_user_category
 from app.core.dependencies import get_current_user
 
 router = APIRouter()
 
 @router.get("/categories", response_model=Dict[str, List[str]])
-def read_categories(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def read_categories(request: Request, response: Response, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     讀取類別，包含使用者自訂和系統預設類別。
+    回應帶有 ETag；客戶端以 If-None-Match 重新驗證時，若分類未變更則回傳 304 且不查詢資料庫。
     """
-    return get_categories(db, current_user.id)
+    if_none_match = request.headers.get("if-none-match", "")
+    client_etags = [tag.strip() for tag in if_none_match.split(",") if tag.strip()]
+    etag = peek_categories_etag(current_user.id)
+    if etag is not None and etag in client_etags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    categories, etag = await db.run(get_categories_with_etag, current_user.id)
+    if etag in client_etags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return categories
 
 @router.post("/categories", response_model=CategoryModel)
-def create_category(category: CategoryCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_category(category: CategoryCreate, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     建立新類別。
     """
-    db_category = create_user_category(db=db, category=category, user_id=current_user.id)
+    db_category = await db.write(create_user_category, category=category, user_id=current_user.id)
     if db_category is None:
         raise HTTPException(status_code=400, detail="Category already exists for this user")
     return db_category
 
-@router.put("/categories/{category_id}", response_model=CategoryModel)
-def update_category(category_id: int, category: CategoryCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.put("/categories/{category_id}", response_model=CategoryWriteResult)
+async def update_category(category_id: int, category: CategoryCreate, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     更新類別名稱。
     """
-    db_category = update_user_category(db=db, category_id=category_id, category=category, user_id=current_user.id)
+    db_category = await db.write(update_user_category, category_id=category_id, category=category, user_id=current_user.id)
     if db_category is None:
         raise HTTPException(status_code=404, detail="Category not found or you don't have permission to edit it, or a category with this name/type already exists.")
     return db_category
 
-@router.delete("/categories/{category_type}/{category_name}", response_model=CategoryModel)
-def delete_category(category_type: str, category_name: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.delete("/categories/{category_type}/{category_name}", response_model=CategoryWriteResult)
+async def delete_category(category_type: str, category_name: str, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
-    刪除類別。
+    刪除類別。類別內的交易會移至同類型的「其他」類別，類別的預算一併刪除。
     """
-    db_category = delete_user_category(db=db, category_type=category_type, category_name=category_name, user_id=current_user.id)
+    db_category = await db.write(delete_user_category, category_type=category_type, category_name=category_name, user_id=current_user.id)
     if db_category is None:
         raise HTTPException(status_code=404, detail="Category not found or you don't have permission to delete it")
     return db_category
\ No newline at end of file
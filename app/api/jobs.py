@@ -0,0 +1,56 @@
+from typing import Dict, List
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse
+
+from app.models.database import AsyncDB, get_async_db
+from app.schemas.schemas import JobModel, Principal
+from app.crud.jobs import get_job, list_jobs, cancel_job, job_result_file
+from app.core.dependencies import get_current_user
+
+router = APIRouter()
+
+def job_accepted(job: Dict) -> JSONResponse:
+    """
+    Build the 202 response of an endpoint that queued a background job, pointing at its status URL.
+    """
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=jsonable_encoder(JobModel.model_validate(job)),
+        headers={"Location": f"/api/jobs/{job['id']}"},
+    )
+
+@router.get("/jobs", response_model=List[JobModel])
+async def read_jobs(limit: int = Query(default=20, ge=1, le=100), db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    列出當前使用者最近的背景工作，新的在前。
+    """
+    return await db.run(list_jobs, current_user.id, limit)
+
+@router.get("/jobs/{job_id}", response_model=JobModel)
+async def read_job(job_id: int, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    讀取背景工作的狀態及進度；匯出工作完成後 result_url 為結果檔案的下載網址。
+    """
+    job = await db.run(get_job, current_user.id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/result")
+async def download_job_result(job_id: int, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    下載已完成的匯出工作所產生的檔案。
+    """
+    path, filename, media_type = await db.run(job_result_file, current_user.id, job_id)
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobModel)
+async def cancel_background_job(job_id: int, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    取消背景工作。排隊中的工作立即取消；執行中的工作在目前這一批完成後停止，已寫入的資料會保留。
+    """
+    job = await db.write(cancel_job, current_user.id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
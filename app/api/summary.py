@@ -0,0 +1,35 @@
+import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.models.database import AsyncDB, get_async_db
+from app.schemas.schemas import Summary, Principal
+from app.crud.crud import get_summary, SUMMARY_DIMENSIONS, SUMMARY_TIME_DIMENSIONS
+from app.core.dependencies import get_current_user
+
+router = APIRouter()
+
+@router.get("/summary", response_model=Summary)
+async def read_summary(
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    group_by: List[str] = Query(default=["type"]),
+    type: Optional[str] = None,
+    category: Optional[str] = None,
+    db: AsyncDB = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    讀取指定期間內的收支彙總，可依類型、分類、日、月、年分組。
+    """
+    unknown = [dim for dim in group_by if dim not in SUMMARY_DIMENSIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by dimension(s): {', '.join(unknown)}")
+    if len([dim for dim in group_by if dim in SUMMARY_TIME_DIMENSIONS]) > 1:
+        raise HTTPException(status_code=400, detail="Only one of day, month or year can be used in group_by")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    return await db.run(
+        get_summary, current_user.id, start_date=start_date, end_date=end_date,
+        group_by=group_by, trans_type=type, category=category
+    )
@@ -1,69 +1,149 @@
+import datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status, Response
-from sqlalchemy.orm import Session
-import io
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, status
+from fastapi.responses import StreamingResponse
 
-from app.models.database import get_db
-from app.models.models import User
-from app.schemas.schemas import TransactionCreate, TransactionModel
+from app.models.database import AsyncDB, get_async_db
+from app.schemas.schemas import TransactionCreate, TransactionModel, TransactionWriteResult, TransactionChanges, TransactionBatch, TransactionBatchResult, Principal
 from app.crud.crud import (
-    get_transactions, create_user_transaction, update_user_transaction, 
-    delete_user_transaction, import_transactions_from_csv, export_transactions_to_csv
+    get_transactions, count_transactions, create_user_transaction, update_user_transaction, 
+    delete_user_transaction, apply_transaction_operations, import_transactions_from_csv, iter_transactions_csv,
+    encode_cursor, transaction_record
 )
+from app.crud.changes import get_changes_since, get_current_version
+from app.crud.jobs import submit_job
+from app.core.streaming import stream_with_session, encode_chunks, gzip_chunks
+from app.core.responses import FastJSONResponse
 from app.core.dependencies import get_current_user
+from app.api.jobs import job_accepted
 
 router = APIRouter()
 
-@router.get("/transactions", response_model=List[TransactionModel])
-def read_transactions(skip: int = 0, limit: int = 100, query: Optional[str] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get("/transactions", response_model=List[TransactionModel], response_class=FastJSONResponse)
+async def read_transactions(
+    skip: int = 0,
+    limit: int = Query(default=100, ge=1, le=1000),
+    query: Optional[str] = None,
+    cursor: Optional[str] = None,
+    sort: str = Query(default="date", pattern="^(date|relevance)$"),
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    type: Optional[str] = Query(default=None, pattern="^(income|expense)$"),
+    category: Optional[List[str]] = Query(default=None),
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    db: AsyncDB = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
     """
-    讀取交易紀錄，支援分頁和關鍵字查詢。
+    讀取交易紀錄（由新到舊），支援游標分頁、關鍵字查詢及篩選條件。
+    可依日期區間 (start_date、end_date)、類型 (type)、分類 (category，可重複指定多個) 及金額範圍 (min_amount、max_amount) 篩選。
+    若還有下一頁，回應標頭 X-Next-Cursor 會帶有下一頁的游標。
+    未帶游標的請求 (第一頁) 會在回應標頭 X-Total-Count 回傳符合條件的交易總筆數；
+    若第一頁已滿，而關鍵字或金額條件需要解壓封存區塊才能計算總數，則省略此標頭。
+    關鍵字查詢時可用 sort=relevance 依相關度排序（此時以 skip 分頁）。
+    回應標頭 X-Change-Version 為目前的變更版本，可作為 /transactions/changes 的 since 參數。
+    交易以資料列直接序列化輸出，不逐筆經過 response_model 驗證。
     """
-    transactions = get_transactions(db, user_id=current_user.id, skip=skip, limit=limit, query=query)
-    return transactions
+    if sort == "relevance" and cursor:
+        raise HTTPException(status_code=400, detail="Cursor pagination is not available with sort=relevance; use skip")
+    filters = {
+        "start_date": start_date, "end_date": end_date, "trans_type": type, "categories": category,
+        "min_amount": min_amount, "max_amount": max_amount
+    }
+    # Read the version first so changes committed while listing are re-sent, never missed
+    headers = {"X-Change-Version": str(await db.run(get_current_version, user_id=current_user.id))}
+    transactions = await db.run(get_transactions, user_id=current_user.id, skip=skip, limit=limit + 1, query=query, cursor=cursor, sort=sort, **filters)
+    if not cursor:
+        if len(transactions) <= limit and (transactions or not skip):
+            total = skip + len(transactions) # The page holds the last match
+        else:
+            total = await db.run(count_transactions, user_id=current_user.id, query=query, scan_archive=False, **filters)
+        if total is not None:
+            headers["X-Total-Count"] = str(total)
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        if sort == "date":
+            headers["X-Next-Cursor"] = encode_cursor(transactions[-1])
+    return FastJSONResponse([transaction_record(row) for row in transactions], headers=headers)
 
-@router.post("/transactions", response_model=TransactionModel)
-def create_transaction(transaction: TransactionCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get("/transactions/changes", response_model=TransactionChanges, response_class=FastJSONResponse)
+async def read_transaction_changes(since: int = Query(default=0, ge=0), limit: int = Query(default=1000, ge=1, le=10000), db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    讀取自指定版本之後新增、修改或刪除的交易紀錄，供前端增量同步。
+    has_more 為 true 時請以回傳的 version 繼續讀取；reset 為 true 時表示版本已被壓縮，需重新載入全部資料。
+    """
+    changes = await db.run(get_changes_since, user_id=current_user.id, since=since, limit=limit)
+    return FastJSONResponse({**changes, "upserts": [transaction_record(row) for row in changes["upserts"]]})
+
+@router.post("/transactions", response_model=TransactionWriteResult)
+async def create_transaction(transaction: TransactionCreate, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     建立新的交易紀錄。
+    若這筆交易使該月份的類別支出達到預算的警告比例或上限，budget_alerts 會列出被跨越的預算。
     """
-    return create_user_transaction(db=db, transaction=transaction, user_id=current_user.id)
+    return await db.write(create_user_transaction, transaction=transaction, user_id=current_user.id)
 
-@router.put("/transactions/{transaction_id}", response_model=TransactionModel)
-def update_transaction(transaction_id: int, transaction: TransactionCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.put("/transactions/{transaction_id}", response_model=TransactionWriteResult)
+async def update_transaction(transaction_id: int, transaction: TransactionCreate, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     更新交易紀錄。
     """
-    db_transaction = update_user_transaction(db=db, transaction_id=transaction_id, transaction=transaction, user_id=current_user.id)
+    db_transaction = await db.write(update_user_transaction, transaction_id=transaction_id, transaction=transaction, user_id=current_user.id)
     if db_transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found or you don't have permission to edit it")
     return db_transaction
 
-@router.delete("/transactions/{transaction_id}", response_model=TransactionModel)
-def delete_transaction(transaction_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.delete("/transactions/{transaction_id}", response_model=TransactionWriteResult)
+async def delete_transaction(transaction_id: int, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     刪除交易紀錄。
     """
-    db_transaction = delete_user_transaction(db=db, transaction_id=transaction_id, user_id=current_user.id)
+    db_transaction = await db.write(delete_user_transaction, transaction_id=transaction_id, user_id=current_user.id)
     if db_transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found or you don't have permission to delete it")
     return db_transaction
 
+@router.post("/transactions/batch", response_model=TransactionBatchResult, response_class=FastJSONResponse)
+async def batch_transactions(batch: TransactionBatch, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    """
+    批次建立、更新及刪除交易紀錄（每次最多 1000 筆操作）。
+    所有操作在同一個資料庫交易中完成：只要有一筆操作無效，整批都不會寫入，並以 422 回傳每筆操作的結果。
+    成功時回傳每筆操作的結果及批次完成後的變更版本。
+    """
+    result = await db.write(apply_transaction_operations, operations=batch.operations, user_id=current_user.id)
+    if not result["applied"]:
+        raise HTTPException(status_code=422, detail=result["results"])
+    return FastJSONResponse(result)
+
 @router.post("/transactions/import")
-async def import_transactions(file: UploadFile = File(...), db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def import_transactions(file: UploadFile = File(...), batch_size: int = Query(default=500, ge=1, le=10000), background: bool = False, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     從 CSV 檔案匯入交易紀錄。
+    以串流方式逐列解析上傳檔案並分批寫入，格式錯誤的列會被略過並回報。
+    background=true 時改由背景工作匯入並立即回傳 202，進度及結果見 /api/jobs/{id}。
     """
-    content = await file.read()
-    imported_count = import_transactions_from_csv(db, content, current_user.id)
-    return {"message": f"Successfully imported {imported_count} transactions."}
+    if background:
+        job = await db.run_blocking(submit_job, current_user.id, "csv_import", {"batch_size": batch_size}, source=file.file)
+        return job_accepted(job)
+    stats = await db.run_blocking(import_transactions_from_csv, file.file, current_user.id, batch_size=batch_size)
+    return {"message": f"Successfully imported {stats['imported']} transactions.", **stats}
 
 @router.get("/transactions/export")
-def export_transactions(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def export_transactions(gzip: bool = False, background: bool = False, db: AsyncDB = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """
     匯出所有交易紀錄為 CSV 檔案。
+    以串流方式分批讀取並輸出，gzip=true 時即時壓縮為 .csv.gz。
+    background=true 時改由背景工作寫入檔案並立即回傳 202，完成後由 /api/jobs/{id}/result 下載。
     """
-    csv_content = export_transactions_to_csv(db, current_user.id)
-    response = Response(content=csv_content, media_type="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=transactions.csv"
-    return response
\ No newline at end of file
+    if background:
+        job = await db.run_blocking(submit_job, current_user.id, "csv_export", {"gzip": gzip}, readonly=False)
+        return job_accepted(job)
+    body = encode_chunks(stream_with_session(iter_transactions_csv, current_user.id, session_factory=db.new_session))
+    if gzip:
+        response = StreamingResponse(gzip_chunks(body), media_type="application/gzip")
+        response.headers["Content-Disposition"] = "attachment; filename=transactions.csv.gz"
+    else:
+        response = StreamingResponse(body, media_type="text/csv")
+        response.headers["Content-Disposition"] = "attachment; filename=transactions.csv"
+    return response
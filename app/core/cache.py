@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache whose entries also expire after a time-to-live.
+    Keeps hit/miss/eviction counters for monitoring.
+    """
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value, or None if it is missing or expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Store a value; `ttl` overrides the cache default for this entry.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """
+        Remove one entry if present.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Any], bool]) -> int:
+        """
+        Remove every entry whose value matches the predicate. Returns the number removed.
+        """
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(value)]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Return the current size and counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+class VersionedCache:
+    """
+    Thread-safe in-process LRU cache validated by per-key version numbers instead of a TTL.
+    Writers call `bump` after changing the underlying data; readers capture `version` before
+    loading and store the result under it, so a load that raced with a write is never served.
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._versions = {}
+        self._entries = OrderedDict() # key -> (version, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, key: Hashable) -> int:
+        """
+        Return the current version of a key.
+        """
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def bump(self, key: Hashable):
+        """
+        Invalidate the cached value of a key by moving it to a new version.
+        """
+        with self._lock:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._entries.pop(key, None)
+
+    def get(self, key: Hashable, version: Any) -> Optional[Any]:
+        """
+        Return the value cached for `key` if it was stored under `version`, else None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, version: Any, value: Any):
+        """
+        Store a value loaded at `version`.
+        """
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Return the current size and counters.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+# Authenticated principals keyed by bearer token, so `get_current_user` skips the user lookup.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+def invalidate_principal(user_id: int):
+    """
+    Drop every cached principal of a user. Call after the account is deleted or changed.
+    """
+    principal_cache.delete_where(lambda principal: principal.id == user_id)
+
+# Category lists: the system categories under key None, each user's list under their id.
+CATEGORY_CACHE_SIZE = int(os.getenv("CATEGORY_CACHE_SIZE", "10000"))
+category_cache = VersionedCache(maxsize=CATEGORY_CACHE_SIZE)
+
+def invalidate_categories(user_id: Optional[int]):
+    """
+    Invalidate the cached category list of a user, or of the system categories when user_id is None.
+    """
+    category_cache.bump(user_id)
+
+# Shard assignments keyed by user id. Kept short-lived: `python -m app.crud.shards` marks a user as
+# moving and waits SHARD_MAP_CACHE_TTL before copying, so every server has seen the flag by then.
+SHARD_MAP_CACHE_TTL = float(os.getenv("SHARD_MAP_CACHE_TTL", "5"))
+SHARD_MAP_CACHE_SIZE = int(os.getenv("SHARD_MAP_CACHE_SIZE", "10000"))
+shard_map_cache = TTLCache(maxsize=SHARD_MAP_CACHE_SIZE, ttl=SHARD_MAP_CACHE_TTL)
+
+# Columnar ledger arrays of app/crud/analytics.py keyed by user id. Each entry holds a user's whole
+# ledger (about 30 bytes per transaction), so the cache is kept small.
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "32"))
+analytics_cache = VersionedCache(maxsize=ANALYTICS_CACHE_SIZE)
+
+def invalidate_analytics(user_id: int):
+    """
+    Drop the cached analytics arrays of a user. Call after the user's ledger changed.
+    """
+    analytics_cache.bump(user_id)
@@ -1,18 +1,24 @@
+import math
+import datetime
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 
-from app.models.database import get_db
-from app.models.models import User
-from app.schemas.schemas import TokenData
+from app.models.database import AsyncDB, get_async_db, SHARD_COUNT
+from app.crud.crud import get_user_by_username
+from app.crud.shards import get_user_shard_assignment
+from app.schemas.schemas import TokenData, Principal
 from app.core.security import SECRET_KEY, ALGORITHM
+from app.core.cache import principal_cache, shard_map_cache, SHARD_MAP_CACHE_TTL
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncDB = Depends(get_async_db)):
     """
     Dependency to get the current authenticated user.
+    Verified principals are cached per token until the token expires (at most PRINCIPAL_CACHE_TTL
+    seconds), so most requests need no user lookup. Returns a lightweight `Principal`, not an ORM object.
+    With sharding enabled, also routes the request's session to the user's shard.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -27,8 +33,30 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+
+    principal = principal_cache.get(token)
+    if principal is None:
+        user = await db.run(get_user_by_username, username=token_data.username)
+        if user is None:
+            raise credentials_exception
+        principal = Principal.model_validate(user)
+        expires_at = payload.get("exp")
+        if expires_at is not None:
+            principal_cache.set(token, principal, ttl=expires_at - datetime.datetime.now(datetime.timezone.utc).timestamp())
+        else:
+            principal_cache.set(token, principal)
+
+    if SHARD_COUNT:
+        assignment = shard_map_cache.get(principal.id)
+        if assignment is None:
+            assignment = await db.run(get_user_shard_assignment, principal.id)
+            shard_map_cache.set(principal.id, assignment)
+        shard, moving = assignment
+        if moving:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Account data is being moved, please retry shortly",
+                headers={"Retry-After": str(max(1, math.ceil(SHARD_MAP_CACHE_TTL * 2)))},
+            )
+        db.route(shard)
+    return principal
\ No newline at end of file
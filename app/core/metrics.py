@@ -0,0 +1,211 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from typing import Dict, Optional, Sequence, Tuple
+from sqlalchemy import event
+
+# Request and SQL instrumentation, exposed on /metrics in the Prometheus text format.
+# MetricsMiddleware times every HTTP request and labels it with the route template (not the raw path,
+# so ids do not explode the label set). SQLAlchemy engine events count the queries, query time and
+# affected rows of each request; the counts are kept in a per-request object stored in a context
+# variable, which Starlette's threadpool and AsyncSession.run_sync both carry over, so queries made
+# on behalf of a request are attributed to its route (the group-commit writer runs each write in the
+# submitting request's context too). Anything outside a request, such as startup, and the writer's
+# own BEGIN/COMMIT statements only show up in the global SQL counters.
+SLOW_QUERY_MS = float(os.getenv("STASHUP_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_PARAMS_LIMIT = 500 # Characters of bound parameters logged with a slow query
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def _format_labels(names: Sequence[str], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    """
+    A monotonically increasing value per label set (also used for gauges, with negative increments).
+    """
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), kind: str = "counter"):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.kind = kind
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count of observations per label set.
+    """
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((label_values, list(values)) for label_values, values in self._series.items())
+        for label_values, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), label_values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {values[-1]}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{labels} {values[-1]}")
+        return "\n".join(lines)
+
+http_requests = Counter("stashup_http_requests_total", "HTTP requests by route, method and status code.", ("route", "method", "status"))
+http_latency = Histogram("stashup_http_request_duration_seconds", "HTTP request latency until the response body is sent.", ("route", "method"))
+http_in_flight = Counter("stashup_http_requests_in_flight", "HTTP requests currently being served.", ("method",), kind="gauge")
+request_queries = Histogram("stashup_http_request_db_queries", "SQL statements executed per HTTP request.", ("route", "method"), QUERY_COUNT_BUCKETS)
+request_query_time = Histogram("stashup_http_request_db_seconds", "Time spent in SQL statements per HTTP request.", ("route", "method"))
+request_rows = Counter("stashup_http_request_db_rows_total", "Rows affected by SQL statements, by route (SQLite reports no row count for SELECT).", ("route", "method"))
+db_queries = Counter("stashup_db_queries_total", "SQL statements executed.")
+db_query_time = Counter("stashup_db_query_seconds_total", "Time spent in SQL statements.")
+db_slow_queries = Counter("stashup_db_slow_queries_total", "SQL statements slower than STASHUP_SLOW_QUERY_MS.")
+jobs_finished = Counter("stashup_jobs_total", "Background jobs finished, by kind and final status.", ("kind", "status"))
+jobs_running = Counter("stashup_jobs_running", "Background jobs currently being run by this process.", ("kind",), kind="gauge")
+
+REGISTRY = [
+    http_requests, http_latency, http_in_flight,
+    request_queries, request_query_time, request_rows,
+    db_queries, db_query_time, db_slow_queries,
+    jobs_finished, jobs_running,
+]
+
+class RequestStats:
+    __slots__ = ("queries", "query_time", "rows")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.rows = 0
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("stashup_request_stats", default=None)
+
+def render_metrics() -> str:
+    """
+    Return every metric in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+def _params_for_log(parameters) -> str:
+    text = repr(parameters)
+    if len(text) > SLOW_QUERY_PARAMS_LIMIT:
+        text = text[:SLOW_QUERY_PARAMS_LIMIT] + "..."
+    return text
+
+def instrument_engine(engine):
+    """
+    Count the queries, query time and affected rows of a sync engine (or an async engine's
+    `sync_engine`), and log statements slower than STASHUP_SLOW_QUERY_MS with their parameters.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries.inc()
+        db_query_time.inc(amount=elapsed)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_time += elapsed
+            if cursor.rowcount > 0:
+                stats.rows += cursor.rowcount
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            db_slow_queries.inc()
+            logging.warning(f"慢查詢 {elapsed * 1000:.1f} ms: {statement} 參數: {_params_for_log(parameters)}")
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # The statement failed, so after_cursor_execute never runs for it
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status code, in-flight count and SQL usage of each HTTP request.
+    Latency runs until the last body chunk is sent, so streamed exports are timed in full.
+    """
+    def __init__(self, app, exclude_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+        start = time.perf_counter()
+        http_in_flight.inc(method)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_in_flight.inc(method, amount=-1)
+            _request_stats.reset(token)
+            # The router stores the matched FastAPI route in the scope; mounts only set their root_path
+            route = getattr(scope.get("route"), "path", None) or scope.get("root_path") or "unmatched"
+            http_requests.inc(route, method, str(status))
+            http_latency.observe(elapsed, route, method)
+            request_queries.observe(stats.queries, route, method)
+            request_query_time.observe(stats.query_time, route, method)
+            if stats.rows:
+                request_rows.inc(route, method, amount=stats.rows)
@@ -0,0 +1,22 @@
+import json
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError: # Optional speed-up; the stdlib encoder produces the same output
+    orjson = None
+
+# Response class for endpoints that return large lists built from our own row tuples.
+# FastAPI would otherwise validate every row against the response_model and run it through
+# jsonable_encoder before encoding; these rows are already plain JSON-ready dicts.
+
+class FastJSONResponse(JSONResponse):
+    """
+    A JSONResponse that encodes with orjson when it is installed.
+    `content` must already be JSON-ready (dicts, lists, strings, numbers); it is not validated.
+    """
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
@@ -1,6 +1,12 @@
 import os
+import time
+import asyncio
 import datetime
-from typing import Optional
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 
@@ -9,7 +15,15 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key") # Should be loaded
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor. Hashes made with a different factor are upgraded on the user's next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Password hashing pool: bcrypt runs in separate processes so login/register bursts
+# cannot exhaust the request threadpool. Requests beyond workers + queue depth get 503.
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_QUEUE_DEPTH = int(os.getenv("HASH_QUEUE_DEPTH", "32"))
+HASH_RETRY_AFTER_SECONDS = int(os.getenv("HASH_RETRY_AFTER_SECONDS", "1"))
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -23,6 +37,106 @@ def get_password_hash(password: str) -> str:
     """
     return pwd_context.hash(password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and, if the stored hash uses an outdated scheme or work factor,
+    also return a replacement hash made with the current settings.
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+class HashingPool:
+    """
+    Bounded process pool for bcrypt work with fail-fast backpressure and basic metrics.
+    """
+    def __init__(self, workers: int, queue_depth: int):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    async def run(self, fn, *args):
+        """
+        Run `fn(*args)` in a worker process. Raises 503 with Retry-After when the queue is full.
+        """
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue_depth:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Authentication service is busy, please retry shortly",
+                    headers={"Retry-After": str(HASH_RETRY_AFTER_SECONDS)},
+                )
+            self.in_flight += 1
+            self.submitted += 1
+        started = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        with self._lock:
+            self.completed += 1
+            self.total_seconds += time.perf_counter() - started
+        return result
+
+    def stats(self) -> dict:
+        """
+        Return pool configuration and counters.
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "in_flight": self.in_flight,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_ms": round(self.total_seconds * 1000 / self.completed, 1) if self.completed else None,
+            }
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+hashing_pool = HashingPool(workers=HASH_POOL_SIZE, queue_depth=HASH_QUEUE_DEPTH)
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hash a plain password in the hashing pool.
+    """
+    return await hashing_pool.run(get_password_hash, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password in the hashing pool; see `verify_and_update_password`.
+    """
+    return await hashing_pool.run(verify_and_update_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[datetime.timedelta] = None) -> str:
     """
     Create a JWT access token.
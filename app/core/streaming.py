@@ -0,0 +1,39 @@
+import zlib
+from typing import Callable, Iterable, Iterator
+
+from app.models.database import ReadSessionLocal
+
+# Helpers for StreamingResponse bodies. Streams outlive the request's `get_db` session,
+# so they open their own read-only session and close it once the last chunk has been sent.
+
+STREAM_ENCODING = "utf-8"
+
+def stream_with_session(produce: Callable, *args, session_factory: Callable = ReadSessionLocal, **kwargs) -> Iterator:
+    """
+    Run a generator function with a dedicated database session as its first argument,
+    closing the session when the stream finishes or the client disconnects.
+    Pass `session_factory=db.new_session` to read from the request's shard.
+    """
+    db = session_factory()
+    try:
+        yield from produce(db, *args, **kwargs)
+    finally:
+        db.close()
+
+def encode_chunks(chunks: Iterable[str], encoding: str = STREAM_ENCODING) -> Iterator[bytes]:
+    """
+    Encode text chunks to bytes as they are produced.
+    """
+    for chunk in chunks:
+        yield chunk.encode(encoding)
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Gzip a byte stream on the fly, emitting compressed data as soon as zlib has any.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,389 @@
+import datetime
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+from sqlalchemy import select, cast, func, or_, String
+from sqlalchemy.orm import Session
+
+from app.models.models import Transaction, Category
+from app.core.cache import analytics_cache
+from app.crud import changes, archive
+
+# Columnar analytics over a user's whole ledger. The (date, amount, type, category) of every
+# transaction is loaded once into NumPy arrays sorted by date and cached per user in
+# `analytics_cache`; each report then slices the arrays with binary searches and aggregates with
+# vectorized NumPy calls, so it costs milliseconds even for a million rows.
+#
+# The arrays remember the change-log version they were read at. When a write has moved the
+# version since (on any server), the transactions named in the newer change entries are dropped
+# from the arrays and read again, so a write costs the next report a few indexed lookups instead of
+# a full reload. Only a compacted change log, a large import or a deleted ledger forces a reload.
+LOAD_BATCH_SIZE = 50000
+PATCH_MAX_CHANGES = 10000 # Above this many changed transactions the arrays are reloaded instead of patched
+ROLLING_WINDOW = 3 # Months averaged by default in the trend report
+FORECAST_PACE_DAYS = 90 # Trailing days whose daily spending projects the rest of the current month
+PERCENTILES = (25, 50, 75, 90)
+UNCATEGORIZED = -1 # Category code of transactions without a category
+LEDGER_COLUMNS = (("ids", np.int64), ("days", np.int32), ("amounts", np.float64), ("income", bool), ("categories", np.int32))
+
+def _round(value) -> Optional[float]:
+    value = float(value)
+    return None if np.isnan(value) or np.isinf(value) else round(value, 2)
+
+def _month_code(date: datetime.date) -> int:
+    return (date.year - 1970) * 12 + date.month - 1
+
+def _month_label(code: int) -> str:
+    return f"{1970 + code // 12:04d}-{code % 12 + 1:02d}"
+
+def _day_code(date: datetime.date) -> int:
+    return (date - datetime.date(1970, 1, 1)).days
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """
+    Element-wise numerator / denominator, NaN where the denominator is zero.
+    """
+    result = np.full(np.shape(numerator), np.nan)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+class LedgerArrays:
+    """
+    A user's ledger at change-log `version` as parallel NumPy arrays sorted by date: transaction ids,
+    days and months since 1970-01-01, amounts, an income flag and category ids (UNCATEGORIZED for none).
+    Never modified once built; `patched` returns a new instance.
+    """
+    __slots__ = ("version", "ids", "days", "months", "amounts", "income", "categories", "_category_order", "_lock")
+
+    def __init__(self, version: int, ids: np.ndarray, days: np.ndarray, amounts: np.ndarray, income: np.ndarray, categories: np.ndarray):
+        self.version = version
+        self.ids = ids
+        self.days = days
+        self.months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int32)
+        self.amounts = amounts
+        self.income = income
+        self.categories = categories
+        self._category_order = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def date_slice(self, start_date: Optional[datetime.date], end_date: Optional[datetime.date]) -> slice:
+        """
+        Return the index range of the transactions dated within [start_date, end_date].
+        """
+        lo = 0 if start_date is None else int(np.searchsorted(self.days, _day_code(start_date), "left"))
+        hi = len(self) if end_date is None else int(np.searchsorted(self.days, _day_code(end_date), "right"))
+        return slice(lo, max(lo, hi))
+
+    def monthly_totals(self, first_month: int, last_month: int) -> np.ndarray:
+        """
+        Return an array of shape (months, 4) with the income total, expense total, income count and
+        expense count of each month from first_month to last_month (month codes, inclusive).
+        """
+        size = last_month - first_month + 1
+        lo = int(np.searchsorted(self.months, first_month, "left"))
+        hi = int(np.searchsorted(self.months, last_month, "right"))
+        # Two bins per month: even for income, odd for expense
+        bins = (self.months[lo:hi] - first_month) * 2 + ~self.income[lo:hi]
+        totals = np.bincount(bins, weights=self.amounts[lo:hi], minlength=size * 2).reshape(size, 2)
+        counts = np.bincount(bins, minlength=size * 2).reshape(size, 2)
+        return np.hstack([totals, counts])
+
+    def category_order(self) -> np.ndarray:
+        """
+        Return the permutation sorting the ledger by (income flag, category, amount). Computed on first
+        use; a date window keeps the order by filtering it on the window's index range.
+        """
+        if self._category_order is None:
+            with self._lock:
+                if self._category_order is None:
+                    self._category_order = np.lexsort((self.amounts, self.categories, self.income))
+        return self._category_order
+
+    def patched(self, version: int, removed_ids: List[int], added: "LedgerArrays") -> "LedgerArrays":
+        """
+        Return a copy at `version` without the transactions in removed_ids and with the transactions
+        of `added` merged in by date.
+        """
+        keep = ~np.isin(self.ids, removed_ids)
+        order = np.argsort(added.days, kind="stable")
+        days = self.days[keep]
+        positions = np.searchsorted(days, added.days[order], "right")
+        return LedgerArrays(version, *(
+            np.insert(getattr(self, name)[keep], positions, getattr(added, name)[order])
+            for name, _ in LEDGER_COLUMNS
+        ))
+
+def _read_ledger_columns(db: Session, columns: List[List[np.ndarray]], *conditions):
+    """
+    Append the transactions matching `conditions` to `columns` (one list of array parts per
+    LEDGER_COLUMNS entry), LOAD_BATCH_SIZE rows at a time. Dates are fetched as ISO strings and
+    parsed by NumPy rather than into Python date objects.
+    """
+    result = db.connection().execute(
+        select(
+            Transaction.id,
+            cast(Transaction.date, String),
+            func.coalesce(Transaction.amount, 0.0),
+            Transaction.type == "income",
+            func.coalesce(Transaction.category_id, UNCATEGORIZED)
+        ).where(*conditions).order_by(Transaction.date, Transaction.id).execution_options(yield_per=LOAD_BATCH_SIZE)
+    )
+    for rows in result.partitions():
+        ids, dates, amounts, income, categories = zip(*rows)
+        columns[0].append(np.array(ids, dtype=np.int64))
+        columns[1].append(np.array(dates, dtype="datetime64[D]").astype(np.int32))
+        columns[2].append(np.array(amounts, dtype=np.float64))
+        columns[3].append(np.array(income, dtype=bool))
+        columns[4].append(np.array(categories, dtype=np.int32))
+
+def _read_archived_columns(db: Session, columns: List[List[np.ndarray]], blocks: List):
+    """
+    Append the archived transactions of `blocks` to `columns`, one decompressed block at a time.
+    """
+    epoch = datetime.date(1970, 1, 1).toordinal()
+    for block in archive.iter_block_columns(db, blocks):
+        columns[0].append(np.array(block["id"], dtype=np.int64))
+        columns[1].append((np.array(block["date"], dtype=np.int64) - epoch).astype(np.int32))
+        columns[2].append(np.array([0.0 if amount is None else amount for amount in block["amount"]], dtype=np.float64))
+        columns[3].append(np.array(block["type"]) == "income")
+        columns[4].append(np.array([UNCATEGORIZED if category_id is None else category_id for category_id in block["category_id"]], dtype=np.int32))
+
+def _ledger_arrays(version: int, columns: List[List[np.ndarray]]) -> LedgerArrays:
+    return LedgerArrays(version, *(
+        np.concatenate(parts) if parts else np.empty(0, dtype)
+        for parts, (_, dtype) in zip(columns, LEDGER_COLUMNS)
+    ))
+
+def load_ledger_arrays(db: Session, user_id: int, version: int) -> LedgerArrays:
+    """
+    Read a user's whole ledger, archive included, into LedgerArrays labelled with change-log `version`.
+    """
+    columns = [[] for _ in LEDGER_COLUMNS]
+    blocks = archive.get_blocks(db, user_id)
+    _read_archived_columns(db, columns, blocks)
+    _read_ledger_columns(db, columns, Transaction.user_id == user_id)
+    arrays = _ledger_arrays(version, columns)
+    if blocks:
+        # The transactions table may still hold rows older than the archived ones
+        order = np.lexsort((arrays.ids, arrays.days))
+        arrays = LedgerArrays(version, *(getattr(arrays, name)[order] for name, _ in LEDGER_COLUMNS))
+    return arrays
+
+def patch_ledger_arrays(db: Session, user_id: int, arrays: LedgerArrays, version: int) -> Optional[LedgerArrays]:
+    """
+    Bring cached arrays up to change-log `version` by re-reading the transactions changed since
+    they were built (deleted ones are simply no longer found). Returns None when the change log
+    no longer covers the arrays' version or more than PATCH_MAX_CHANGES transactions changed.
+    """
+    changed_ids = changes.get_changed_ids(db, user_id, arrays.version, limit=PATCH_MAX_CHANGES)
+    if changed_ids is None:
+        return None
+    columns = [[] for _ in LEDGER_COLUMNS]
+    for start in range(0, len(changed_ids), changes.CHANGE_LOG_BATCH_SIZE):
+        _read_ledger_columns(
+            db, columns, Transaction.user_id == user_id,
+            Transaction.id.in_(changed_ids[start:start + changes.CHANGE_LOG_BATCH_SIZE])
+        )
+    return arrays.patched(version, changed_ids, _ledger_arrays(version, columns))
+
+def get_ledger_arrays(db: Session, user_id: int) -> LedgerArrays:
+    """
+    Return a user's LedgerArrays, from the cache when they are current, patched when the ledger has
+    changed a little and reloaded otherwise.
+    The version is read first, so changes that race with the read are simply read again next time.
+    """
+    cache_version = (analytics_cache.version(user_id), db.info.get("shard"))
+    version = changes.get_current_version(db, user_id)
+    arrays = analytics_cache.get(user_id, cache_version)
+    if arrays is not None and arrays.version == version:
+        return arrays
+    if arrays is not None:
+        arrays = patch_ledger_arrays(db, user_id, arrays, version)
+    if arrays is None:
+        arrays = load_ledger_arrays(db, user_id, version)
+    analytics_cache.set(user_id, cache_version, arrays)
+    return arrays
+
+def monthly_trends(db: Session, user_id: int, months: int = 12, window: int = ROLLING_WINDOW, end_date: Optional[datetime.date] = None) -> Dict:
+    """
+    Report income, expense and net per month for the `months` months ending with the month of
+    end_date (default today), with month-over-month changes, `window`-month rolling averages and
+    the income/expense ratio of each month.
+    """
+    arrays = get_ledger_arrays(db, user_id)
+    end_month = _month_code(end_date or datetime.date.today())
+    first_month = end_month - months + 1
+    lead = window # Earlier months needed for the first rolling average and month-over-month change
+    data = arrays.monthly_totals(first_month - lead, end_month)
+    income, expense, income_count, expense_count = data.T
+    net = income - expense
+
+    def rolling(values: np.ndarray) -> np.ndarray:
+        sums = np.concatenate(([0.0], np.cumsum(values)))
+        return (sums[window:] - sums[:-window])[-months:] / window
+
+    def change(values: np.ndarray):
+        delta = values[lead:] - values[lead - 1:-1]
+        return delta, _ratio(delta, np.abs(values[lead - 1:-1])) * 100
+
+    income_change, income_change_pct = change(income)
+    expense_change, expense_change_pct = change(expense)
+    net_change, _ = change(net)
+    columns = {
+        "income": income[lead:], "expense": expense[lead:], "net": net[lead:],
+        "income_change": income_change, "income_change_pct": income_change_pct,
+        "expense_change": expense_change, "expense_change_pct": expense_change_pct,
+        "net_change": net_change,
+        "income_average": rolling(income), "expense_average": rolling(expense), "net_average": rolling(net),
+        "income_expense_ratio": _ratio(income[lead:], expense[lead:]),
+    }
+    trend = []
+    for i in range(months):
+        entry = {"month": _month_label(first_month + i), "count": int(income_count[lead + i] + expense_count[lead + i])}
+        entry.update({name: _round(values[i]) for name, values in columns.items()})
+        trend.append(entry)
+
+    total_income = float(columns["income"].sum())
+    total_expense = float(columns["expense"].sum())
+    return {
+        "start_month": _month_label(first_month),
+        "end_month": _month_label(end_month),
+        "window": window,
+        "income": _round(total_income),
+        "expense": _round(total_expense),
+        "net": _round(total_income - total_expense),
+        "average_income": _round(total_income / months),
+        "average_expense": _round(total_expense / months),
+        "income_expense_ratio": _round(total_income / total_expense) if total_expense else None,
+        "savings_rate": _round((total_income - total_expense) / total_income * 100) if total_income else None,
+        "months": trend
+    }
+
+def category_breakdown(
+    db: Session,
+    user_id: int,
+    trans_type: str = "expense",
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None
+) -> Dict:
+    """
+    Report count, total, share, mean, min, max and percentiles of the amounts in each category of
+    one transaction type within a date range, largest total first.
+    """
+    arrays = get_ledger_arrays(db, user_id)
+    window = arrays.date_slice(start_date, end_date)
+    order = arrays.category_order()
+    if window.start > 0 or window.stop < len(arrays):
+        order = order[(order >= window.start) & (order < window.stop)]
+    order = order[arrays.income[order] == (trans_type == "income")]
+
+    stats = []
+    if len(order):
+        categories = arrays.categories[order]
+        amounts = arrays.amounts[order] # Sorted within each category
+        starts = np.flatnonzero(np.concatenate(([True], categories[1:] != categories[:-1])))
+        counts = np.diff(np.append(starts, len(order)))
+        totals = np.add.reduceat(amounts, starts)
+        percentiles = {}
+        for q in PERCENTILES:
+            # Linear interpolation between the closest ranks, like numpy.percentile's default
+            position = starts + (counts - 1) * (q / 100)
+            below = np.floor(position).astype(np.int64)
+            above = np.minimum(below + 1, starts + counts - 1)
+            percentiles[f"p{q}"] = amounts[below] + (amounts[above] - amounts[below]) * (position - below)
+
+        category_ids = [int(cat_id) for cat_id in categories[starts] if cat_id != UNCATEGORIZED]
+        names = dict(db.query(Category.id, Category.name).filter(
+            Category.id.in_(category_ids),
+            or_(Category.user_id == None, Category.user_id == user_id)
+        ).all()) if category_ids else {}
+        grand_total = totals.sum()
+        for i in np.argsort(-totals, kind="stable"):
+            entry = {
+                "category": names.get(int(categories[starts[i]])),
+                "count": int(counts[i]),
+                "total": _round(totals[i]),
+                "share": _round(totals[i] / grand_total * 100) if grand_total else None,
+                "mean": _round(totals[i] / counts[i]),
+                "min": _round(amounts[starts[i]]),
+                "max": _round(amounts[starts[i] + counts[i] - 1]),
+            }
+            entry.update({name: _round(values[i]) for name, values in percentiles.items()})
+            stats.append(entry)
+
+    return {
+        "type": trans_type,
+        "start_date": start_date,
+        "end_date": end_date,
+        "count": int(len(order)),
+        "total": _round(arrays.amounts[order].sum()),
+        "categories": stats
+    }
+
+def spending_forecast(db: Session, user_id: int, months: int = 3, history: int = 12, as_of: Optional[datetime.date] = None) -> Dict:
+    """
+    Project expenses for the rest of the current month and the next `months` months.
+    The current month adds the trailing FORECAST_PACE_DAYS daily average for each remaining day to what
+    was already spent; later months follow a least-squares linear trend over the last `history`
+    complete months (counted from the first transaction), bounded by one standard deviation of the
+    trend's residuals.
+    """
+    arrays = get_ledger_arrays(db, user_id)
+    as_of = as_of or datetime.date.today()
+    current_month = _month_code(as_of)
+    month_start = as_of.replace(day=1)
+    days_in_month = ((month_start + datetime.timedelta(days=32)).replace(day=1) - month_start).days
+    expense = ~arrays.income
+
+    def spent(start: datetime.date, end: datetime.date) -> float:
+        window = arrays.date_slice(start, end)
+        return float(arrays.amounts[window][expense[window]].sum())
+
+    first_day = int(arrays.days[0]) if len(arrays) else _day_code(as_of)
+    pace_days = max(1, min(FORECAST_PACE_DAYS, _day_code(as_of) - first_day + 1))
+    daily_average = spent(as_of - datetime.timedelta(days=pace_days - 1), as_of) / pace_days
+    spent_so_far = spent(month_start, as_of)
+
+    first_month = max(current_month - history, int(arrays.months[0]) if len(arrays) else current_month)
+    history_months = max(0, current_month - first_month)
+    slope, method, deviation = 0.0, "none", 0.0
+    if history_months > 0:
+        observed = arrays.monthly_totals(first_month, current_month - 1)[:, 1]
+        x = np.arange(history_months, dtype=np.float64)
+        if history_months >= 2:
+            slope, intercept = np.polyfit(x, observed, 1)
+            residuals = observed - (slope * x + intercept)
+            deviation = float(np.sqrt(np.sum(residuals ** 2) / max(1, history_months - 2)))
+            method = "linear"
+        else:
+            intercept = float(observed[0])
+            method = "mean"
+        steps = np.arange(history_months, history_months + months + 1, dtype=np.float64)
+        projected = np.maximum(0.0, slope * steps + intercept)
+    else:
+        projected = np.zeros(months + 1)
+
+    forecast = []
+    for k in range(1, months + 1):
+        forecast.append({
+            "month": _month_label(current_month + k),
+            "expense": _round(projected[k]),
+            "lower": _round(max(0.0, projected[k] - deviation)),
+            "upper": _round(projected[k] + deviation)
+        })
+    return {
+        "as_of": as_of,
+        "method": method,
+        "history_months": history_months,
+        "trend_per_month": _round(slope),
+        "current_month": {
+            "month": _month_label(current_month),
+            "spent": _round(spent_so_far),
+            "daily_average": _round(daily_average),
+            "projected": _round(spent_so_far + daily_average * (days_in_month - as_of.day))
+        },
+        "months": forecast
+    }
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import zlib
+import logging
+import datetime
+import itertools
+from collections import Counter, namedtuple
+from typing import Collection, Dict, Iterable, Iterator, List, Optional
+from sqlalchemy import func, select, delete, insert, text
+from sqlalchemy.orm import Session
+
+from app.models.models import Transaction, TransactionArchive, TransactionChange
+from app.crud import search
+
+# Cold-data archive. `python -m app.crud.archive compact` moves transactions dated more than
+# ARCHIVE_AFTER_DAYS ago out of the transactions table and the search index into one compressed block
+# per user and calendar year, so the hot table and its indexes only grow with recent data.
+# A block stores its rows column by column as zlib-compressed JSON, sorted by (date, id), and keeps
+# its date and id ranges in plain columns: the read paths in app/crud/crud.py first look up the blocks
+# overlapping the requested range with one indexed query and only decompress those, which for the
+# usual recent pages is none. Rollups are not touched, so summaries, counts and budgets never read here.
+# Blocks also keep their row counts per type and category and their amount range, which answer the
+# filtered counts of blocks lying wholly inside or outside the filters without decompressing them.
+#
+# Archived transactions keep their ids (the transactions table uses AUTOINCREMENT, so SQLite never
+# hands an archived id out again). Writes never change a block in place: a transaction that is edited
+# or deleted, or whose category moves, is first taken out of its block and put back into the
+# transactions table (`rehydrate_transactions` in app/crud/crud.py), and the next compaction archives
+# it again. Transactions still named in the change log are not archived, so delta sync and the
+# analytics cache patches only ever look up hot rows.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", "9"))
+ARCHIVE_BATCH_SIZE = 1000
+
+ARCHIVE_COLUMNS = ("id", "type", "description", "amount", "category_id", "date", "content_seq")
+ArchivedRow = namedtuple("ArchivedRow", ARCHIVE_COLUMNS)
+BLOCK_INFO = (
+    TransactionArchive.id, TransactionArchive.year, TransactionArchive.count,
+    TransactionArchive.min_date, TransactionArchive.max_date, TransactionArchive.min_id, TransactionArchive.max_id,
+    TransactionArchive.type_category_counts, TransactionArchive.min_amount, TransactionArchive.max_amount
+)
+
+def encode_block(rows: List[ArchivedRow]) -> bytes:
+    """
+    Compress rows sorted by (date, id). Dates are stored as deltas of their day numbers, mostly 0 or 1.
+    """
+    columns = {name: list(values) for name, values in zip(ARCHIVE_COLUMNS, zip(*rows))}
+    days = [date.toordinal() for date in columns["date"]]
+    columns["date"] = days[:1] + [day - previous for previous, day in zip(days, days[1:])]
+    raw = json.dumps(columns, ensure_ascii=False, separators=(",", ":")).encode()
+    return zlib.compress(raw, ARCHIVE_COMPRESSION_LEVEL)
+
+def decode_columns(data: bytes) -> Dict[str, list]:
+    """
+    Decompress a block into its columns, with dates as day numbers (`datetime.date.toordinal`).
+    """
+    columns = json.loads(zlib.decompress(data))
+    columns["date"] = list(itertools.accumulate(columns["date"]))
+    return columns
+
+def decode_rows(data: bytes) -> List[ArchivedRow]:
+    """
+    Decompress a block into ArchivedRow tuples, oldest first.
+    """
+    columns = decode_columns(data)
+    columns["date"] = list(map(datetime.date.fromordinal, columns["date"]))
+    return [ArchivedRow(*values) for values in zip(*(columns[name] for name in ARCHIVE_COLUMNS))]
+
+def get_blocks(db: Session, user_id: int, start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None) -> List:
+    """
+    Return the metadata (without the data) of a user's blocks holding transactions dated within
+    [start_date, end_date], oldest first. Read paths call this first and skip the archive when it is empty.
+    """
+    blocks_query = db.query(*BLOCK_INFO).filter(TransactionArchive.user_id == user_id)
+    if start_date is not None:
+        blocks_query = blocks_query.filter(TransactionArchive.max_date >= start_date)
+    if end_date is not None:
+        blocks_query = blocks_query.filter(TransactionArchive.min_date <= end_date)
+    return blocks_query.order_by(TransactionArchive.year).all()
+
+def _block_data(db: Session, block_id: int) -> bytes:
+    return db.query(TransactionArchive.data).filter(TransactionArchive.id == block_id).scalar() or b""
+
+def iter_block_columns(db: Session, blocks: Iterable) -> Iterator[Dict[str, list]]:
+    """
+    Yield the decoded columns (see `decode_columns`) of each block, reading one block at a time.
+    """
+    for block in blocks:
+        data = _block_data(db, block.id)
+        if data:
+            yield decode_columns(data)
+
+def iter_archived_rows(db: Session, blocks: List, descending: bool = False) -> Iterator[ArchivedRow]:
+    """
+    Yield the rows of `blocks` (as returned by `get_blocks`) in (date, id) order, newest first if
+    `descending`. Blocks are decompressed one at a time as the iteration reaches them.
+    """
+    for block in (reversed(blocks) if descending else blocks):
+        data = _block_data(db, block.id)
+        rows = decode_rows(data) if data else []
+        yield from (reversed(rows) if descending else rows)
+
+def count_from_stats(
+    block,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    trans_type: Optional[str] = None,
+    category_ids: Optional[Collection[int]] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None
+) -> Optional[int]:
+    """
+    Count the rows of a block (as returned by `get_blocks`) matching the filters from its statistics,
+    or return None if only decompressing the block can tell: when it lies partly outside the date
+    range, or its amount range is partly inside the amount bounds.
+    """
+    if block.type_category_counts is None:
+        return None
+    if (start_date is not None and block.min_date < start_date) or (end_date is not None and block.max_date > end_date):
+        return None
+    if min_amount is not None or max_amount is not None:
+        if block.min_amount is None:
+            return None
+        if (min_amount is not None and block.max_amount < min_amount) or (max_amount is not None and block.min_amount > max_amount):
+            return 0
+        if (min_amount is not None and block.min_amount < min_amount) or (max_amount is not None and block.max_amount > max_amount):
+            return None
+    return sum(
+        count for row_type, category_id, count in block.type_category_counts
+        if (not trans_type or row_type == trans_type) and (category_ids is None or category_id in category_ids)
+    )
+
+def archived_user_ids(db: Session) -> List[int]:
+    return [user_id for (user_id,) in db.query(TransactionArchive.user_id).distinct()]
+
+def count_archived(db: Session, user_id: int) -> int:
+    return db.query(func.sum(TransactionArchive.count)).filter(TransactionArchive.user_id == user_id).scalar() or 0
+
+def _pop_block(db: Session, user_id: int, year: int) -> List[ArchivedRow]:
+    """
+    Delete a block and return its rows. The DELETE ... RETURNING takes the write lock before the data
+    is read, so a block is never rewritten from a copy that a concurrent compaction has replaced.
+    """
+    table = TransactionArchive.__table__
+    data = db.execute(
+        delete(table).where(table.c.user_id == user_id, table.c.year == year).returning(table.c.data)
+    ).scalar()
+    return decode_rows(data) if data else []
+
+def _write_block(db: Session, user_id: int, year: int, rows: List[ArchivedRow]):
+    """
+    Store the rows of a user's year as a new block; nothing is stored for an empty list.
+    """
+    if not rows:
+        return
+    rows = sorted(rows, key=lambda row: (row.date, row.id))
+    ids = [row.id for row in rows]
+    amounts = [row.amount for row in rows]
+    known_amounts = None not in amounts # A missing amount matches no amount bound, so the range cannot answer for it
+    counts = Counter((row.type, row.category_id) for row in rows)
+    db.execute(insert(TransactionArchive.__table__), {
+        "user_id": user_id, "year": year, "count": len(rows),
+        "min_date": rows[0].date, "max_date": rows[-1].date, "min_id": min(ids), "max_id": max(ids),
+        "type_category_counts": [[row_type, category_id, count] for (row_type, category_id), count in counts.items()],
+        "min_amount": min(amounts) if known_amounts else None,
+        "max_amount": max(amounts) if known_amounts else None,
+        "data": encode_block(rows),
+    })
+
+def take_archived_rows(db: Session, user_id: int, transaction_ids: Optional[Iterable[int]] = None, category_id: Optional[int] = None) -> List[ArchivedRow]:
+    """
+    Remove archived transactions from their blocks and return them: those with the given ids, or
+    every transaction of a category. Only blocks that hold one are rewritten. Does not commit.
+    """
+    blocks = get_blocks(db, user_id)
+    if transaction_ids is not None:
+        ids = set(transaction_ids)
+        blocks = [block for block in blocks if any(block.min_id <= i <= block.max_id for i in ids)]
+        wanted = lambda row: row.id in ids
+    else:
+        wanted = lambda row: row.category_id == category_id
+    taken = []
+    for block in blocks:
+        if not any(wanted(row) for row in iter_archived_rows(db, [block])):
+            continue
+        kept = []
+        for row in _pop_block(db, user_id, block.year):
+            (taken if wanted(row) else kept).append(row)
+        _write_block(db, user_id, block.year, kept)
+    return taken
+
+def delete_user_archive(db: Session, user_id: int) -> int:
+    """
+    Remove all of a user's archived transactions. Does not commit. Returns how many there were.
+    """
+    archived = count_archived(db, user_id)
+    db.query(TransactionArchive).filter(TransactionArchive.user_id == user_id).delete(synchronize_session=False)
+    return archived
+
+def ensure_transaction_autoincrement(db: Session):
+    """
+    Rebuild a SQLite transactions table created without AUTOINCREMENT. Without it SQLite gives a new
+    row the largest id in the table plus one, which could be the id of an archived transaction.
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    table_sql = db.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions'")).scalar()
+    if table_sql is None or "AUTOINCREMENT" in table_sql.upper():
+        return
+    table = Transaction.__table__
+    columns = ", ".join(column.name for column in table.columns)
+    db.execute(text("ALTER TABLE transactions RENAME TO transactions_old"))
+    for (index_name,) in db.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'transactions_old' AND sql IS NOT NULL"
+    )).all():
+        db.execute(text(f"DROP INDEX {index_name}"))
+    table.create(db.connection())
+    db.execute(text(f"INSERT INTO transactions ({columns}) SELECT {columns} FROM transactions_old"))
+    db.execute(text("DROP TABLE transactions_old"))
+    db.commit()
+    logging.info("交易資料表已改用 AUTOINCREMENT 編號")
+
+def archive_user_transactions(db: Session, user_id: int, before: datetime.date) -> int:
+    """
+    Move a user's transactions dated before `before` into their year blocks, committing once per year.
+    Transactions named in the change log are left for a later run. Returns the number archived.
+    """
+    table = Transaction.__table__
+    first_date = db.query(func.min(Transaction.date)).filter(Transaction.user_id == user_id, Transaction.date < before).scalar()
+    if first_date is None:
+        return 0
+    logged = select(TransactionChange.transaction_id).where(
+        TransactionChange.user_id == user_id,
+        TransactionChange.transaction_id != None
+    )
+    archived = 0
+    for year in range(first_date.year, before.year + 1):
+        year_end = min(before, datetime.date(year + 1, 1, 1))
+        # Rows are read by the DELETE itself, so an edit committed meanwhile is never archived in its old form
+        moved = [ArchivedRow(*row) for row in db.execute(delete(table).where(
+            table.c.user_id == user_id,
+            table.c.date >= datetime.date(year, 1, 1),
+            table.c.date < year_end,
+            table.c.id.not_in(logged)
+        ).returning(*(table.c[name] for name in ARCHIVE_COLUMNS)))]
+        if not moved:
+            db.rollback()
+            continue
+        _write_block(db, user_id, year, _pop_block(db, user_id, year) + moved)
+        search.unindex_transactions(db, [row.id for row in moved])
+        db.commit()
+        archived += len(moved)
+    return archived
+
+def compact_archive(db: Session, archive_after_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    """
+    Archive every user's transactions older than `archive_after_days` days and report the archive size.
+    """
+    ensure_transaction_autoincrement(db)
+    for user_id, year in db.query(TransactionArchive.user_id, TransactionArchive.year).filter(
+        TransactionArchive.type_category_counts == None
+    ).all():
+        # Blocks written before they kept statistics
+        _write_block(db, user_id, year, _pop_block(db, user_id, year))
+        db.commit()
+    before = datetime.date.today() - datetime.timedelta(days=archive_after_days)
+    user_ids = [user_id for (user_id,) in db.query(Transaction.user_id).filter(Transaction.date < before).distinct()]
+    archived = 0
+    for user_id in user_ids:
+        archived += archive_user_transactions(db, user_id, before)
+    blocks, rows, size = db.query(
+        func.count(TransactionArchive.id), func.sum(TransactionArchive.count), func.sum(func.length(TransactionArchive.data))
+    ).one()
+    result = {"before": before.isoformat(), "users": len(user_ids), "archived": archived, "blocks": blocks, "archived_total": rows or 0, "archive_bytes": size or 0}
+    logging.info(f"冷資料封存完成: {result}")
+    return result
+
+if __name__ == "__main__":
+    # Usage: python -m app.crud.archive compact [archive_after_days]
+    from app.models.database import SessionLocal, create_schema, data_shards
+
+    if not sys.argv[1:] or sys.argv[1] != "compact":
+        print("Usage: python -m app.crud.archive compact [archive_after_days]")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    create_schema()
+    for shard in data_shards():
+        db = SessionLocal(info={"shard": shard})
+        try:
+            compact_archive(db, int(sys.argv[2]) if len(sys.argv) > 2 else ARCHIVE_AFTER_DAYS)
+        finally:
+            db.close()
@@ -0,0 +1,177 @@
+import os
+import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+
+from app.models.models import Budget, Category, TransactionRollup
+from app.schemas.schemas import BudgetCreate
+
+# Monthly budgets per expense category. A budget keeps no counter of its own: the amount spent in a
+# month is the category's expense month bucket in `transaction_rollups`, which every ledger mutation
+# in app/crud/crud.py (single writes, batches, importers, category moves) already adjusts by its delta
+# in the same DB transaction. `apply_rollup_deltas` reads back the new totals of budgeted buckets
+# from its upsert, so telling whether a write crossed a budget threshold needs no aggregate query.
+# The crossings of a write are collected in the session and handed to its response by the write
+# function through `pop_budget_alerts`.
+BUDGET_WARN_PERCENT = float(os.getenv("BUDGET_WARN_PERCENT", "80"))
+BUDGET_ALERTS = "budget_alerts" # Session info key collecting the crossings of the current write
+
+def get_budgets_by_category(db: Session, user_id: int) -> Dict[int, Tuple]:
+    """
+    Return {category_id: (budget id, category name, amount, warn_percent)} for a user's budgets.
+    """
+    return {
+        row.category_id: (row.id, row.name, row.amount, row.warn_percent)
+        for row in db.query(Budget.id, Budget.category_id, Budget.amount, Budget.warn_percent, Category.name).join(
+            Category, Category.id == Budget.category_id
+        ).filter(Budget.user_id == user_id)
+    }
+
+def _alert(budget: Tuple, month: datetime.date, spent: float, level: str) -> Dict:
+    budget_id, category, amount, _ = budget
+    spent = float(spent)
+    return {
+        "budget_id": budget_id,
+        "category": category,
+        "month": month.strftime("%Y-%m"),
+        "level": level,
+        "amount": amount,
+        "spent": round(spent, 2),
+        "percent": round(spent / amount * 100, 1) if amount else None,
+    }
+
+def record_budget_crossings(db: Session, budgets: Dict[int, Tuple], totals: Dict[Tuple[int, datetime.date], Tuple[float, float]]):
+    """
+    Add an alert to the session for every budget whose month total moved from below to at or above
+    its warning level or its limit. `totals` maps (category_id, month) to (total before, total after).
+    Only the highest level crossed by one change is reported.
+    """
+    alerts = []
+    for (category_id, month), (before, after) in totals.items():
+        budget = budgets.get(category_id)
+        if budget is None or after <= before:
+            continue
+        amount, warn_percent = budget[2], budget[3]
+        for level, threshold in (("exceeded", amount), ("warning", amount * warn_percent / 100)):
+            if before < threshold <= after:
+                alerts.append(_alert(budget, month, after, level))
+                break
+    if alerts:
+        db.info.setdefault(BUDGET_ALERTS, []).extend(alerts)
+
+def pop_budget_alerts(db: Session) -> List[Dict]:
+    """
+    Return and clear the budget alerts collected in the session since the last call.
+    """
+    return db.info.pop(BUDGET_ALERTS, [])
+
+def _budget_status(budget: Budget, category: str, spent: float) -> Dict:
+    percent = round(spent / budget.amount * 100, 1) if budget.amount else None
+    if spent >= budget.amount:
+        level = "exceeded"
+    elif spent >= budget.amount * budget.warn_percent / 100:
+        level = "warning"
+    else:
+        level = "ok"
+    return {
+        "id": budget.id,
+        "category": category,
+        "amount": budget.amount,
+        "warn_percent": budget.warn_percent,
+        "spent": round(spent, 2),
+        "remaining": round(budget.amount - spent, 2),
+        "percent": percent,
+        "level": level,
+    }
+
+def get_budgets(db: Session, user_id: int, month: datetime.date, budget_id: Optional[int] = None) -> List[Dict]:
+    """
+    Return a user's budgets with the amount spent in the month starting at `month`, read from the
+    month rollup buckets in one indexed lookup.
+    """
+    budget_query = db.query(Budget, Category.name).join(Category, Category.id == Budget.category_id).filter(Budget.user_id == user_id)
+    if budget_id is not None:
+        budget_query = budget_query.filter(Budget.id == budget_id)
+    budgets = budget_query.order_by(Category.name).all()
+    if not budgets:
+        return []
+    spent = dict(db.query(TransactionRollup.category_id, TransactionRollup.total).filter(
+        TransactionRollup.user_id == user_id,
+        TransactionRollup.period == "month",
+        TransactionRollup.bucket == month,
+        TransactionRollup.type == "expense",
+        TransactionRollup.category_id.in_([budget.category_id for budget, _ in budgets])
+    ))
+    return [_budget_status(budget, name, spent.get(budget.category_id, 0.0)) for budget, name in budgets]
+
+def _budget_category_id(db: Session, user_id: int, name: str, budget_id: Optional[int] = None) -> int:
+    """
+    Return the id of the expense category with this name that the user's transactions reference
+    (a system category wins over a custom one, as in `resolve_category_ids`).
+    Raises 404 if there is none and 400 if another budget already covers it.
+    """
+    categories = db.query(Category.id, Category.user_id).filter(
+        Category.name == name,
+        Category.type == "expense",
+        or_(Category.user_id == user_id, Category.user_id == None)
+    ).all()
+    if not categories:
+        raise HTTPException(status_code=404, detail="Expense category not found")
+    category_id = min(categories, key=lambda row: (row.user_id is not None, row.id)).id
+    duplicate_query = db.query(Budget.id).filter(Budget.user_id == user_id, Budget.category_id == category_id)
+    if budget_id is not None:
+        duplicate_query = duplicate_query.filter(Budget.id != budget_id)
+    if duplicate_query.first():
+        raise HTTPException(status_code=400, detail="A budget for this category already exists")
+    return category_id
+
+def create_budget(db: Session, budget: BudgetCreate, user_id: int, month: datetime.date) -> Dict:
+    """
+    Create a budget on an expense category and return its status for `month`.
+    """
+    category_id = _budget_category_id(db, user_id, budget.category)
+    warn_percent = BUDGET_WARN_PERCENT if budget.warn_percent is None else budget.warn_percent
+    db_budget = Budget(user_id=user_id, category_id=category_id, amount=budget.amount, warn_percent=warn_percent)
+    db.add(db_budget)
+    db.commit()
+    return get_budgets(db, user_id, month, db_budget.id)[0]
+
+def update_budget(db: Session, budget_id: int, budget: BudgetCreate, user_id: int, month: datetime.date) -> Optional[Dict]:
+    """
+    Change the category, amount or warning level of a budget and return its status for `month`,
+    or None if the user has no such budget.
+    """
+    db_budget = db.query(Budget).filter(Budget.id == budget_id, Budget.user_id == user_id).first()
+    if db_budget is None:
+        return None
+    db_budget.category_id = _budget_category_id(db, user_id, budget.category, budget_id)
+    db_budget.amount = budget.amount
+    if budget.warn_percent is not None:
+        db_budget.warn_percent = budget.warn_percent
+    db.commit()
+    return get_budgets(db, user_id, month, budget_id)[0]
+
+def delete_budget(db: Session, budget_id: int, user_id: int, month: datetime.date) -> Optional[Dict]:
+    """
+    Delete a budget and return its last status for `month`, or None if the user has no such budget.
+    """
+    deleted = get_budgets(db, user_id, month, budget_id)
+    if not deleted:
+        return None
+    db.query(Budget).filter(Budget.id == budget_id, Budget.user_id == user_id).delete(synchronize_session=False)
+    db.commit()
+    return deleted[0]
+
+def delete_category_budgets(db: Session, user_id: int, category_id: int):
+    """
+    Remove the budget of a category that is being deleted or stops being an expense category. Does not commit.
+    """
+    db.query(Budget).filter(Budget.user_id == user_id, Budget.category_id == category_id).delete(synchronize_session=False)
+
+def delete_user_budgets(db: Session, user_id: int):
+    """
+    Remove all of a user's budgets. Does not commit.
+    """
+    db.query(Budget).filter(Budget.user_id == user_id).delete(synchronize_session=False)
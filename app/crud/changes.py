@@ -0,0 +1,160 @@
+import os
+import sys
+import logging
+import datetime
+from typing import Iterable, List, Optional
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app.models.models import Transaction, Category, TransactionChange, ChangeLogHorizon
+
+# Per-user transaction change log for delta sync. Every mutation in app/crud/crud.py appends
+# "upsert" or "delete" entries; clients pass the last version they saw to /api/transactions/changes
+# and receive only what changed since. Compaction keeps the log small: superseded entries are
+# always safe to drop, and entries older than the retention window are dropped behind a horizon
+# that tells clients which versions can no longer be served incrementally.
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+CHANGE_LOG_BATCH_SIZE = 1000
+
+def log_changes(db: Session, user_id: int, upserted_ids: Iterable[int] = (), deleted_ids: Iterable[int] = ()):
+    """
+    Append change entries for transactions that were created/updated or deleted.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    upserted_ids = list(upserted_ids)
+    upserted = set(upserted_ids)
+    rows = [{"user_id": user_id, "transaction_id": i, "op": "delete", "created_at": now} for i in deleted_ids if i not in upserted]
+    rows += [{"user_id": user_id, "transaction_id": i, "op": "upsert", "created_at": now} for i in upserted_ids]
+    for start in range(0, len(rows), CHANGE_LOG_BATCH_SIZE):
+        db.execute(insert(TransactionChange.__table__), rows[start:start + CHANGE_LOG_BATCH_SIZE])
+
+def force_resync(db: Session, user_id: int):
+    """
+    Make every client of a user reload the full ledger, for changes that alter how many transactions
+    look without touching their rows (such as renaming a category). Appends a "resync" entry and moves
+    the horizon up to it, so any version handed out before is behind the horizon.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    version = db.execute(
+        insert(TransactionChange).returning(TransactionChange.id),
+        {"user_id": user_id, "transaction_id": None, "op": "resync", "created_at": now}
+    ).scalar_one()
+    db.merge(ChangeLogHorizon(user_id=user_id, version=version))
+
+def get_current_version(db: Session, user_id: int) -> int:
+    """
+    Return the newest change version of a user (0 if nothing was ever logged).
+    """
+    version = db.query(func.max(TransactionChange.id)).filter(TransactionChange.user_id == user_id).scalar()
+    if version is None:
+        version = db.query(ChangeLogHorizon.version).filter(ChangeLogHorizon.user_id == user_id).scalar()
+    return version or 0
+
+def get_changes_since(db: Session, user_id: int, since: int, limit: int = 1000):
+    """
+    Return the transactions upserted (as row tuples, like the transaction list) and deleted after
+    version `since`, oldest change first.
+    Sets `reset` when the client must reload everything: `since` is older than the compaction horizon,
+    or newer than any version this database has handed out.
+    """
+    horizon = db.query(ChangeLogHorizon.version).filter(ChangeLogHorizon.user_id == user_id).scalar() or 0
+    current = get_current_version(db, user_id)
+    if since < horizon or since > current:
+        return {"version": current, "reset": True, "has_more": False, "upserts": [], "deletes": []}
+
+    entries = db.query(TransactionChange.id, TransactionChange.transaction_id, TransactionChange.op).filter(
+        TransactionChange.user_id == user_id,
+        TransactionChange.id > since
+    ).order_by(TransactionChange.id).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest_op = {}
+    for entry in entries:
+        latest_op[entry.transaction_id] = entry.op
+    upsert_ids = [i for i, op in latest_op.items() if op == "upsert"]
+    upserts = []
+    for start in range(0, len(upsert_ids), CHANGE_LOG_BATCH_SIZE):
+        upserts += db.query(
+            Transaction.id, Transaction.type, Transaction.description, Transaction.amount,
+            Category.name.label("category"), Transaction.date
+        ).outerjoin(Category, Category.id == Transaction.category_id).filter(
+            Transaction.user_id == user_id,
+            Transaction.id.in_(upsert_ids[start:start + CHANGE_LOG_BATCH_SIZE])
+        ).all()
+    return {
+        "version": entries[-1].id if entries else current,
+        "reset": False,
+        "has_more": has_more,
+        "upserts": upserts,
+        "deletes": [i for i, op in latest_op.items() if op == "delete"],
+    }
+
+def get_changed_ids(db: Session, user_id: int, since: int, limit: int) -> Optional[List[int]]:
+    """
+    Return the ids of transactions upserted or deleted after version `since`, for caches that patch
+    themselves from the log. Returns None when the log cannot answer (as for `reset` above) or more
+    than `limit` transactions changed.
+    """
+    horizon = db.query(ChangeLogHorizon.version).filter(ChangeLogHorizon.user_id == user_id).scalar() or 0
+    if since < horizon or since > get_current_version(db, user_id):
+        return None
+    ids = [row[0] for row in db.query(TransactionChange.transaction_id).filter(
+        TransactionChange.user_id == user_id,
+        TransactionChange.id > since,
+        TransactionChange.transaction_id != None
+    ).distinct().limit(limit + 1)]
+    return None if len(ids) > limit else ids
+
+def delete_user_changes(db: Session, user_id: int):
+    """
+    Remove a user's change log and horizon.
+    """
+    db.query(TransactionChange).filter(TransactionChange.user_id == user_id).delete(synchronize_session=False)
+    db.query(ChangeLogHorizon).filter(ChangeLogHorizon.user_id == user_id).delete(synchronize_session=False)
+
+def compact_change_log(db: Session, retention_days: int = CHANGE_LOG_RETENTION_DAYS) -> dict:
+    """
+    Drop change entries that are superseded by a newer entry for the same transaction,
+    then drop everything older than the retention window and advance each user's horizon.
+    """
+    newest_per_transaction = db.query(func.max(TransactionChange.id)).group_by(
+        TransactionChange.user_id, TransactionChange.transaction_id
+    )
+    superseded = db.query(TransactionChange).filter(
+        TransactionChange.id.not_in(newest_per_transaction)
+    ).delete(synchronize_session=False)
+
+    cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(days=retention_days)
+    expired_versions = db.query(TransactionChange.user_id, func.max(TransactionChange.id)).filter(
+        TransactionChange.created_at < cutoff
+    ).group_by(TransactionChange.user_id).all()
+    for user_id, version in expired_versions:
+        horizon = db.get(ChangeLogHorizon, user_id)
+        if horizon is None:
+            db.add(ChangeLogHorizon(user_id=user_id, version=version))
+        elif horizon.version < version:
+            horizon.version = version
+    expired = db.query(TransactionChange).filter(
+        TransactionChange.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    result = {"superseded": superseded, "expired": expired}
+    logging.info(f"交易變更紀錄已壓縮: {result}")
+    return result
+
+if __name__ == "__main__":
+    # Usage: python -m app.crud.changes compact [retention_days]
+    from app.models.database import SessionLocal, create_schema, data_shards
+
+    if not sys.argv[1:] or sys.argv[1] != "compact":
+        print("Usage: python -m app.crud.changes compact [retention_days]")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    create_schema()
+    for shard in data_shards():
+        db = SessionLocal(info={"shard": shard})
+        try:
+            compact_change_log(db, int(sys.argv[2]) if len(sys.argv) > 2 else CHANGE_LOG_RETENTION_DAYS)
+        finally:
+            db.close()
@@ -1,13 +1,29 @@
 import datetime
 import io
 import csv
-from typing import List, Dict, Optional
+import base64
+import gzip
+import json
+import time
+import heapq
+import hashlib
+import logging
+from collections import defaultdict, namedtuple
+from itertools import chain, islice
+from typing import Callable, List, Dict, Optional, Iterable, Tuple
+from sqlalchemy import func, and_, or_, insert, update, inspect, text
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects import sqlite, postgresql
 from fastapi import HTTPException, status
 
-from app.models.models import User, Transaction, Category
-from app.schemas.schemas import UserCreate, TransactionCreate, CategoryCreate, TransactionImport
+from app.models.models import User, Transaction, Category, TransactionRollup, UserShard
+from app.schemas.schemas import (
+    UserCreate, TransactionCreate, CategoryCreate, TransactionImport, TransactionOperation, UserDataImport
+)
 from app.core.security import get_password_hash
+from app.core.cache import invalidate_principal, category_cache, invalidate_categories, shard_map_cache, invalidate_analytics
+from app.models.writer import after_commit
+from app.crud import search, changes, budgets, archive
 
 # --- User CRUD Operations ---
 def get_user_by_username(db: Session, username: str):
@@ -16,127 +32,1020 @@ def get_user_by_username(db: Session, username: str):
     """
     return db.query(User).filter(User.username == username).first()
 
-def create_user(db: Session, user: UserCreate):
+def create_user(db: Session, user: UserCreate, hashed_password: Optional[str] = None):
     """
-    Create a new user.
+    Create a new user. Pass `hashed_password` if the password was already hashed elsewhere.
     """
-    hashed_password = get_password_hash(user.password)
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     db_user = User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
+def update_user_password_hash(db: Session, user_id: int, hashed_password: str):
+    """
+    Replace a user's stored password hash, e.g. after a work-factor upgrade.
+    """
+    db.query(User).filter(User.id == user_id).update({User.hashed_password: hashed_password})
+    db.commit()
+
+def delete_user_data(db: Session, user_id: int):
+    """
+    Delete all of a user's transactions (archived ones included), categories and derived data, but not
+    the account itself. Does not commit.
+    """
+    search.unindex_user(db, user_id)
+    db.query(Transaction).filter(Transaction.user_id == user_id).delete()
+    archive.delete_user_archive(db, user_id)
+    db.query(Category).filter(Category.user_id == user_id).delete()
+    db.query(TransactionRollup).filter(TransactionRollup.user_id == user_id).delete()
+    changes.delete_user_changes(db, user_id)
+    budgets.delete_user_budgets(db, user_id)
+    after_commit(db, invalidate_analytics, user_id)
+
+def delete_user_and_data(db: Session, user_id: int):
+    """
+    Delete a user account together with all of its transactions, categories and derived data.
+    """
+    try:
+        delete_user_data(db, user_id)
+        db.query(UserShard).filter(UserShard.user_id == user_id).delete()
+        db.query(User).filter(User.id == user_id).delete()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    after_commit(db, invalidate_principal, user_id)
+    after_commit(db, invalidate_categories, user_id)
+    after_commit(db, shard_map_cache.delete, user_id)
+
+def iter_user_data_export(db: Session, user, export_format: str = "json", chunk_size: Optional[int] = None, on_rows: Optional[Callable[[int], None]] = None):
+    """
+    Yield a user's full data export (transactions and custom categories) piece by piece.
+    `user` is any object with `id` and `username`, such as the request's principal.
+    "json" yields the same document as UserDataExport; "ndjson" yields one record per line: a "user"
+    header, then the "category" records, then the "transaction" records. Transactions are read in
+    index-ordered chunks and serialized straight from the row tuples, so memory stays flat.
+    `on_rows`, if given, is called with the number of transactions in each chunk before it is yielded.
+    """
+    categories = [
+        {"name": cat.name, "type": cat.type, "id": cat.id}
+        for cat in db.query(Category.id, Category.name, Category.type).filter(Category.user_id == user.id).order_by(Category.id)
+    ]
+    chunks = _iter_transaction_chunks(db, user.id, chunk_size or EXPORT_CHUNK_SIZE)
+    dumps = lambda record: json.dumps(record, ensure_ascii=False)
+
+    if export_format == "ndjson":
+        lines = [dumps({"kind": "user", "username": user.username})]
+        lines += [dumps({"kind": "category", **category}) for category in categories]
+        yield "\n".join(lines) + "\n"
+        for rows in chunks:
+            if on_rows is not None:
+                on_rows(len(rows))
+            yield "".join(dumps({"kind": "transaction", **transaction_record(row)}) + "\n" for row in rows)
+        return
+
+    yield '{"username": ' + dumps(user.username) + ', "transactions": ['
+    separator = ""
+    for rows in chunks:
+        if on_rows is not None:
+            on_rows(len(rows))
+        yield separator + ", ".join(dumps(transaction_record(row)) for row in rows)
+        separator = ", "
+    yield '], "custom_categories": ' + dumps(categories) + "}"
+
+def _import_custom_categories(db: Session, user_id: int, categories: Iterable[CategoryCreate]) -> int:
+    """
+    Add the custom categories a user does not have yet with one query and one bulk insert.
+    Does not commit. Returns the number of categories added.
+    """
+    existing_categories = {
+        (cat.type, cat.name) for cat in db.query(Category.type, Category.name).filter(Category.user_id == user_id)
+    }
+    new_categories = []
+    for category_data in categories:
+        key = (category_data.type, category_data.name)
+        if key not in existing_categories:
+            existing_categories.add(key)
+            new_categories.append({"name": category_data.name, "type": category_data.type, "user_id": user_id})
+    if new_categories:
+        db.execute(insert(Category), new_categories)
+    return len(new_categories)
+
+def backup_transaction_rows(db: Session, user_id: int, transactions: List[TransactionCreate], seen: Dict[str, int]) -> List[Dict]:
+    """
+    Turn one batch of backup transactions into transaction dicts with category ids and content keys.
+    The n-th copy of identical transactions in the backup (counted in `seen` across batches) gets
+    sequence n, so a copy is only skipped when the ledger already holds at least that many.
+    """
+    category_ids = resolve_category_ids(db, user_id, {(t.type, t.category) for t in transactions})
+    rows = []
+    for transaction_data in transactions:
+        row = {
+            "type": transaction_data.type,
+            "description": transaction_data.description,
+            "amount": transaction_data.amount,
+            "category_id": category_ids[(transaction_data.type, transaction_data.category)],
+            "date": transaction_data.date,
+            "user_id": user_id
+        }
+        row["content_hash"] = transaction_content_hash(row)
+        row["content_seq"] = seen[row["content_hash"]]
+        seen[row["content_hash"]] += 1
+        rows.append(row)
+    return rows
+
+def _import_backup_transactions(db: Session, user_id: int, transactions: List[TransactionCreate], seen: Dict[str, int]) -> Tuple[int, int]:
+    """
+    Bulk insert one batch of backup transactions, skipping those already in the ledger, and commit.
+    Returns (imported, skipped).
+    """
+    rows = backup_transaction_rows(db, user_id, transactions, seen)
+    existing = _existing_content_keys(db, user_id, {row["content_hash"] for row in rows}, dates={row["date"] for row in rows})
+    new_rows = [row for row in rows if row["content_seq"] not in existing.get(row["content_hash"], ())]
+    imported = _insert_transaction_rows(db, new_rows, user_id) if new_rows else 0
+    db.commit()
+    return imported, len(rows) - len(new_rows)
+
+def import_user_data_records(db: Session, user_data: UserDataImport, user_id: int) -> Dict:
+    """
+    Import custom categories and transactions from a full data export.
+    Categories are resolved with set-based queries and transactions are bulk inserted in batches.
+    Transactions already in the ledger (same content hash and sequence) are skipped, so importing
+    the same backup twice is a no-op.
+    """
+    try:
+        imported_count = {"transactions": 0, "categories": 0, "skipped_transactions": 0}
+        imported_count["categories"] = _import_custom_categories(db, user_id, user_data.custom_categories)
+        seen = defaultdict(int)
+        for start in range(0, len(user_data.transactions), IMPORT_BATCH_SIZE):
+            imported, skipped = _import_backup_transactions(db, user_id, user_data.transactions[start:start + IMPORT_BATCH_SIZE], seen)
+            imported_count["transactions"] += imported
+            imported_count["skipped_transactions"] += skipped
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        after_commit(db, invalidate_categories, user_id)
+    imported_count["budget_alerts"] = budgets.pop_budget_alerts(db)
+    return imported_count
+
+def open_export_file(file_content):
+    """
+    Return a text stream over a data export given as bytes or a binary file object, gunzipping it if needed.
+    Detach the returned stream when done to leave the underlying file open.
+    """
+    stream = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+    compressed = stream.read(2) == b"\x1f\x8b"
+    stream.seek(0)
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+def iter_export_batches(text_stream, batch_size: int, report_error):
+    """
+    Parse the NDJSON form of `iter_user_data_export` into batches.
+    Yields (line, categories, transactions) whenever `batch_size` transactions have been read and once at
+    the end, where `line` is the last line read. Malformed lines are passed to `report_error(line, message)`.
+    """
+    categories = []
+    batch = []
+    line_number = 0
+    for line_number, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Expected a JSON object")
+            kind = record.pop("kind", None)
+            if kind == "transaction":
+                batch.append(TransactionCreate.model_validate(record))
+            elif kind == "category":
+                categories.append(CategoryCreate.model_validate(record))
+            elif kind != "user":
+                raise ValueError(f"Unknown record kind: {kind}")
+        except ValueError as e:
+            report_error(line_number, str(e))
+            continue
+        if len(batch) >= batch_size:
+            yield line_number, categories, batch
+            categories, batch = [], []
+    if categories or batch:
+        yield line_number, categories, batch
+
+def import_export_batch(db: Session, user_id: int, categories: List[CategoryCreate], transactions: List[TransactionCreate], seen: Dict[str, int], stats: Dict):
+    """
+    Import one batch from `iter_export_batches`, add its counts to `stats` and commit.
+    """
+    if categories:
+        stats["categories"] += _import_custom_categories(db, user_id, categories)
+    if transactions:
+        imported, skipped = _import_backup_transactions(db, user_id, transactions, seen)
+        stats["transactions"] += imported
+        stats["skipped_transactions"] += skipped
+    db.commit()
+
+def import_user_data_ndjson(db: Session, file_content, user_id: int, batch_size: Optional[int] = None) -> Dict:
+    """
+    Import a full data export in the NDJSON form of `iter_user_data_export`, optionally gzip-compressed.
+    `file_content` may be bytes or a binary file object; it is read line by line and applied in
+    batches like `import_user_data_records`. Malformed lines are skipped and reported.
+    """
+    text_stream = open_export_file(file_content)
+    stats = {"transactions": 0, "categories": 0, "skipped_transactions": 0, "failed": 0, "errors": []}
+
+    def report_error(line_number, message):
+        stats["failed"] += 1
+        if len(stats["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            stats["errors"].append({"line": line_number, "error": message})
+
+    seen = defaultdict(int)
+    try:
+        for _, categories, batch in iter_export_batches(text_stream, batch_size or IMPORT_BATCH_SIZE, report_error):
+            import_export_batch(db, user_id, categories, batch, seen, stats)
+    except (UnicodeDecodeError, OSError, EOFError) as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Invalid export file after {stats['transactions']} transactions: {e}")
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to import data after {stats['transactions']} transactions: {e}")
+    finally:
+        text_stream.detach()
+        after_commit(db, invalidate_categories, user_id)
+    stats["budget_alerts"] = budgets.pop_budget_alerts(db)
+    return stats
+
 # --- Transaction CRUD Operations ---
-def get_transactions(db: Session, user_id: int, skip: int = 0, limit: int = 100, query: Optional[str] = None):
+def query_transaction_rows(db: Session):
     """
-    Retrieve transactions for a specific user, with optional pagination and query.
+    Return a query for transactions as plain row tuples (id, type, description, amount, category, date),
+    with the category name joined in. Reading tuples skips ORM object hydration for list endpoints.
     """
-    transactions_query = db.query(Transaction).filter(Transaction.user_id == user_id)
+    return db.query(
+        Transaction.id, Transaction.type, Transaction.description, Transaction.amount,
+        Category.name.label("category"), Transaction.date
+    ).outerjoin(Category, Category.id == Transaction.category_id)
+
+# Archived transactions in the shape of the rows of `query_transaction_rows`
+TransactionRow = namedtuple("TransactionRow", ["id", "type", "description", "amount", "category", "date"])
+
+def _position(row) -> Tuple[datetime.date, int]:
+    return (row.date, row.id)
+
+def transaction_record(row) -> Dict:
+    """
+    Return the TransactionModel fields of a transaction row as a JSON-ready dict.
+    Rows come from our own tables, so they are not validated again.
+    """
+    return {
+        "type": row.type, "description": row.description, "amount": row.amount,
+        "category": row.category, "date": row.date.isoformat(), "id": row.id
+    }
+
+def encode_cursor(transaction) -> str:
+    """
+    Encode the (date, id) position of a transaction as an opaque pagination cursor.
+    """
+    raw = f"{transaction.date.isoformat()}|{transaction.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime.date, int]:
+    """
+    Decode a pagination cursor produced by `encode_cursor`.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date_str, id_str = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.date.fromisoformat(date_str), int(id_str)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def transaction_filter_conditions(
+    db: Session,
+    user_id: int,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    trans_type: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None
+) -> List:
+    """
+    Return the WHERE conditions of the transaction list filters. Categories are given by name and
+    match the user's and the system categories of that name (of `trans_type` if given).
+    Date and type filters seek on the (user_id, type, date, id) index, category filters on
+    (user_id, category_id, date, id); amount bounds are checked on the rows those return.
+    """
+    conditions = []
+    if start_date is not None:
+        conditions.append(Transaction.date >= start_date)
+    if end_date is not None:
+        conditions.append(Transaction.date <= end_date)
+    if trans_type:
+        conditions.append(Transaction.type == trans_type)
+    if categories:
+        conditions.append(Transaction.category_id.in_(_filter_category_ids(db, user_id, categories, trans_type)))
+    if min_amount is not None:
+        conditions.append(Transaction.amount >= min_amount)
+    if max_amount is not None:
+        conditions.append(Transaction.amount <= max_amount)
+    return conditions
+
+def _filter_category_ids(db: Session, user_id: int, categories: List[str], trans_type: Optional[str] = None) -> List[int]:
+    """
+    Return the ids of the user's and the system categories with these names (of `trans_type` if given).
+    """
+    category_query = db.query(Category.id).filter(
+        or_(Category.user_id == None, Category.user_id == user_id),
+        Category.name.in_(categories)
+    )
+    if trans_type:
+        category_query = category_query.filter(Category.type == trans_type)
+    return [row.id for row in category_query]
+
+def _filter_transactions(db: Session, transactions_query, user_id: int, query: Optional[str], conditions: List, ranked: bool = False):
+    """
+    Restrict a query over transactions (joined with their category) to a user's rows matching the
+    filter conditions and the search query. Returns the query and, if `ranked` and the full-text index
+    is used, the match subquery carrying the relevance score. Unranked searches filter on the matching
+    ids, so the MATCH runs once instead of once per candidate row.
+    """
+    transactions_query = transactions_query.filter(Transaction.user_id == user_id, *conditions)
+    match_query = build_search_query(db, query, user_id) if query else None
+    if match_query and ranked:
+        matches = search.match_subquery(user_id, match_query)
+        return transactions_query.join(matches, matches.c.id == Transaction.id), matches
+    if match_query:
+        return transactions_query.filter(Transaction.id.in_(search.match_ids(user_id, match_query))), None
     if query:
         transactions_query = transactions_query.filter(
             (Transaction.description.contains(query)) |
-            (Transaction.category.contains(query))
+            (Category.name.contains(query))
+        )
+    return transactions_query, None
+
+def _category_names(db: Session, user_id: int) -> Dict[int, str]:
+    """
+    Return {category id: name} for the user's and the system categories.
+    """
+    return {
+        cat.id: cat.name for cat in db.query(Category.id, Category.name).filter(
+            or_(Category.user_id == None, Category.user_id == user_id)
         )
-    return transactions_query.offset(skip).limit(limit).all()
+    }
+
+def _archived_text_filter(db: Session, query: str, category_names: Dict[int, str]) -> Callable:
+    """
+    Return a predicate on archived rows for a search query, with the rules of the full-text index when
+    it is in use and the substring match of the LIKE fallback otherwise.
+    """
+    if search.search_enabled(db):
+        matches = search.text_matcher(query, category_names.items())
+        if matches is not None:
+            return lambda row: matches(row.description, row.category_id)
+    needle = query.casefold()
+    return lambda row: needle in (row.description or "").casefold() or needle in (category_names.get(row.category_id) or "").casefold()
+
+def _iter_archived_transactions(
+    db: Session,
+    user_id: int,
+    blocks: List,
+    query: Optional[str] = None,
+    descending: bool = False,
+    before: Optional[Tuple[datetime.date, int]] = None,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    trans_type: Optional[str] = None,
+    categories: Optional[List[str]] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None
+):
+    """
+    Yield the archived transactions in `blocks` (see `archive.get_blocks`) that match the filters of
+    `transaction_filter_conditions` and the search query, as TransactionRow tuples in (date, id) order,
+    newest first if `descending`. `before` is a cursor position: only rows older than it are yielded.
+    """
+    category_names = _category_names(db, user_id)
+    category_ids = set(_filter_category_ids(db, user_id, categories, trans_type)) if categories else None
+    matches = _archived_text_filter(db, query, category_names) if query else None
+    for row in archive.iter_archived_rows(db, blocks, descending):
+        if start_date is not None and row.date < start_date:
+            if descending:
+                break
+            continue
+        if end_date is not None and row.date > end_date:
+            if not descending:
+                break
+            continue
+        if before is not None and _position(row) >= before:
+            continue
+        if trans_type and row.type != trans_type:
+            continue
+        if category_ids is not None and row.category_id not in category_ids:
+            continue
+        if min_amount is not None and (row.amount is None or row.amount < min_amount):
+            continue
+        if max_amount is not None and (row.amount is None or row.amount > max_amount):
+            continue
+        if matches is not None and not matches(row):
+            continue
+        yield TransactionRow(row.id, row.type, row.description, row.amount, category_names.get(row.category_id), row.date)
+
+def get_transactions(db: Session, user_id: int, skip: int = 0, limit: int = 100, query: Optional[str] = None, cursor: Optional[str] = None, sort: str = "date", **filters):
+    """
+    Retrieve transactions for a specific user as row tuples (see `query_transaction_rows`), newest first,
+    with optional pagination, filters (see `transaction_filter_conditions`) and query. Pass the cursor of
+    the last row of a page to get the next page; this seeks on the (user_id, date, id) index so every page
+    costs the same. `skip` is kept for older clients.
+    The query is answered from the full-text index when available; with sort="relevance"
+    the best matches come first and pagination is by `skip` only.
+    Archived transactions are merged in only when archive blocks overlap the requested range and the
+    hot rows do not fill the page by themselves; with sort="relevance" they rank after the indexed matches.
+    """
+    conditions = transaction_filter_conditions(db, user_id, **filters)
+    transactions_query, matches = _filter_transactions(db, query_transaction_rows(db), user_id, query, conditions, ranked=sort == "relevance")
+    position = decode_cursor(cursor) if cursor else None
+    end_date = filters.get("end_date")
+    if position is not None and (end_date is None or position[0] < end_date):
+        end_date = position[0]
+    blocks = archive.get_blocks(db, user_id, filters.get("start_date"), end_date)
+
+    if matches is not None:
+        rows = transactions_query.order_by(
+            matches.c.score, Transaction.date.desc(), Transaction.id.desc()
+        ).offset(skip).limit(limit).all()
+        if len(rows) == limit or not blocks:
+            return rows
+        indexed = skip + len(rows) if rows or not skip else transactions_query.count()
+        archived = _iter_archived_transactions(db, user_id, blocks, query, descending=True, **filters)
+        archived_skip = max(skip - indexed, 0)
+        return rows + list(islice(archived, archived_skip, archived_skip + limit - len(rows)))
+    if position is not None:
+        cursor_date, cursor_id = position
+        transactions_query = transactions_query.filter(or_(
+            Transaction.date < cursor_date,
+            and_(Transaction.date == cursor_date, Transaction.id < cursor_id)
+        ))
+    transactions_query = transactions_query.order_by(Transaction.date.desc(), Transaction.id.desc())
+    if not blocks:
+        if skip and not cursor:
+            transactions_query = transactions_query.offset(skip)
+        return transactions_query.limit(limit).all()
+
+    skip = skip if not cursor else 0
+    rows = transactions_query.limit(skip + limit).all()
+    archive_filters = dict(filters)
+    if len(rows) == skip + limit:
+        # Archived rows older than the last hot row cannot make it onto the page
+        floor = rows[-1].date
+        if filters.get("start_date") is None or filters["start_date"] < floor:
+            archive_filters["start_date"] = floor
+        blocks = [block for block in blocks if block.max_date >= floor]
+        if not blocks:
+            return rows[skip:]
+    archived = _iter_archived_transactions(db, user_id, blocks, query, descending=True, before=position, **archive_filters)
+    return list(islice(heapq.merge(rows, archived, key=_position, reverse=True), skip, skip + limit))
+
+def _count_archived_transactions(db: Session, user_id: int, query: Optional[str], scan_archive: bool, **filters) -> Optional[int]:
+    """
+    Count the archived transactions matching the search query and filters. Without a query, blocks
+    lying wholly inside the date range are counted from their statistics (see `archive.count_from_stats`);
+    the others are decompressed and scanned, or, unless `scan_archive`, None is returned.
+    """
+    blocks = archive.get_blocks(db, user_id, filters.get("start_date"), filters.get("end_date"))
+    if not blocks:
+        return 0
+    categories, trans_type = filters.get("categories"), filters.get("trans_type")
+    category_ids = set(_filter_category_ids(db, user_id, categories, trans_type)) if categories else None
+    count = 0
+    unanswered = []
+    for block in blocks:
+        block_count = None if query else archive.count_from_stats(
+            block, filters.get("start_date"), filters.get("end_date"), trans_type, category_ids,
+            filters.get("min_amount"), filters.get("max_amount")
+        )
+        if block_count is None:
+            unanswered.append(block)
+        else:
+            count += block_count
+    if unanswered and not scan_archive:
+        return None
+    if unanswered:
+        count += sum(1 for _ in _iter_archived_transactions(db, user_id, unanswered, query, **filters))
+    return count
+
+def count_transactions(db: Session, user_id: int, query: Optional[str] = None, scan_archive: bool = True, **filters) -> Optional[int]:
+    """
+    Count the transactions `get_transactions` would return over all pages for the same query and filters.
+    Without a search query or amount bounds the count is read from the rollup buckets, so it does not
+    grow with the ledger; otherwise the matching rows are counted on the filter indexes, plus the
+    matching archived rows. Pass scan_archive=False to get None instead of decompressing archive blocks
+    whose statistics cannot answer the filters (any block, with a search query).
+    """
+    if query or filters.get("min_amount") is not None or filters.get("max_amount") is not None:
+        archived = _count_archived_transactions(db, user_id, query, scan_archive, **filters)
+        if archived is None:
+            return None
+        conditions = transaction_filter_conditions(db, user_id, **filters)
+        count_query = db.query(func.count(Transaction.id)).select_from(Transaction).outerjoin(
+            Category, Category.id == Transaction.category_id
+        )
+        count_query, _ = _filter_transactions(db, count_query, user_id, query, conditions)
+        return (count_query.scalar() or 0) + archived
+
+    start_date, end_date = filters.get("start_date"), filters.get("end_date")
+    trans_type, categories = filters.get("trans_type"), filters.get("categories")
+    if start_date and end_date and start_date > end_date:
+        return 0
+    category_ids = None
+    if categories:
+        category_ids = [
+            row.id for row in db.query(Category.id).filter(
+                or_(Category.user_id == None, Category.user_id == user_id),
+                Category.name.in_(categories)
+            )
+        ]
+    total = 0
+    for period, first_bucket, last_bucket in _summary_ranges(start_date, end_date, False):
+        rollup_query = db.query(func.sum(TransactionRollup.count)).filter(
+            TransactionRollup.user_id == user_id,
+            TransactionRollup.period == period
+        )
+        if first_bucket is not None:
+            rollup_query = rollup_query.filter(TransactionRollup.bucket >= first_bucket)
+        if last_bucket is not None:
+            rollup_query = rollup_query.filter(TransactionRollup.bucket <= last_bucket)
+        if trans_type:
+            rollup_query = rollup_query.filter(TransactionRollup.type == trans_type)
+        if category_ids is not None:
+            rollup_query = rollup_query.filter(TransactionRollup.category_id.in_(category_ids))
+        total += rollup_query.scalar() or 0
+    return total
+
+def build_search_query(db: Session, query: str, user_id: int) -> Optional[str]:
+    """
+    Return the FTS5 expression for a search string, or None if the LIKE fallback should be used.
+    """
+    if not search.search_enabled(db):
+        return None
+    categories = db.query(Category.id, Category.name).filter(or_(Category.user_id == None, Category.user_id == user_id))
+    return search.build_match_query(query, [(cat.id, cat.name) for cat in categories])
+
+def _transaction_fields(db: Session, transaction: TransactionCreate, user_id: int, transaction_id: Optional[int] = None) -> Dict:
+    """
+    Return the column values of a transaction payload, with its category name resolved to an id
+    and its content key assigned. Pass `transaction_id` when the payload replaces that transaction.
+    """
+    fields = transaction.model_dump()
+    category = fields.pop("category")
+    fields["category_id"] = resolve_category_ids(db, user_id, [(fields["type"], category)])[(fields["type"], category)]
+    fields["content_hash"], fields["content_seq"] = assign_content_keys(
+        db, user_id, [fields], exclude_ids=[transaction_id] if transaction_id is not None else ()
+    )[0]
+    return fields
 
 def create_user_transaction(db: Session, transaction: TransactionCreate, user_id: int):
     """
     Create a new transaction for a specific user.
+    The returned transaction carries the `budget_alerts` the write triggered.
     """
-    db_transaction = Transaction(**transaction.model_dump(), user_id=user_id)
+    db_transaction = Transaction(**_transaction_fields(db, transaction, user_id), user_id=user_id)
     db.add(db_transaction)
+    record_ledger_changes(db, user_id, added=[db_transaction])
     db.commit()
     db.refresh(db_transaction)
+    db_transaction.budget_alerts = budgets.pop_budget_alerts(db)
+    return db_transaction
+
+def _get_user_transaction(db: Session, transaction_id: int, user_id: int) -> Optional[Transaction]:
+    """
+    Return a user's transaction for a write, moving it out of the archive first if it was archived.
+    """
+    transaction_query = db.query(Transaction).filter(Transaction.id == transaction_id, Transaction.user_id == user_id)
+    db_transaction = transaction_query.first()
+    if db_transaction is None and rehydrate_transactions(db, user_id, [transaction_id]):
+        db_transaction = transaction_query.first()
     return db_transaction
 
 def update_user_transaction(db: Session, transaction_id: int, transaction: TransactionCreate, user_id: int):
     """
     Update an existing transaction for a specific user.
     """
-    db_transaction = db.query(Transaction).filter(Transaction.id == transaction_id, Transaction.user_id == user_id).first()
+    db_transaction = _get_user_transaction(db, transaction_id, user_id)
     if db_transaction is None:
         return None
-    for key, value in transaction.model_dump().items():
+    previous = _ledger_row(db_transaction)
+    for key, value in _transaction_fields(db, transaction, user_id, transaction_id).items():
         setattr(db_transaction, key, value)
+    record_ledger_changes(db, user_id, added=[db_transaction], removed=[previous])
     db.commit()
     db.refresh(db_transaction)
+    db_transaction.budget_alerts = budgets.pop_budget_alerts(db)
     return db_transaction
 
 def delete_user_transaction(db: Session, transaction_id: int, user_id: int):
     """
     Delete a transaction for a specific user.
     """
-    db_transaction = db.query(Transaction).filter(Transaction.id == transaction_id, Transaction.user_id == user_id).first()
+    db_transaction = _get_user_transaction(db, transaction_id, user_id)
     if db_transaction is None:
         return None
     db.delete(db_transaction)
+    record_ledger_changes(db, user_id, removed=[db_transaction])
     db.commit()
+    db_transaction.budget_alerts = budgets.pop_budget_alerts(db)
     return db_transaction
 
-def import_transactions_from_csv(db: Session, file_content: bytes, user_id: int):
+def apply_transaction_operations(db: Session, operations: List[TransactionOperation], user_id: int) -> Dict:
+    """
+    Apply a batch of create/update/delete operations in one DB transaction with bulk statements.
+    Every operation is checked first; if any is invalid (missing payload or id, unknown transaction,
+    the same id twice) nothing is written and `applied` is False. Returns the per-operation results,
+    the change version after the batch and the budget alerts it triggered.
+    Archived targets are moved back into the transactions table first.
+    """
+    target_ids = [op.id for op in operations if op.op != "create" and op.id is not None]
+    existing = {}
+
+    def read_existing(ids):
+        for start in range(0, len(ids), CONTENT_KEY_QUERY_SIZE):
+            for row in query_transaction_rows(db).add_columns(Transaction.category_id).filter(
+                Transaction.user_id == user_id,
+                Transaction.id.in_(ids[start:start + CONTENT_KEY_QUERY_SIZE])
+            ):
+                existing[row.id] = row
+
+    read_existing(target_ids)
+    missing_ids = [i for i in set(target_ids) if i not in existing]
+    if missing_ids and rehydrate_transactions(db, user_id, missing_ids):
+        read_existing(missing_ids)
+
+    results = []
+    seen_ids = set()
+    for index, op in enumerate(operations):
+        result = {"index": index, "op": op.op, "id": op.id, "status": 200, "transaction": None, "detail": None}
+        if op.op != "delete" and op.transaction is None:
+            result.update(status=422, detail="transaction is required")
+        elif op.op == "create":
+            result["id"] = None
+        elif op.id is None:
+            result.update(status=422, detail="id is required")
+        elif op.id in seen_ids:
+            result.update(status=422, detail="Transaction appears more than once in the batch")
+        elif op.id not in existing:
+            result.update(status=404, detail="Transaction not found or you don't have permission to change it")
+        if op.op != "create" and op.id is not None:
+            seen_ids.add(op.id)
+        results.append(result)
+    if any(result["status"] != 200 for result in results):
+        return {"applied": False, "version": None, "results": results}
+
+    writes = [op for op in operations if op.op != "delete"]
+    category_ids = resolve_category_ids(db, user_id, {(op.transaction.type, op.transaction.category) for op in writes})
+    rows = []
+    for op in writes:
+        row = {key: value for key, value in op.transaction.model_dump().items() if key != "category"}
+        row["category_id"] = category_ids[(op.transaction.type, op.transaction.category)]
+        row["user_id"] = user_id
+        rows.append(row)
+    keys = assign_content_keys(db, user_id, rows, exclude_ids=target_ids)
+    for row, (content_hash, content_seq) in zip(rows, keys):
+        row["content_hash"] = content_hash
+        row["content_seq"] = content_seq
+
+    removed = [
+        LedgerRow(row.id, user_id, row.type, row.description, row.amount, row.category_id, row.date)
+        for row in existing.values()
+    ]
+    delete_ids = [op.id for op in operations if op.op == "delete"]
+    for start in range(0, len(delete_ids), CONTENT_KEY_QUERY_SIZE):
+        db.query(Transaction).filter(
+            Transaction.id.in_(delete_ids[start:start + CONTENT_KEY_QUERY_SIZE])
+        ).delete(synchronize_session=False)
+    updates = [dict(row, id=op.id) for op, row in zip(writes, rows) if op.op == "update"]
+    if updates:
+        _release_content_keys(db, [row["id"] for row in updates])
+        db.execute(update(Transaction), updates)
+    added = [LedgerRow(row["id"], user_id, row["type"], row["description"], row["amount"], row["category_id"], row["date"]) for row in updates]
+    creates = [row for op, row in zip(writes, rows) if op.op == "create"]
+    if creates:
+        added += _bulk_insert_transactions(db, creates, user_id)
+    record_ledger_changes(db, user_id, added=added, removed=removed)
+    version = changes.get_current_version(db, user_id)
+    db.commit()
+
+    created_ids = iter([row.id for row in added[len(updates):]])
+    written_ids = []
+    for op, result in zip(operations, results):
+        if op.op == "create":
+            result["id"] = next(created_ids)
+            result["status"] = 201
+        if op.op != "delete":
+            written_ids.append(result["id"])
+    written = {}
+    for start in range(0, len(written_ids), CONTENT_KEY_QUERY_SIZE):
+        for row in query_transaction_rows(db).filter(Transaction.id.in_(written_ids[start:start + CONTENT_KEY_QUERY_SIZE])):
+            written[row.id] = row
+    for op, result in zip(operations, results):
+        row = existing[op.id] if op.op == "delete" else written[result["id"]]
+        result["transaction"] = transaction_record(row)
+    return {"applied": True, "version": version, "results": results, "budget_alerts": budgets.pop_budget_alerts(db)}
+
+IMPORT_BATCH_SIZE = 5000
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+CONTENT_KEY_QUERY_SIZE = 500
+
+def transaction_content_hash(row: Dict) -> str:
+    """
+    Hash the content of a transaction dict (type, amount, date, category_id, description).
+    """
+    raw = json.dumps(
+        [row["type"], float(row["amount"]), row["date"].isoformat(), row["category_id"], row["description"]],
+        ensure_ascii=False
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _existing_content_keys(db: Session, user_id: int, hashes: Iterable[str], exclude_ids: Iterable[int] = (), dates: Iterable[datetime.date] = ()) -> Dict[str, set]:
+    """
+    Return {content_hash: {content_seq, ...}} for a user's transactions with the given hashes.
+    Archived transactions are included for the archive blocks covering `dates`, the dates of the
+    transactions the hashes were computed from (the hash covers the date).
+    """
+    hashes = list(hashes)
+    exclude_ids = list(exclude_ids)
+    taken = defaultdict(set)
+    for start in range(0, len(hashes), CONTENT_KEY_QUERY_SIZE):
+        keys_query = db.query(Transaction.content_hash, Transaction.content_seq).filter(
+            Transaction.user_id == user_id,
+            Transaction.content_hash.in_(hashes[start:start + CONTENT_KEY_QUERY_SIZE])
+        )
+        if exclude_ids:
+            keys_query = keys_query.filter(Transaction.id.not_in(exclude_ids))
+        for content_hash, content_seq in keys_query:
+            taken[content_hash].add(content_seq)
+    dates = {date for date in dates if date is not None}
+    if dates:
+        wanted = set(hashes)
+        blocks = archive.get_blocks(db, user_id, min(dates), max(dates))
+        for row in archive.iter_archived_rows(db, blocks):
+            if row.date in dates:
+                content_hash = transaction_content_hash(row._asdict())
+                if content_hash in wanted:
+                    taken[content_hash].add(row.content_seq)
+    return taken
+
+def assign_content_keys(db: Session, user_id: int, rows: List[Dict], exclude_ids: Iterable[int] = ()) -> List[Tuple[str, int]]:
+    """
+    Return a (content_hash, content_seq) key for each new transaction dict. Identical transactions
+    get the lowest sequence numbers not yet taken in the user's ledger (ignoring `exclude_ids`).
+    """
+    hashes = [transaction_content_hash(row) for row in rows]
+    taken = _existing_content_keys(db, user_id, set(hashes), exclude_ids, dates={row["date"] for row in rows})
+    keys = []
+    for content_hash in hashes:
+        content_seq = 0
+        while content_seq in taken[content_hash]:
+            content_seq += 1
+        taken[content_hash].add(content_seq)
+        keys.append((content_hash, content_seq))
+    return keys
+
+def insert_transaction_batch(db: Session, rows: List[Dict], user_id: int) -> int:
+    """
+    Bulk insert a batch of new transaction dicts, update derived data and commit.
+    The dicts carry category names, which are resolved to category ids here.
+    """
+    category_ids = resolve_category_ids(db, user_id, {(row["type"], row["category"]) for row in rows})
+    rows = [
+        {**{key: value for key, value in row.items() if key != "category"}, "category_id": category_ids[(row["type"], row["category"])]}
+        for row in rows
+    ]
+    for row, (content_hash, content_seq) in zip(rows, assign_content_keys(db, user_id, rows)):
+        row["content_hash"] = content_hash
+        row["content_seq"] = content_seq
+    return _insert_transaction_rows(db, rows, user_id)
+
+def _insert_transaction_rows(db: Session, rows: List[Dict], user_id: int) -> int:
+    """
+    Insert transaction dicts with all columns filled in with a Core INSERT, update derived data and commit.
+    Committing per batch keeps each SQLite write lock short during large imports.
+    """
+    inserted = _bulk_insert_transactions(db, rows, user_id)
+    record_ledger_changes(db, user_id, added=inserted)
+    db.commit()
+    return len(inserted)
+
+def _bulk_insert_transactions(db: Session, rows: List[Dict], user_id: int) -> List["LedgerRow"]:
+    """
+    Insert transaction dicts with all columns filled in with a Core INSERT, without touching derived
+    data or committing. Returns a LedgerRow snapshot per row, in the order of `rows`.
+    """
+    # New ids are matched to rows by their unique content key rather than by parameter order,
+    # which lets SQLAlchemy send the batch as multi-row INSERTs instead of one statement per row.
+    inserted_ids = {
+        (content_hash, content_seq): new_id for new_id, content_hash, content_seq in db.execute(
+            insert(Transaction.__table__).returning(Transaction.id, Transaction.content_hash, Transaction.content_seq), rows
+        )
+    }
+    return [
+        LedgerRow(inserted_ids[(row["content_hash"], row["content_seq"])], user_id, row["type"], row["description"], row["amount"], row["category_id"], row["date"])
+        for row in rows
+    ]
+
+def iter_csv_import_batches(text_stream, user_id: int, batch_size: int, report_error, start_line: int = 0):
+    """
+    Parse a transactions CSV text stream into batches of transaction dicts.
+    Yields (line, batch), where `line` is the last CSV line read into the batch. Invalid rows are passed to
+    `report_error(line, message)` and skipped. Rows up to `start_line` are skipped without being parsed,
+    which lets a resumed import job continue after its last committed batch.
+    """
+    batch = []
+    csv_reader = csv.reader(text_stream)
+    next(csv_reader, None) # Skip header row
+    for row in csv_reader:
+        if not row or csv_reader.line_num <= start_line:
+            continue
+        if len(row) != 5:
+            report_error(csv_reader.line_num, f"Invalid row format: {row}. Expected 5 columns.")
+            continue
+        try:
+            batch.append({
+                "type": row[0],
+                "description": row[1],
+                "amount": float(row[2]),
+                "category": row[3],
+                "date": datetime.datetime.strptime(row[4], "%Y-%m-%d").date(),
+                "user_id": user_id
+            })
+        except ValueError as e:
+            report_error(csv_reader.line_num, f"Data conversion error in row {row}: {e}")
+            continue
+        if len(batch) >= batch_size:
+            yield csv_reader.line_num, batch
+            batch = []
+    if batch:
+        yield csv_reader.line_num, batch
+
+def import_transactions_from_csv(db: Session, file_content, user_id: int, batch_size: int = IMPORT_BATCH_SIZE):
     """
     Import transactions from a CSV file for a specific user.
+    `file_content` may be bytes or a binary file object; file objects are parsed incrementally.
+    Rows are inserted in batches of `batch_size`; invalid rows are skipped and reported
+    instead of failing the whole file. Returns import statistics.
     """
+    started = time.perf_counter()
+    stream = io.BytesIO(file_content) if isinstance(file_content, (bytes, bytearray)) else file_content
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    stats = {"imported": 0, "failed": 0, "batches": 0, "errors": []}
+
+    def report_error(line_number, message):
+        stats["failed"] += 1
+        if len(stats["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            stats["errors"].append({"line": line_number, "error": message})
+
     try:
-        decoded_content = file_content.decode('utf-8')
-        csv_reader = csv.reader(io.StringIO(decoded_content))
-        next(csv_reader) # Skip header row
-
-        transactions_to_add = []
-        for row in csv_reader:
-            if len(row) != 5:
-                raise HTTPException(status_code=400, detail=f"Invalid row format: {row}. Expected 5 columns.")
-            try:
-                transaction_data = {
-                    "type": row[0],
-                    "description": row[1],
-                    "amount": float(row[2]),
-                    "category": row[3],
-                    "date": datetime.datetime.strptime(row[4], "%Y-%m-%d").date(),
-                    "user_id": user_id
-                }
-                transactions_to_add.append(Transaction(**transaction_data))
-            except ValueError as e:
-                raise HTTPException(status_code=400, detail=f"Data conversion error in row {row}: {e}")
-
-        db.add_all(transactions_to_add)
-        db.commit()
-        return len(transactions_to_add)
+        for _, batch in iter_csv_import_batches(text_stream, user_id, batch_size, report_error):
+            stats["imported"] += insert_transaction_batch(db, batch, user_id)
+            stats["batches"] += 1
+    except UnicodeDecodeError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"File is not valid UTF-8; {stats['imported']} transactions were imported before the error.")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to import transactions: {e}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to import transactions after {stats['imported']} rows: {e}")
+    finally:
+        text_stream.detach()
 
-def export_transactions_to_csv(db: Session, user_id: int):
+    elapsed = time.perf_counter() - started
+    stats["elapsed_seconds"] = round(elapsed, 3)
+    stats["rows_per_second"] = round(stats["imported"] / elapsed, 1) if elapsed > 0 else None
+    stats["budget_alerts"] = budgets.pop_budget_alerts(db)
+    return stats
+
+EXPORT_CHUNK_SIZE = 1000
+
+def _iter_transaction_chunks(db: Session, user_id: int, chunk_size: int = EXPORT_CHUNK_SIZE):
     """
-    Export all transactions for a specific user to a CSV string.
+    Yield a user's transactions oldest first, as lists of up to `chunk_size` plain row tuples
+    (id, type, description, amount, category, date). Archived transactions are merged in
+    one decompressed block at a time.
+    """
+    hot_chunks = _iter_hot_transaction_chunks(db, user_id, chunk_size)
+    blocks = archive.get_blocks(db, user_id)
+    if not blocks:
+        yield from hot_chunks
+        return
+    rows = heapq.merge(chain.from_iterable(hot_chunks), _iter_archived_transactions(db, user_id, blocks), key=_position)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+def _iter_hot_transaction_chunks(db: Session, user_id: int, chunk_size: int):
+    """
+    Yield the transactions table part of `_iter_transaction_chunks`. Each chunk seeks on the (user_id, date, id) index.
+    """
+    last_position = None
+    while True:
+        chunk_query = query_transaction_rows(db).filter(Transaction.user_id == user_id)
+        if last_position is not None:
+            last_date, last_id = last_position
+            chunk_query = chunk_query.filter(or_(
+                Transaction.date > last_date,
+                and_(Transaction.date == last_date, Transaction.id > last_id)
+            ))
+        rows = chunk_query.order_by(Transaction.date, Transaction.id).limit(chunk_size).all()
+        if not rows:
+            break
+        yield rows
+        last_position = (rows[-1].date, rows[-1].id)
+
+def iter_transactions_csv(db: Session, user_id: int, chunk_size: int = EXPORT_CHUNK_SIZE, on_rows: Optional[Callable[[int], None]] = None):
+    """
+    Yield the CSV export of a user's transactions piece by piece, oldest first.
+    Rows are read as plain tuples in fixed-size chunks that seek on the (user_id, date, id) index,
+    so memory stays flat regardless of the size of the ledger.
+    `on_rows`, if given, is called with the number of rows in each chunk before it is yielded.
     """
-    transactions = db.query(Transaction).filter(Transaction.user_id == user_id).all()
-    
     output = io.StringIO()
     csv_writer = csv.writer(output)
-    
+
     # Write header
     csv_writer.writerow(["type", "description", "amount", "category", "date"])
-    
-    # Write data
-    for trans in transactions:
-        csv_writer.writerow([trans.type, trans.description, trans.amount, trans.category, trans.date.strftime("%Y-%m-%d")])
-    
-    return output.getvalue()
+    yield output.getvalue()
+
+    for rows in _iter_transaction_chunks(db, user_id, chunk_size):
+        if on_rows is not None:
+            on_rows(len(rows))
+        output.seek(0)
+        output.truncate()
+        for row in rows:
+            csv_writer.writerow([row.type, row.description, row.amount, row.category, row.date.strftime("%Y-%m-%d")])
+        yield output.getvalue()
+
+def export_transactions_to_csv(db: Session, user_id: int):
+    """
+    Export all transactions for a specific user to a CSV string.
+    """
+    return "".join(iter_transactions_csv(db, user_id))
 
 # --- Category CRUD Operations ---
+def _category_cache_version(user_id: int):
+    """
+    Return the cache version of a user's category list, which also depends on the system categories.
+    """
+    return (category_cache.version(None), category_cache.version(user_id))
+
+def _get_system_categories(db: Session) -> List[Tuple[str, str]]:
+    """
+    Return the system-wide (type, name) categories, loaded once per process.
+    """
+    version = category_cache.version(None)
+    system_categories = category_cache.get(None, version)
+    if system_categories is None:
+        system_categories = [
+            (cat.type, cat.name) for cat in db.query(Category.type, Category.name).filter(Category.user_id == None)
+        ]
+        category_cache.set(None, version, system_categories)
+    return system_categories
+
+def get_categories_with_etag(db: Session, user_id: int) -> Tuple[Dict[str, List[str]], str]:
+    """
+    Retrieve categories for a specific user, including system-wide categories, with a strong ETag.
+    The result is cached until one of the user's categories (or the system set) changes.
+    """
+    version = _category_cache_version(user_id)
+    cached = category_cache.get(user_id, version)
+    if cached is not None:
+        return cached
+
+    result = {"income": [], "expense": []}
+    user_categories = [(cat.type, cat.name) for cat in db.query(Category.type, Category.name).filter(Category.user_id == user_id)]
+    for cat_type, cat_name in _get_system_categories(db) + user_categories:
+        if cat_type in result:
+            result[cat_type].append(cat_name)
+    etag = '"' + hashlib.sha1(json.dumps(result, ensure_ascii=False, sort_keys=True).encode()).hexdigest() + '"'
+    category_cache.set(user_id, version, (result, etag))
+    return result, etag
+
+def peek_categories_etag(user_id: int) -> Optional[str]:
+    """
+    Return the ETag of a user's cached category list if it is still current, without touching the database.
+    """
+    cached = category_cache.get(user_id, _category_cache_version(user_id))
+    return cached[1] if cached is not None else None
+
 def get_categories(db: Session, user_id: int):
     """
     Retrieve categories for a specific user, including system-wide categories.
     """
-    categories_db = db.query(Category).filter(
-        (Category.user_id == user_id) | (Category.user_id == None)
-    ).all()
-    result = {"income": [], "expense": []}
-    for cat in categories_db:
-        if cat.type in result:
-            result[cat.type].append(cat.name)
-    return result
+    return get_categories_with_etag(db, user_id)[0]
 
 def create_user_category(db: Session, category: CategoryCreate, user_id: int):
     """
@@ -153,6 +1062,7 @@ def create_user_category(db: Session, category: CategoryCreate, user_id: int):
     db_category = Category(**category.model_dump(), user_id=user_id)
     db.add(db_category)
     db.commit()
+    after_commit(db, invalidate_categories, user_id)
     db.refresh(db_category)
     return db_category
 
@@ -173,20 +1083,28 @@ def update_user_category(db: Session, category_id: int, category: CategoryCreate
     if existing_cat:
         return None # Category with new name/type already exists for this user
 
-    if db_category.name != category.name or db_category.type != category.type:
-        db.query(Transaction).filter(
+    # Transactions reference the category by id, so a rename only touches the category row;
+    # clients holding the old name are told to reload. A type change also moves the transactions.
+    if db_category.type != category.type:
+        rehydrate_transactions(db, user_id, category_id=category_id)
+        moved_query = db.query(Transaction).filter(
             Transaction.user_id == user_id,
-            Transaction.category == db_category.name,
-            Transaction.type == db_category.type
-        ).update({
-            Transaction.category: category.name,
-            Transaction.type: category.type
-        })
+            Transaction.category_id == category_id
+        )
+        moved_ids = [row.id for row in moved_query.with_entities(Transaction.id)]
+        moved_query.update({Transaction.type: category.type})
+        record_category_move(db, user_id, (db_category.type, category_id), (category.type, category_id), moved_ids)
+        if category.type != "expense":
+            budgets.delete_category_budgets(db, user_id, category_id)
+    elif db_category.name != category.name:
+        changes.force_resync(db, user_id)
 
     for key, value in category.model_dump().items():
         setattr(db_category, key, value)
     db.commit()
+    after_commit(db, invalidate_categories, user_id)
     db.refresh(db_category)
+    db_category.budget_alerts = budgets.pop_budget_alerts(db)
     return db_category
 
 def delete_user_category(db: Session, category_type: str, category_name: str, user_id: int):
@@ -201,14 +1119,21 @@ def delete_user_category(db: Session, category_type: str, category_name: str, us
     if db_category is None:
         return None
     
-    db.query(Transaction).filter(
+    fallback_id = resolve_category_ids(db, user_id, [(category_type, "其他")], exclude_id=db_category.id)[(category_type, "其他")]
+    rehydrate_transactions(db, user_id, category_id=db_category.id)
+    moved_query = db.query(Transaction).filter(
         Transaction.user_id == user_id,
-        Transaction.category == category_name,
-        Transaction.type == category_type
-    ).update({"category": "其他"})
+        Transaction.category_id == db_category.id
+    )
+    moved_ids = [row.id for row in moved_query.with_entities(Transaction.id)]
+    moved_query.update({Transaction.category_id: fallback_id})
+    record_category_move(db, user_id, (category_type, db_category.id), (category_type, fallback_id), moved_ids)
+    budgets.delete_category_budgets(db, user_id, db_category.id)
 
     db.delete(db_category)
     db.commit()
+    after_commit(db, invalidate_categories, user_id)
+    db_category.budget_alerts = budgets.pop_budget_alerts(db)
     return db_category
 
 def seed_default_categories(db: Session):
@@ -223,4 +1148,406 @@ def seed_default_categories(db: Session):
         for cat_type, cat_list in default_categories.items():
             for cat_name in cat_list:
                 db.add(Category(name=cat_name, type=cat_type, user_id=None))
-        db.commit()
\ No newline at end of file
+        db.commit()
+        after_commit(db, invalidate_categories, None)
+
+def resolve_category_ids(db: Session, user_id: int, keys: Iterable[Tuple[str, str]], exclude_id: Optional[int] = None) -> Dict[Tuple[str, str], int]:
+    """
+    Map (type, name) pairs to the ids of the categories a user's transactions should reference.
+    A system category wins over a custom category of the same name. Names without a category
+    (free text from imports and older clients) get a new custom category. Does not commit.
+    """
+    keys = set(keys)
+    lookup = {}
+    for cat in db.query(Category.id, Category.type, Category.name).filter(
+        or_(Category.user_id == None, Category.user_id == user_id)
+    ).order_by(Category.user_id.is_not(None).desc(), Category.id):
+        if cat.id != exclude_id:
+            lookup[(cat.type, cat.name)] = cat.id
+    missing = [key for key in keys if key not in lookup]
+    if missing:
+        created = [Category(type=cat_type, name=cat_name, user_id=user_id) for cat_type, cat_name in missing]
+        db.add_all(created)
+        db.flush()
+        for cat in created:
+            lookup[(cat.type, cat.name)] = cat.id
+        after_commit(db, invalidate_categories, user_id)
+    return {key: lookup[key] for key in keys}
+
+def ensure_category_ids(db: Session):
+    """
+    Migrate a ledger created before transactions referenced categories by id: fill `category_id`
+    from the old free-text `category` column, then drop that column.
+    """
+    columns = {column["name"] for column in inspect(db.connection()).get_columns("transactions")}
+    if "category" not in columns:
+        return
+    keys_by_user = defaultdict(set)
+    for owner_id, trans_type, category in db.execute(text(
+        "SELECT DISTINCT user_id, type, category FROM transactions WHERE category_id IS NULL AND category IS NOT NULL"
+    )):
+        keys_by_user[owner_id].add((trans_type, category))
+    for owner_id, keys in keys_by_user.items():
+        category_ids = resolve_category_ids(db, owner_id, keys)
+        db.execute(text(
+            "UPDATE transactions SET category_id = :category_id "
+            "WHERE user_id = :user_id AND type = :type AND category = :category AND category_id IS NULL"
+        ), [
+            {"category_id": category_id, "user_id": owner_id, "type": trans_type, "category": category}
+            for (trans_type, category), category_id in category_ids.items()
+        ])
+    db.execute(text("DROP INDEX IF EXISTS ix_transactions_category"))
+    db.execute(text("ALTER TABLE transactions DROP COLUMN category"))
+    db.commit()
+    logging.info(f"交易分類已轉換為分類編號，共 {len(keys_by_user)} 位使用者")
+
+# --- Ledger Change Tracking ---
+LedgerRow = namedtuple("LedgerRow", ["id", "user_id", "type", "description", "amount", "category_id", "date"])
+
+def rehydrate_transactions(db: Session, user_id: int, transaction_ids: Optional[Iterable[int]] = None, category_id: Optional[int] = None) -> int:
+    """
+    Move archived transactions (the given ids, or every one in a category) back into the transactions
+    table with their ids and content keys, and into the search index, so writes only ever change
+    ordinary rows. Rollups count archived transactions already. Does not commit. Returns the number moved.
+    """
+    rows = archive.take_archived_rows(db, user_id, transaction_ids, category_id)
+    if not rows:
+        return 0
+    values = []
+    for row in rows:
+        fields = dict(row._asdict(), user_id=user_id)
+        fields["content_hash"] = transaction_content_hash(fields)
+        values.append(fields)
+    db.execute(insert(Transaction.__table__), values)
+    search.index_transactions(db, [LedgerRow(row.id, user_id, row.type, row.description, row.amount, row.category_id, row.date) for row in rows])
+    return len(rows)
+
+def _ledger_row(trans) -> LedgerRow:
+    """
+    Snapshot the fields of a transaction that derived data depends on.
+    """
+    if isinstance(trans, LedgerRow):
+        return trans
+    return LedgerRow(trans.id, trans.user_id, trans.type, trans.description, trans.amount, trans.category_id, trans.date)
+
+def record_ledger_changes(db: Session, user_id: int, added: Iterable = (), removed: Iterable = ()):
+    """
+    Keep derived data (rollups, search index, change log) in step with transactions added to or removed from the ledger.
+    Accepts Transaction objects or LedgerRow snapshots; an update is a removal of the old snapshot plus an addition.
+    Must be called before the caller commits so everything lands in the same DB transaction.
+    """
+    db.flush() # Assign ids to newly added transactions
+    added = [_ledger_row(row) for row in added]
+    removed = [_ledger_row(row) for row in removed]
+
+    deltas = defaultdict(lambda: [0.0, 0])
+    for sign, rows in ((1, added), (-1, removed)):
+        for row in rows:
+            delta = deltas[(row.type, row.category_id, row.date)]
+            delta[0] += sign * row.amount
+            delta[1] += sign
+    _apply_budgeted_rollup_deltas(db, user_id, deltas)
+
+    search.unindex_transactions(db, [row.id for row in removed])
+    search.index_transactions(db, added)
+    changes.log_changes(db, user_id, upserted_ids=[row.id for row in added], deleted_ids=[row.id for row in removed])
+
+def _apply_budgeted_rollup_deltas(db: Session, user_id: int, deltas: Dict[Tuple[str, int, datetime.date], List]):
+    """
+    Apply rollup deltas and record the budget thresholds they cross (see app/crud/budgets.py).
+    Budgets are only looked up when an expense bucket changes.
+    """
+    user_budgets = budgets.get_budgets_by_category(db, user_id) if any(key[0] == "expense" for key in deltas) else {}
+    totals = apply_rollup_deltas(db, user_id, deltas, watch=user_budgets)
+    if totals:
+        budgets.record_budget_crossings(db, user_budgets, totals)
+
+def record_category_move(db: Session, user_id: int, old_key: Tuple[str, int], new_key: Tuple[str, int], transaction_ids: List[int]):
+    """
+    Keep derived data in step with a bulk re-categorization of the given transactions
+    from (type, category_id) to (type, category_id).
+    """
+    if old_key == new_key:
+        return
+    old_type, old_id = old_key
+    new_type, new_id = new_key
+    day_rows = db.query(TransactionRollup).filter(
+        TransactionRollup.user_id == user_id,
+        TransactionRollup.period == "day",
+        TransactionRollup.type == old_type,
+        TransactionRollup.category_id == old_id
+    ).all()
+    deltas = defaultdict(lambda: [0.0, 0])
+    for row in day_rows:
+        deltas[(old_type, old_id, row.bucket)] = [-row.total, -row.count]
+        deltas[(new_type, new_id, row.bucket)] = [row.total, row.count]
+    _apply_budgeted_rollup_deltas(db, user_id, deltas)
+    if old_id != new_id:
+        search.reindex_category(db, transaction_ids, new_id)
+    rehash_transactions(db, user_id, transaction_ids)
+    changes.log_changes(db, user_id, upserted_ids=transaction_ids)
+
+def _release_content_keys(db: Session, transaction_ids: List[int]):
+    """
+    Clear the content keys of transactions about to be rewritten in one executemany UPDATE, so a row
+    can take over a key that another row of the same statement gives up.
+    """
+    for start in range(0, len(transaction_ids), CONTENT_KEY_QUERY_SIZE):
+        db.query(Transaction).filter(
+            Transaction.id.in_(transaction_ids[start:start + CONTENT_KEY_QUERY_SIZE])
+        ).update({Transaction.content_hash: None}, synchronize_session=False)
+
+def rehash_transactions(db: Session, user_id: int, transaction_ids: List[int]):
+    """
+    Recompute the content keys of transactions whose content changed in a bulk UPDATE.
+    """
+    for start in range(0, len(transaction_ids), CONTENT_KEY_QUERY_SIZE):
+        ids = transaction_ids[start:start + CONTENT_KEY_QUERY_SIZE]
+        rows = [
+            row._asdict() for row in db.query(
+                Transaction.id, Transaction.type, Transaction.amount, Transaction.date, Transaction.category_id, Transaction.description
+            ).filter(Transaction.id.in_(ids)).order_by(Transaction.id)
+        ]
+        keys = assign_content_keys(db, user_id, rows, exclude_ids=ids)
+        _release_content_keys(db, ids)
+        db.execute(update(Transaction), [
+            {"id": row["id"], "content_hash": content_hash, "content_seq": content_seq}
+            for row, (content_hash, content_seq) in zip(rows, keys)
+        ])
+
+def ensure_content_hashes(db: Session):
+    """
+    Fill in the content keys of transactions created before duplicate detection existed.
+    """
+    filled = 0
+    while True:
+        batch = db.query(
+            Transaction.id, Transaction.user_id, Transaction.type, Transaction.amount, Transaction.date,
+            Transaction.category_id, Transaction.description
+        ).filter(Transaction.content_hash == None).order_by(Transaction.id).limit(IMPORT_BATCH_SIZE).all()
+        if not batch:
+            break
+        rows_by_user = defaultdict(list)
+        for row in batch:
+            rows_by_user[row.user_id].append(row._asdict())
+        updates = []
+        for owner_id, rows in rows_by_user.items():
+            for row, (content_hash, content_seq) in zip(rows, assign_content_keys(db, owner_id, rows)):
+                updates.append({"id": row["id"], "content_hash": content_hash, "content_seq": content_seq})
+        db.execute(update(Transaction), updates)
+        db.commit()
+        filled += len(updates)
+    if filled:
+        logging.info(f"已補齊 {filled} 筆交易的內容雜湊")
+
+# --- Rollup Operations ---
+def _rollup_insert(db: Session):
+    """
+    Return the dialect-specific INSERT construct that supports ON CONFLICT upserts.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(TransactionRollup)
+    return sqlite.insert(TransactionRollup)
+
+def apply_rollup_deltas(db: Session, user_id: int, deltas: Dict[Tuple[str, int, datetime.date], List], watch: Iterable[int] = ()) -> Dict[Tuple[int, datetime.date], Tuple[float, float]]:
+    """
+    Add {(type, category_id, date): [amount, count]} deltas to the day and month rollup buckets.
+    Uses an atomic upsert so concurrent writers never race on creating the same bucket.
+    For the expense month buckets of the categories in `watch` (the budgeted ones), the upsert
+    returns the new totals; they are returned as {(category_id, month): (total before, total after)}.
+    """
+    buckets = defaultdict(lambda: [0.0, 0])
+    for (trans_type, category_id, date), (amount, count) in deltas.items():
+        if count == 0 and amount == 0:
+            continue
+        for period, bucket in (("day", date), ("month", date.replace(day=1))):
+            entry = buckets[(period, bucket, trans_type, category_id)]
+            entry[0] += amount
+            entry[1] += count
+    if not buckets:
+        return {}
+
+    rows = [
+        {"user_id": user_id, "period": period, "bucket": bucket, "type": trans_type,
+         "category_id": category_id, "total": amount, "count": count}
+        for (period, bucket, trans_type, category_id), (amount, count) in buckets.items()
+    ]
+    stmt = _rollup_insert(db)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "period", "bucket", "type", "category_id"],
+        set_={
+            "total": TransactionRollup.total + stmt.excluded.total,
+            "count": TransactionRollup.count + stmt.excluded.count,
+        }
+    )
+    watch = set(watch)
+    watched, unwatched = [], []
+    for row in rows:
+        is_watched = row["period"] == "month" and row["type"] == "expense" and row["category_id"] in watch
+        (watched if is_watched else unwatched).append(row)
+    if unwatched:
+        db.execute(stmt, unwatched)
+    totals = {}
+    if watched:
+        returning = stmt.returning(TransactionRollup.category_id, TransactionRollup.bucket, TransactionRollup.total)
+        for category_id, bucket, total in db.execute(returning, watched):
+            totals[(category_id, bucket)] = (total - buckets[("month", bucket, "expense", category_id)][0], total)
+    db.query(TransactionRollup).filter(
+        TransactionRollup.user_id == user_id,
+        TransactionRollup.count <= 0
+    ).delete(synchronize_session=False)
+    return totals
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None):
+    """
+    Recompute rollup buckets from the transactions table and the archive, for one user or for everyone.
+    Used to backfill databases created before rollups existed.
+    """
+    rollup_query = db.query(TransactionRollup)
+    transactions_query = db.query(
+        Transaction.user_id, Transaction.type, Transaction.category_id, Transaction.date,
+        func.sum(Transaction.amount), func.count(Transaction.id)
+    )
+    if user_id is not None:
+        rollup_query = rollup_query.filter(TransactionRollup.user_id == user_id)
+        transactions_query = transactions_query.filter(Transaction.user_id == user_id)
+    rollup_query.delete(synchronize_session=False)
+
+    deltas_by_user = defaultdict(dict)
+    for owner_id, trans_type, category_id, date, amount, count in transactions_query.group_by(
+        Transaction.user_id, Transaction.type, Transaction.category_id, Transaction.date
+    ):
+        deltas_by_user[owner_id][(trans_type, category_id, date)] = [amount, count]
+    for owner_id in ([user_id] if user_id is not None else archive.archived_user_ids(db)):
+        deltas = deltas_by_user[owner_id]
+        for row in archive.iter_archived_rows(db, archive.get_blocks(db, owner_id)):
+            delta = deltas.setdefault((row.type, row.category_id, row.date), [0.0, 0])
+            delta[0] += row.amount or 0.0
+            delta[1] += 1
+    for owner_id, deltas in deltas_by_user.items():
+        apply_rollup_deltas(db, owner_id, deltas)
+    db.commit()
+
+def ensure_rollups(db: Session):
+    """
+    Backfill rollups once if the ledger has transactions but no rollup buckets yet.
+    """
+    if db.query(TransactionRollup.id).first() is None and (
+        db.query(Transaction.id).first() is not None or archive.archived_user_ids(db)
+    ):
+        rebuild_rollups(db)
+
+# --- Summary Operations ---
+SUMMARY_DIMENSIONS = ("type", "category", "day", "month", "year")
+SUMMARY_TIME_DIMENSIONS = ("day", "month", "year")
+
+def _month_end(date: datetime.date) -> datetime.date:
+    """
+    Return the last day of the month containing the given date.
+    """
+    next_month = (date.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return next_month - datetime.timedelta(days=1)
+
+def _summary_ranges(start_date: Optional[datetime.date], end_date: Optional[datetime.date], by_day: bool):
+    """
+    Split a date range into (period, first_bucket, last_bucket) pieces so that whole months are
+    read from month buckets and only the partial months at the edges are read from day buckets.
+    """
+    if by_day:
+        return [("day", start_date, end_date)]
+    if start_date is None and end_date is None:
+        return [("month", None, None)]
+
+    ranges = []
+    full_start = start_date
+    if start_date is not None and start_date.day != 1:
+        head_end = _month_end(start_date)
+        if end_date is not None and end_date <= head_end:
+            return [("day", start_date, end_date)]
+        ranges.append(("day", start_date, head_end))
+        full_start = head_end + datetime.timedelta(days=1)
+
+    full_end = end_date
+    if end_date is not None and end_date != _month_end(end_date):
+        tail_start = end_date.replace(day=1)
+        ranges.append(("day", tail_start, end_date))
+        full_end = tail_start - datetime.timedelta(days=1)
+
+    if full_start is None or full_end is None or full_start <= full_end:
+        ranges.append(("month", full_start, full_end))
+    return ranges
+
+def get_summary(
+    db: Session,
+    user_id: int,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    group_by: Optional[List[str]] = None,
+    trans_type: Optional[str] = None,
+    category: Optional[str] = None
+):
+    """
+    Aggregate transaction totals for a user from the rollup buckets.
+    The cost is proportional to the number of buckets in the range, not the number of transactions.
+    """
+    group_by = list(group_by or [])
+    time_dimension = next((dim for dim in group_by if dim in SUMMARY_TIME_DIMENSIONS), None)
+
+    category_names = {
+        cat.id: cat.name for cat in db.query(Category.id, Category.name).filter(
+            or_(Category.user_id == None, Category.user_id == user_id)
+        )
+    }
+    totals = {"income": 0.0, "expense": 0.0}
+    buckets = defaultdict(lambda: [0.0, 0])
+    for period, first_bucket, last_bucket in _summary_ranges(start_date, end_date, time_dimension == "day"):
+        rollup_query = db.query(TransactionRollup).filter(
+            TransactionRollup.user_id == user_id,
+            TransactionRollup.period == period
+        )
+        if first_bucket is not None:
+            rollup_query = rollup_query.filter(TransactionRollup.bucket >= first_bucket)
+        if last_bucket is not None:
+            rollup_query = rollup_query.filter(TransactionRollup.bucket <= last_bucket)
+        if trans_type:
+            rollup_query = rollup_query.filter(TransactionRollup.type == trans_type)
+        if category:
+            rollup_query = rollup_query.filter(TransactionRollup.category_id.in_(
+                [cat_id for cat_id, cat_name in category_names.items() if cat_name == category]
+            ))
+
+        for row in rollup_query.all():
+            if row.type in totals:
+                totals[row.type] += row.total
+            key = []
+            for dim in group_by:
+                if dim == "type":
+                    key.append(row.type)
+                elif dim == "category":
+                    key.append(category_names.get(row.category_id))
+                elif dim == "day":
+                    key.append(row.bucket.strftime("%Y-%m-%d"))
+                elif dim == "month":
+                    key.append(row.bucket.strftime("%Y-%m"))
+                elif dim == "year":
+                    key.append(row.bucket.strftime("%Y"))
+            entry = buckets[tuple(key)]
+            entry[0] += row.total
+            entry[1] += row.count
+
+    result_buckets = []
+    for key, (amount, count) in sorted(buckets.items()):
+        bucket = {"total": round(amount, 2), "count": count}
+        for dim, value in zip(group_by, key):
+            bucket["period" if dim in SUMMARY_TIME_DIMENSIONS else dim] = value
+        result_buckets.append(bucket)
+
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "group_by": group_by,
+        "income": round(totals["income"], 2),
+        "expense": round(totals["expense"], 2),
+        "buckets": result_buckets
+    }
@@ -0,0 +1,661 @@
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import uuid
+import shutil
+import logging
+import datetime
+import itertools
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import update, or_, and_, func
+from sqlalchemy.orm import Session
+
+from app.models.database import SessionLocal, create_schema, data_shards
+from app.models.models import Job, User, UserShard, Transaction
+from app.schemas.schemas import Principal, UserDataImport
+from app.crud.crud import (
+    IMPORT_MAX_REPORTED_ERRORS, delete_user_data, count_transactions, insert_transaction_batch,
+    iter_csv_import_batches, open_export_file, iter_export_batches, import_export_batch, backup_transaction_rows,
+    iter_user_data_export, iter_transactions_csv
+)
+from app.crud import search, archive
+from app.crud.budgets import pop_budget_alerts
+from app.core.cache import invalidate_principal, invalidate_categories, shard_map_cache
+from app.core.metrics import jobs_finished, jobs_running
+
+# Background jobs for imports, exports and account deletion.
+# A job is a row of the jobs table in the database holding the user's ledger, so the checkpoint of a job
+# commits in the same transaction as the chunk of work it describes. JobWorkerPool threads claim queued
+# jobs with a conditional UPDATE (safe across processes) and run them in chunks of about JOB_CHUNK_SIZE
+# rows, committing after each chunk and pausing JOB_CHUNK_PAUSE_MS so interactive requests get the write
+# lock in between. A job interrupted by a shutdown or a crash is resumed from its last checkpoint: CSV
+# imports continue after the last committed line, backup imports replay the content keys of the lines
+# already imported and continue, exports start over, and account deletion picks up with the remaining rows.
+# Uploaded files and export results are kept in JOB_DIR; finished jobs are purged after JOB_RETENTION_HOURS.
+JOB_DIR = os.getenv("STASHUP_JOB_DIR", "./jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1")) # 0 leaves the jobs to `python -m app.crud.jobs work`
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "1000"))
+JOB_CHUNK_PAUSE_MS = float(os.getenv("JOB_CHUNK_PAUSE_MS", "20"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120")) # A running job without a checkpoint for this long is taken over
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+JOB_PURGE_INTERVAL = 3600 # Seconds between purges of finished jobs
+CLAIM_CANDIDATES = 5
+COPY_BUFFER_SIZE = 1024 * 1024
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+EXPORT_KINDS = ("csv_export", "data_export")
+
+class JobCancelled(Exception):
+    """
+    The user cancelled the job.
+    """
+
+class JobInterrupted(Exception):
+    """
+    The worker pool is shutting down; the job is queued again and resumed later.
+    """
+
+class JobLost(Exception):
+    """
+    Another worker claimed the job after this one stopped sending checkpoints.
+    """
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _job_path(shard: Optional[int], job_id: int, suffix: str) -> str:
+    """
+    Return the path of a job's input ("in") or result ("out") file. Job ids are per database,
+    so every shard has its own folder.
+    """
+    folder = "directory" if shard is None else f"shard_{shard:03d}"
+    return os.path.join(JOB_DIR, folder, f"job_{job_id}.{suffix}")
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def job_record(job: Job) -> Dict:
+    """
+    Return the API representation (JobModel) of a job.
+    """
+    finished_export = job.kind in EXPORT_KINDS and job.status == SUCCEEDED
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "processed": job.processed or 0,
+        "total": job.total,
+        "result": job.result,
+        "error": job.error,
+        "cancel_requested": bool(job.cancel_requested),
+        "result_url": f"/api/jobs/{job.id}/result" if finished_export else None,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+def user_data_ndjson(user_data: UserDataImport) -> Iterable[bytes]:
+    """
+    Serialize an uploaded JSON backup to the NDJSON export format, which is what data import jobs read.
+    """
+    for category in user_data.custom_categories:
+        yield (json.dumps({"kind": "category", **category.model_dump(mode="json")}, ensure_ascii=False) + "\n").encode()
+    for transaction in user_data.transactions:
+        yield (json.dumps({"kind": "transaction", **transaction.model_dump(mode="json")}, ensure_ascii=False) + "\n").encode()
+
+def submit_job(db: Session, user_id: int, kind: str, params: Optional[Dict] = None, source=None) -> Dict:
+    """
+    Queue a job in the session's database and return its record.
+    `source`, a binary file object or an iterable of byte chunks, becomes the job's input file; it is
+    written before the job row is inserted, so no write lock is held while an upload is copied.
+    """
+    shard = db.info.get("shard")
+    upload = None
+    if source is not None:
+        upload = os.path.join(JOB_DIR, "uploads", f"{uuid.uuid4().hex}.tmp")
+        os.makedirs(os.path.dirname(upload), exist_ok=True)
+        with open(upload, "wb") as f:
+            if hasattr(source, "read"):
+                shutil.copyfileobj(source, f, COPY_BUFFER_SIZE)
+            else:
+                for chunk in source:
+                    f.write(chunk)
+    now = _utcnow()
+    job = Job(
+        user_id=user_id, kind=kind, status=QUEUED, params=params or {}, state={}, processed=0,
+        cancel_requested=False, attempts=0, created_at=now, updated_at=now
+    )
+    try:
+        db.add(job)
+        db.flush()
+        if upload is not None:
+            path = _job_path(shard, job.id, "in")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(upload, path)
+            upload = None
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        if upload is not None:
+            _remove(upload)
+    job_workers.notify()
+    return job_record(job)
+
+def get_job(db: Session, user_id: int, job_id: int) -> Optional[Dict]:
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == user_id).first()
+    return job_record(job) if job is not None else None
+
+def list_jobs(db: Session, user_id: int, limit: int = 20) -> List[Dict]:
+    """
+    Return a user's most recent jobs, newest first.
+    """
+    return [job_record(job) for job in db.query(Job).filter(Job.user_id == user_id).order_by(Job.id.desc()).limit(limit)]
+
+def cancel_job(db: Session, user_id: int, job_id: int) -> Optional[Dict]:
+    """
+    Cancel a job. A queued job is cancelled right away; a running one stops after its current chunk,
+    keeping the work already committed. Account deletion cannot be cancelled once it has started.
+    """
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == user_id).first()
+    if job is None:
+        return None
+    if job.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job has already {job.status}")
+    if job.kind == "delete_account" and (job.status == RUNNING or job.state):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account deletion cannot be cancelled once started")
+    now = _utcnow()
+    cancelled = db.execute(update(Job).where(Job.id == job_id, Job.status == QUEUED).values(
+        status=CANCELLED, cancel_requested=True, finished_at=now, updated_at=now
+    )).rowcount
+    if not cancelled:
+        db.execute(update(Job).where(Job.id == job_id).values(cancel_requested=True))
+    db.commit()
+    if cancelled:
+        _remove(_job_path(db.info.get("shard"), job_id, "in"))
+        jobs_finished.inc(job.kind, CANCELLED)
+    db.refresh(job)
+    return job_record(job)
+
+def job_result_file(db: Session, user_id: int, job_id: int) -> Tuple[str, str, str]:
+    """
+    Return (path, filename, media type) of a finished export job's file.
+    """
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == user_id).first()
+    if job is None or job.kind not in EXPORT_KINDS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job.status}")
+    path = _job_path(db.info.get("shard"), job.id, "out")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Job result has been purged")
+    return path, job.result["filename"], job.result["media_type"]
+
+def _claimable(now: datetime.datetime):
+    stale = now - datetime.timedelta(seconds=JOB_STALE_SECONDS)
+    return or_(Job.status == QUEUED, and_(Job.status == RUNNING, Job.updated_at < stale))
+
+def claim_job(db: Session) -> Optional[Job]:
+    """
+    Claim the oldest queued job of the session's database, or a running job whose worker stopped
+    sending checkpoints. The conditional UPDATE makes sure only one worker wins a job.
+    """
+    now = _utcnow()
+    candidates = [job_id for (job_id,) in db.query(Job.id).filter(_claimable(now)).order_by(Job.id).limit(CLAIM_CANDIDATES)]
+    for job_id in candidates:
+        claimed = db.execute(update(Job).where(Job.id == job_id, _claimable(now)).values(
+            status=RUNNING, attempts=Job.attempts + 1, updated_at=now
+        )).rowcount
+        db.commit()
+        if claimed:
+            return db.get(Job, job_id)
+    return None
+
+class JobContext:
+    """
+    What a job handler works with: the session, the job's parameters and resume state, and the calls
+    that record progress between chunks.
+    """
+    def __init__(self, db: Session, job: Job, stop: threading.Event):
+        self.db = db
+        self.shard = db.info.get("shard")
+        self.job_id = job.id
+        self.user_id = job.user_id
+        self.kind = job.kind
+        self.params = dict(job.params or {})
+        self.state = dict(job.state or {})
+        self.processed = job.processed or 0
+        self.total = job.total
+        self.attempt = job.attempts
+        self._stop = stop
+
+    def path(self, suffix: str) -> str:
+        return _job_path(self.shard, self.job_id, suffix)
+
+    def checkpoint(self, processed: Optional[int] = None, total: Optional[int] = None, **state):
+        """
+        Write progress and resume state in the session's current transaction, so they commit together
+        with the chunk of work around them. Raises JobLost if another worker has claimed the job.
+        """
+        self.state.update(state)
+        if processed is not None:
+            self.processed = processed
+        if total is not None:
+            self.total = total
+        updated = self.db.execute(update(Job).where(Job.id == self.job_id, Job.attempts == self.attempt).values(
+            state=self.state, processed=self.processed, total=self.total, updated_at=_utcnow()
+        )).rowcount
+        if not updated:
+            raise JobLost()
+
+    def next_chunk(self):
+        """
+        Commit, give other writers a moment with the database, and stop if the job was cancelled
+        or the worker pool is shutting down.
+        """
+        self.db.commit()
+        if self._stop.wait(JOB_CHUNK_PAUSE_MS / 1000):
+            raise JobInterrupted()
+        cancel_requested = self.db.query(Job.cancel_requested).filter(Job.id == self.job_id).scalar()
+        self.db.commit()
+        if cancel_requested:
+            raise JobCancelled()
+
+    def count_lines(self) -> int:
+        """
+        Count the lines of the job's (possibly gzipped) input file, for progress reporting.
+        """
+        with open(self.path("in"), "rb") as f:
+            compressed = f.read(2) == b"\x1f\x8b"
+            f.seek(0)
+            stream = gzip.GzipFile(fileobj=f, mode="rb") if compressed else f
+            count = 0
+            last = b"\n"
+            while True:
+                block = stream.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                count += block.count(b"\n")
+                last = block[-1:]
+        return count + (last != b"\n")
+
+def _error_reporter(stats: Dict, after_line: int = 0):
+    """
+    Return a `report_error` callback collecting import errors in `stats`, ignoring the lines
+    up to `after_line` that were already reported before the job was resumed.
+    """
+    def report_error(line_number, message):
+        if line_number <= after_line:
+            return
+        stats["failed"] += 1
+        if len(stats["errors"]) < IMPORT_MAX_REPORTED_ERRORS:
+            stats["errors"].append({"line": line_number, "error": message})
+    return report_error
+
+def _run_csv_import(ctx: JobContext) -> Dict:
+    """
+    Import an uploaded transactions CSV. Each batch commits together with the line it ends on,
+    so a resumed job skips exactly the rows already imported.
+    """
+    if ctx.total is None:
+        ctx.checkpoint(total=max(ctx.count_lines() - 1, 0))
+        ctx.next_chunk()
+    start_line = ctx.state.get("line", 0)
+    stats = ctx.state.get("stats") or {"imported": 0, "failed": 0, "batches": 0, "errors": []}
+    stats.setdefault("budget_alerts", []) # Missing from checkpoints of older versions
+    batch_size = ctx.params.get("batch_size") or JOB_CHUNK_SIZE
+    with open(ctx.path("in"), "rb") as f:
+        text_stream = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        try:
+            for line, batch in iter_csv_import_batches(text_stream, ctx.user_id, batch_size, _error_reporter(stats), start_line):
+                stats["imported"] += len(batch)
+                stats["batches"] += 1
+                ctx.checkpoint(processed=line - 1, line=line, stats=stats)
+                insert_transaction_batch(ctx.db, batch, ctx.user_id)
+                stats["budget_alerts"] += pop_budget_alerts(ctx.db) # Saved with the next checkpoint
+                ctx.next_chunk()
+        except UnicodeDecodeError:
+            raise ValueError(f"File is not valid UTF-8; {stats['imported']} transactions were imported before the error.")
+        finally:
+            text_stream.detach()
+    return stats
+
+def _run_data_import(ctx: JobContext) -> Dict:
+    """
+    Import an NDJSON data export (or an uploaded JSON backup converted to it). Backup imports skip
+    transactions already in the ledger, so a batch committed just before a crash is skipped when the
+    job resumes; the lines before the checkpoint are only re-read to replay their content sequence numbers.
+    """
+    if ctx.total is None:
+        ctx.checkpoint(total=ctx.count_lines())
+        ctx.next_chunk()
+    resume_line = ctx.state.get("line", 0)
+    stats = ctx.state.get("stats") or {"transactions": 0, "categories": 0, "skipped_transactions": 0, "failed": 0, "errors": []}
+    stats.setdefault("budget_alerts", []) # Missing from checkpoints of older versions
+    batch_size = ctx.params.get("batch_size") or JOB_CHUNK_SIZE
+    seen = defaultdict(int)
+    with open(ctx.path("in"), "rb") as f:
+        text_stream = open_export_file(f)
+        try:
+            for line, categories, batch in iter_export_batches(text_stream, batch_size, _error_reporter(stats, resume_line)):
+                if line <= resume_line:
+                    if batch:
+                        backup_transaction_rows(ctx.db, ctx.user_id, batch, seen)
+                    continue
+                import_export_batch(ctx.db, ctx.user_id, categories, batch, seen, stats)
+                stats["budget_alerts"] += pop_budget_alerts(ctx.db)
+                ctx.checkpoint(processed=line, line=line, stats=stats)
+                ctx.next_chunk()
+        except (UnicodeDecodeError, EOFError) as e:
+            raise ValueError(f"Invalid export file after {stats['transactions']} transactions: {e}")
+        finally:
+            text_stream.detach()
+            invalidate_categories(ctx.user_id)
+    return {
+        "imported_transactions": stats["transactions"],
+        "imported_categories": stats["categories"],
+        "skipped_transactions": stats["skipped_transactions"],
+        "failed": stats["failed"],
+        "errors": stats["errors"],
+        "budget_alerts": stats["budget_alerts"],
+    }
+
+def _write_export(ctx: JobContext, produce, filename: str, media_type: str) -> Dict:
+    """
+    Write an export to the job's result file, recording progress after every chunk of transactions.
+    Exports are cheap to redo, so a resumed export starts over.
+    """
+    ctx.checkpoint(processed=0, total=count_transactions(ctx.db, ctx.user_id))
+    ctx.next_chunk()
+    written = 0
+
+    def on_rows(count):
+        nonlocal written
+        written += count
+        ctx.checkpoint(processed=written)
+        ctx.next_chunk()
+
+    path = ctx.path("out")
+    part = path + ".part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if ctx.params.get("gzip"):
+        filename += ".gz"
+        media_type = "application/gzip"
+        output = gzip.open(part, "wt", encoding="utf-8", newline="")
+    else:
+        output = open(part, "w", encoding="utf-8", newline="")
+    try:
+        with output:
+            for chunk in produce(on_rows):
+                output.write(chunk)
+        os.replace(part, path)
+    finally:
+        _remove(part)
+    return {"filename": filename, "media_type": media_type, "size": os.path.getsize(path), "transactions": written}
+
+def _run_csv_export(ctx: JobContext) -> Dict:
+    return _write_export(
+        ctx, lambda on_rows: iter_transactions_csv(ctx.db, ctx.user_id, on_rows=on_rows), "transactions.csv", "text/csv"
+    )
+
+def _run_data_export(ctx: JobContext) -> Dict:
+    export_format = ctx.params.get("format", "json")
+    user = Principal(id=ctx.user_id, username=ctx.params["username"])
+    return _write_export(
+        ctx, lambda on_rows: iter_user_data_export(ctx.db, user, export_format, on_rows=on_rows),
+        f"stashup-data.{export_format}", "application/x-ndjson" if export_format == "ndjson" else "application/json"
+    )
+
+def _run_delete_account(ctx: JobContext) -> Dict:
+    """
+    Delete the account first, so it can no longer be used, then its transactions in chunks of
+    JOB_CHUNK_SIZE and finally the remaining categories and derived data. Other jobs of the account are cancelled.
+    """
+    db = ctx.db
+    if not ctx.state.get("account_deleted"):
+        total = db.query(func.count(Transaction.id)).filter(Transaction.user_id == ctx.user_id).scalar() + archive.count_archived(db, ctx.user_id)
+        ctx.checkpoint(processed=0, total=total, account_deleted=True)
+        db.query(UserShard).filter(UserShard.user_id == ctx.user_id).delete()
+        db.query(User).filter(User.id == ctx.user_id).delete()
+        db.execute(update(Job).where(
+            Job.user_id == ctx.user_id, Job.id != ctx.job_id, Job.status.in_((QUEUED, RUNNING))
+        ).values(cancel_requested=True))
+        db.commit()
+        invalidate_principal(ctx.user_id)
+        invalidate_categories(ctx.user_id)
+        shard_map_cache.delete(ctx.user_id)
+        logging.info(f"使用者 {ctx.user_id} 的帳號已刪除，開始分批刪除 {total} 筆交易")
+
+    deleted = ctx.processed
+    while True:
+        ids = [transaction_id for (transaction_id,) in db.query(Transaction.id).filter(
+            Transaction.user_id == ctx.user_id
+        ).order_by(Transaction.id).limit(JOB_CHUNK_SIZE)]
+        if not ids:
+            break
+        deleted += len(ids)
+        ctx.checkpoint(processed=deleted)
+        search.unindex_transactions(db, ids)
+        db.query(Transaction).filter(Transaction.id.in_(ids)).delete(synchronize_session=False)
+        ctx.next_chunk()
+    deleted += archive.delete_user_archive(db, ctx.user_id) # Whole year blocks at a time
+    ctx.checkpoint(processed=deleted)
+    delete_user_data(db, ctx.user_id)
+    db.commit()
+    return {"deleted_transactions": deleted}
+
+JOB_HANDLERS = {
+    "csv_import": _run_csv_import,
+    "csv_export": _run_csv_export,
+    "data_import": _run_data_import,
+    "data_export": _run_data_export,
+    "delete_account": _run_delete_account,
+}
+
+def _finish(ctx: JobContext, job_status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+    now = _utcnow()
+    values = {"status": job_status, "result": result, "error": error, "finished_at": now, "updated_at": now}
+    if job_status == SUCCEEDED and ctx.total is not None:
+        values["processed"] = ctx.total
+    finished = ctx.db.execute(update(Job).where(Job.id == ctx.job_id, Job.attempts == ctx.attempt).values(**values)).rowcount
+    ctx.db.commit()
+    if not finished:
+        return
+    _remove(ctx.path("in"))
+    if job_status != SUCCEEDED:
+        _remove(ctx.path("out"))
+    jobs_finished.inc(ctx.kind, job_status)
+
+def run_job(db: Session, job: Job, stop: threading.Event):
+    """
+    Run a claimed job to completion, cancellation or failure. When `stop` is set the job is put back
+    in the queue after its current chunk.
+    """
+    ctx = JobContext(db, job, stop)
+    started = time.perf_counter()
+    jobs_running.inc(ctx.kind)
+    try:
+        if ctx.attempt > JOB_MAX_ATTEMPTS:
+            raise RuntimeError(f"Gave up after {JOB_MAX_ATTEMPTS} attempts")
+        if job.cancel_requested:
+            raise JobCancelled()
+        result = JOB_HANDLERS[ctx.kind](ctx)
+    except JobInterrupted:
+        db.rollback()
+        db.execute(update(Job).where(Job.id == ctx.job_id, Job.attempts == ctx.attempt).values(status=QUEUED, updated_at=_utcnow()))
+        db.commit()
+        logging.info(f"背景工作 {ctx.job_id} ({ctx.kind}) 已暫停，將於下次啟動時繼續")
+    except JobLost:
+        db.rollback()
+        logging.warning(f"背景工作 {ctx.job_id} ({ctx.kind}) 已由其他工作執行緒接手")
+    except JobCancelled:
+        db.rollback()
+        _finish(ctx, CANCELLED)
+        logging.info(f"背景工作 {ctx.job_id} ({ctx.kind}) 已取消")
+    except Exception as e:
+        db.rollback()
+        logging.exception(f"背景工作 {ctx.job_id} ({ctx.kind}) 失敗: {e}")
+        _finish(ctx, FAILED, error=str(e) or type(e).__name__)
+    else:
+        _finish(ctx, SUCCEEDED, result=result)
+        logging.info(f"背景工作 {ctx.job_id} ({ctx.kind}) 完成，耗時 {time.perf_counter() - started:.1f} 秒")
+    finally:
+        jobs_running.inc(ctx.kind, amount=-1)
+
+def purge_finished_jobs(db: Session, retention_hours: float = JOB_RETENTION_HOURS) -> int:
+    """
+    Delete the jobs of the session's database that finished more than `retention_hours` ago, with their files.
+    """
+    cutoff = _utcnow() - datetime.timedelta(hours=retention_hours)
+    ids = [job_id for (job_id,) in db.query(Job.id).filter(Job.status.in_(FINISHED_STATUSES), Job.finished_at < cutoff)]
+    for job_id in ids:
+        _remove(_job_path(db.info.get("shard"), job_id, "in"))
+        _remove(_job_path(db.info.get("shard"), job_id, "out"))
+    for start in range(0, len(ids), JOB_CHUNK_SIZE):
+        db.query(Job).filter(Job.id.in_(ids[start:start + JOB_CHUNK_SIZE])).delete(synchronize_session=False)
+        db.commit()
+    return len(ids)
+
+class JobWorkerPool:
+    """
+    Worker threads that claim queued jobs from every database and run them.
+    Several processes may run pools against the same databases.
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._rotation = itertools.count()
+        self._last_purge = None
+
+    def start(self):
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            self._stop.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"stashup-job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        """
+        Wake an idle worker after a job was queued.
+        """
+        self._wakeup.set()
+
+    def shutdown(self, timeout: float = 10.0):
+        """
+        Stop the workers. Running jobs stop after their current chunk and resume on the next start.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stop.set()
+        self._wakeup.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def _claim(self) -> Tuple[Optional[Session], Optional[Job]]:
+        # Start at a different database each time, so a busy shard cannot starve the others
+        shards = data_shards()
+        offset = next(self._rotation) % len(shards)
+        for shard in shards[offset:] + shards[:offset]:
+            db = SessionLocal(info={"shard": shard})
+            try:
+                job = claim_job(db)
+            except Exception:
+                db.close()
+                raise
+            if job is not None:
+                return db, job
+            db.close()
+        return None, None
+
+    def _purge(self):
+        with self._lock:
+            if self._last_purge is not None and time.monotonic() - self._last_purge < JOB_PURGE_INTERVAL:
+                return
+            self._last_purge = time.monotonic()
+        for shard in data_shards():
+            db = SessionLocal(info={"shard": shard})
+            try:
+                purge_finished_jobs(db)
+            finally:
+                db.close()
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                db, job = self._claim()
+                if job is None:
+                    self._purge()
+                    self._wakeup.wait(JOB_POLL_SECONDS)
+                    self._wakeup.clear()
+                    continue
+                try:
+                    run_job(db, job, self._stop)
+                finally:
+                    db.close()
+            except Exception as e:
+                logging.error(f"背景工作執行緒發生錯誤: {e}")
+                self._stop.wait(JOB_POLL_SECONDS)
+
+job_workers = JobWorkerPool(workers=JOB_WORKERS)
+
+def job_status_counts() -> Dict:
+    """
+    Return the number of jobs per status in each database.
+    """
+    counts = {}
+    for shard in data_shards():
+        db = SessionLocal(info={"shard": shard})
+        try:
+            counts["directory" if shard is None else shard] = dict(db.query(Job.status, func.count()).group_by(Job.status).all())
+        finally:
+            db.close()
+    return counts
+
+if __name__ == "__main__":
+    # Usage: python -m app.crud.jobs status|purge|work
+    usage = "Usage: python -m app.crud.jobs status|purge|work"
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    create_schema()
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "status":
+        print(job_status_counts())
+    elif command == "purge":
+        purged = 0
+        for shard in data_shards():
+            db = SessionLocal(info={"shard": shard})
+            try:
+                purged += purge_finished_jobs(db)
+            finally:
+                db.close()
+        print(f"Purged {purged} jobs")
+    elif command == "work":
+        # A dedicated worker process, for servers started with JOB_WORKERS=0
+        pool = JobWorkerPool(workers=max(JOB_WORKERS, 1))
+        pool.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.shutdown()
+    else:
+        print(usage)
+        sys.exit(1)
@@ -0,0 +1,267 @@
+import re
+import sys
+import logging
+from typing import Callable, Iterable, List, Optional, Tuple
+from sqlalchemy import text, Integer, Float
+from sqlalchemy.orm import Session
+
+from app.models.models import Transaction
+
+# Full-text search over transaction descriptions and categories, backed by a SQLite FTS5 shadow table.
+# The table is keyed by the transaction id (rowid) and kept in sync by app/crud/crud.py.
+#
+# FTS5's unicode61 tokenizer treats a run of Chinese characters as one token, so "午餐便當" could only
+# be found by searching for the whole run. We segment CJK text into single characters before indexing
+# and turn each CJK search term into a phrase query, which matches any substring of a description.
+#
+# Categories are indexed by id (a "c<id>" token) rather than by name, so renaming a category never
+# touches the index. At query time each term is matched against the user's category names and
+# expanded to the ids of the categories it matches.
+#
+# The index is shared by all users. Each row also carries its owner as an indexed "u<id>" token, which
+# `match_subquery` ANDs into every MATCH expression, so FTS5 only walks the posting lists of the
+# caller's own documents instead of filtering every user's matches afterwards.
+#
+# Archived transactions (see app/crud/archive.py) are removed from the index; `text_matcher` applies
+# the same matching rules to them in Python.
+FTS_TABLE = "transactions_fts"
+FTS_COLUMNS = "description, category_id, user_token"
+FTS_BATCH_SIZE = 1000
+
+_CJK = "[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]"
+_TOKEN_RE = re.compile(rf"{_CJK}|(?:(?!{_CJK})[^\W_])+")
+_CJK_RE = re.compile(_CJK)
+
+_fts_support = {}
+
+def search_enabled(db: Session) -> bool:
+    """
+    Return True if the session's database supports the FTS5 search index.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "sqlite":
+        return False
+    url = bind.engine.url # The bind may be an Engine or, for group-commit sessions, a Connection
+    if url not in _fts_support:
+        try:
+            db.execute(text("SELECT fts5(NULL)"))
+            _fts_support[url] = True
+        except Exception:
+            _fts_support[url] = False
+        if not _fts_support[url]:
+            logging.warning("SQLite 未編譯 FTS5，關鍵字搜尋將退回 LIKE 查詢")
+    return _fts_support[url]
+
+def segment(value: Optional[str]) -> str:
+    """
+    Split text into the tokens stored in the index: one token per CJK character, one per other word.
+    """
+    return " ".join(_TOKEN_RE.findall(value or ""))
+
+def _category_token(category_id: int) -> str:
+    return f"c{category_id}"
+
+def _user_token(user_id: int) -> str:
+    return f"u{user_id}"
+
+def _term_matches(term_tokens: List[str], prefix: bool, text_tokens: List[str]) -> bool:
+    """
+    Return True if the term's tokens occur contiguously in the text's tokens, with the same
+    case-insensitive, optional last-token-prefix semantics as the FTS phrase query.
+    """
+    term_tokens = [token.casefold() for token in term_tokens]
+    text_tokens = [token.casefold() for token in text_tokens]
+    for start in range(len(text_tokens) - len(term_tokens) + 1):
+        window = text_tokens[start:start + len(term_tokens)]
+        if window[:-1] != term_tokens[:-1]:
+            continue
+        if window[-1] == term_tokens[-1] or (prefix and window[-1].startswith(term_tokens[-1])):
+            return True
+    return False
+
+def _search_terms(query: str, categories: Iterable[Tuple[int, str]]) -> List[Tuple[List[str], bool, List[int]]]:
+    """
+    Split a search string into (tokens, prefix, ids of the categories whose name matches) per term.
+    """
+    category_tokens = [(category_id, _TOKEN_RE.findall(name or "")) for category_id, name in categories]
+    terms = []
+    for term in query.split():
+        tokens = _TOKEN_RE.findall(term)
+        if not tokens:
+            continue
+        prefix = not _CJK_RE.fullmatch(tokens[-1])
+        category_ids = [category_id for category_id, name_tokens in category_tokens if _term_matches(tokens, prefix, name_tokens)]
+        terms.append((tokens, prefix, category_ids))
+    return terms
+
+def build_match_query(query: str, categories: Iterable[Tuple[int, str]] = ()) -> Optional[str]:
+    """
+    Translate a user search string into an FTS5 MATCH expression.
+    Every whitespace-separated term must match (AND), either in the description or in the name of
+    one of `categories` ((id, name) pairs). CJK characters within a term must be adjacent, and a term
+    ending in a Latin word also matches longer words with that prefix.
+    Returns None if the query contains nothing searchable.
+    """
+    clauses = []
+    for tokens, prefix, category_ids in _search_terms(query, categories):
+        phrase = '"' + " ".join(token.replace('"', '""') for token in tokens) + '"'
+        if prefix:
+            phrase += " *"
+        alternatives = [f"description : {phrase}"] + [f"category_id : {_category_token(category_id)}" for category_id in category_ids]
+        clauses.append(alternatives[0] if len(alternatives) == 1 else "(" + " OR ".join(alternatives) + ")")
+    return " AND ".join(clauses) if clauses else None
+
+def text_matcher(query: str, categories: Iterable[Tuple[int, str]] = ()) -> Optional[Callable[[Optional[str], Optional[int]], bool]]:
+    """
+    Return a predicate (description, category_id) -> bool that matches what `build_match_query` matches,
+    for transactions outside the index (archived ones). Returns None if the query contains nothing searchable.
+    """
+    terms = [(tokens, prefix, set(category_ids)) for tokens, prefix, category_ids in _search_terms(query, categories)]
+    if not terms:
+        return None
+
+    def matches(description: Optional[str], category_id: Optional[int]) -> bool:
+        text_tokens = _TOKEN_RE.findall(description or "")
+        return all(category_id in category_ids or _term_matches(tokens, prefix, text_tokens) for tokens, prefix, category_ids in terms)
+    return matches
+
+def _create_table(db: Session):
+    db.execute(text(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({FTS_COLUMNS}, tokenize='unicode61')"))
+
+def ensure_search_index(db: Session):
+    """
+    Create the FTS5 table if needed, and fill it once if the ledger predates it
+    (or predates indexing categories by id or owners by token).
+    """
+    if not search_enabled(db):
+        return
+    columns = {row[1] for row in db.execute(text(f"PRAGMA table_info({FTS_TABLE})"))}
+    if columns and "user_token" not in columns:
+        rebuild_search_index(db)
+        return
+    _create_table(db)
+    db.commit()
+    index_empty = db.execute(text(f"SELECT rowid FROM {FTS_TABLE} LIMIT 1")).first() is None
+    if index_empty and db.query(Transaction.id).first() is not None:
+        rebuild_search_index(db)
+
+def rebuild_search_index(db: Session):
+    """
+    Re-index every transaction from scratch, in batches ordered by id.
+    """
+    if not search_enabled(db):
+        return 0
+    db.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    _create_table(db)
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = db.query(
+            Transaction.id, Transaction.user_id, Transaction.description, Transaction.category_id
+        ).filter(Transaction.id > last_id).order_by(Transaction.id).limit(FTS_BATCH_SIZE).all()
+        if not batch:
+            break
+        _insert_rows(db, batch)
+        indexed += len(batch)
+        last_id = batch[-1].id
+    db.commit()
+    logging.info(f"全文檢索索引已重建，共 {indexed} 筆交易")
+    return indexed
+
+def _insert_rows(db: Session, rows: Iterable):
+    """
+    Insert (id, user_id, description, category_id) rows into the index.
+    """
+    params = [
+        {"id": row.id, "description": segment(row.description), "category_id": _category_token(row.category_id), "user_token": _user_token(row.user_id)}
+        for row in rows
+    ]
+    if params:
+        db.execute(text(
+            f"INSERT INTO {FTS_TABLE} (rowid, description, category_id, user_token) "
+            "VALUES (:id, :description, :category_id, :user_token)"
+        ), params)
+
+def index_transactions(db: Session, rows: Iterable):
+    """
+    Add or replace index entries for transactions (objects with id, user_id, description and category_id).
+    """
+    if not search_enabled(db):
+        return
+    rows = list(rows)
+    unindex_transactions(db, [row.id for row in rows])
+    _insert_rows(db, rows)
+
+def unindex_transactions(db: Session, transaction_ids: Iterable[int]):
+    """
+    Remove index entries for the given transaction ids.
+    """
+    if not search_enabled(db):
+        return
+    ids = list(transaction_ids)
+    for start in range(0, len(ids), FTS_BATCH_SIZE):
+        db.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), [{"id": i} for i in ids[start:start + FTS_BATCH_SIZE]])
+
+def unindex_user(db: Session, user_id: int):
+    """
+    Remove every index entry of a user. Must run before the user's transactions are deleted.
+    """
+    if not search_enabled(db):
+        return
+    db.execute(text(
+        f"DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT id FROM transactions WHERE user_id = :user_id)"
+    ), {"user_id": user_id})
+
+def reindex_category(db: Session, transaction_ids: Iterable[int], category_id: int):
+    """
+    Point the index entries of transactions at a new category after a bulk re-categorization.
+    """
+    if not search_enabled(db):
+        return
+    ids = list(transaction_ids)
+    token = _category_token(category_id)
+    for start in range(0, len(ids), FTS_BATCH_SIZE):
+        db.execute(
+            text(f"UPDATE {FTS_TABLE} SET category_id = :token WHERE rowid = :id"),
+            [{"token": token, "id": i} for i in ids[start:start + FTS_BATCH_SIZE]]
+        )
+
+def _user_match_query(user_id: int, match_query: str) -> str:
+    return f"user_token : {_user_token(user_id)} AND ({match_query})"
+
+def match_subquery(user_id: int, match_query: str):
+    """
+    Return a SELECT of (id, score) for a user's transactions matching an FTS5 expression.
+    Lower scores are more relevant; description matches weigh twice as much as category matches.
+    The subquery must drive the join it is used in: as the inner side of a join SQLite runs the
+    whole MATCH once per outer row. Callers that do not need the score filter on `match_ids` instead.
+    """
+    return text(
+        f"SELECT rowid AS id, bm25({FTS_TABLE}, 2.0, 1.0, 0.0) AS score FROM {FTS_TABLE} "
+        f"WHERE {FTS_TABLE} MATCH :match_query"
+    ).bindparams(match_query=_user_match_query(user_id, match_query)).columns(id=Integer, score=Float).subquery()
+
+def match_ids(user_id: int, match_query: str):
+    """
+    Return a SELECT of the ids of a user's transactions matching an FTS5 expression, for an
+    `id IN (...)` filter: SQLite runs the MATCH once and probes the result for each row.
+    """
+    return text(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match_query"
+    ).bindparams(match_query=_user_match_query(user_id, match_query)).columns(rowid=Integer)
+
+if __name__ == "__main__":
+    # Usage: python -m app.crud.search rebuild
+    from app.models.database import SessionLocal, create_schema, data_shards
+
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python -m app.crud.search rebuild")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    create_schema()
+    for shard in data_shards():
+        db = SessionLocal(info={"shard": shard})
+        try:
+            rebuild_search_index(db)
+        finally:
+            db.close()
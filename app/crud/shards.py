@@ -0,0 +1,232 @@
+import sys
+import time
+import logging
+from itertools import islice
+from typing import List, Optional, Tuple
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app.models.database import SessionLocal, SHARD_COUNT, create_schema, data_shards
+from app.models.models import User, UserShard, Transaction, Category, ChangeLogHorizon, Budget
+from app.crud.crud import delete_user_data, insert_transaction_batch, seed_default_categories, resolve_category_ids
+from app.crud import changes, archive
+from app.core.cache import SHARD_MAP_CACHE_TTL
+
+# Shard assignment and the online tool that moves users between databases (see "Sharding" in
+# app/models/database.py). A move marks the user as moving, waits until every server's shard map
+# cache has seen the flag (requests for the user get 503 meanwhile), copies the ledger to the target
+# shard, switches the assignment and finally deletes the data from the source.
+MOVE_BATCH_SIZE = 1000
+MOVE_GROUP_SIZE = 50
+
+def get_user_shard_assignment(db: Session, user_id: int) -> Tuple[Optional[int], bool]:
+    """
+    Return (shard, moving) for a user; unassigned users live in the directory database (shard None).
+    """
+    row = db.query(UserShard.shard, UserShard.moving).filter(UserShard.user_id == user_id).first()
+    return (row.shard, bool(row.moving)) if row else (None, False)
+
+def _shard_loads(db: Session) -> dict:
+    """
+    Return the number of users assigned to each shard, including empty shards.
+    """
+    loads = {shard: 0 for shard in range(SHARD_COUNT)}
+    for shard, count in db.query(UserShard.shard, func.count()).filter(UserShard.shard != None).group_by(UserShard.shard):
+        loads[shard] = count
+    return loads
+
+def _least_loaded(loads: dict) -> int:
+    return min(range(SHARD_COUNT), key=lambda shard: (loads.get(shard, 0), shard))
+
+def assign_user_shard(db: Session, user_id: int) -> int:
+    """
+    Assign a new user to the shard with the fewest users.
+    """
+    shard = _least_loaded(_shard_loads(db))
+    db.add(UserShard(user_id=user_id, shard=shard, moving=False))
+    db.commit()
+    return shard
+
+def _copy_user_data(source: Session, target: Session, user_id: int) -> int:
+    """
+    Copy a user's categories, transactions and budgets into the target database, rebuilding derived data there.
+    Transactions get new ids in the target, so every older change-log version is put behind the horizon.
+    Archived transactions arrive as ordinary rows; the next archive compaction of the target archives them again.
+    """
+    delete_user_data(target, user_id) # Leftovers of an interrupted move
+    for category in source.query(Category).filter(Category.user_id == user_id):
+        target.add(Category(name=category.name, type=category.type, user_id=user_id))
+    target.flush() # Sessions do not autoflush, and resolve_category_ids must see the copied categories
+    copied = 0
+    last_id = 0
+    while True:
+        batch = source.query(Transaction).filter(
+            Transaction.user_id == user_id, Transaction.id > last_id
+        ).order_by(Transaction.id).limit(MOVE_BATCH_SIZE).all()
+        if not batch:
+            break
+        copied += insert_transaction_batch(target, [
+            {"type": t.type, "description": t.description, "amount": t.amount, "category": t.category, "date": t.date, "user_id": user_id}
+            for t in batch
+        ], user_id)
+        last_id = batch[-1].id
+    category_names = {
+        cat.id: cat.name for cat in source.query(Category.id, Category.name).filter(or_(Category.user_id == None, Category.user_id == user_id))
+    }
+    archived = archive.iter_archived_rows(source, archive.get_blocks(source, user_id))
+    while True:
+        batch = list(islice(archived, MOVE_BATCH_SIZE))
+        if not batch:
+            break
+        copied += insert_transaction_batch(target, [
+            {"type": t.type, "description": t.description, "amount": t.amount, "category": category_names.get(t.category_id), "date": t.date, "user_id": user_id}
+            for t in batch
+        ], user_id)
+    # Category ids differ between databases, so budgets are matched to their category by type and name
+    user_budgets = source.query(Budget, Category.type, Category.name).join(Category, Category.id == Budget.category_id).filter(Budget.user_id == user_id).all()
+    category_ids = resolve_category_ids(target, user_id, {(cat_type, name) for _, cat_type, name in user_budgets})
+    for budget, cat_type, name in user_budgets:
+        target.add(Budget(user_id=user_id, category_id=category_ids[(cat_type, name)], amount=budget.amount, warn_percent=budget.warn_percent))
+    target.merge(ChangeLogHorizon(user_id=user_id, version=changes.get_current_version(target, user_id)))
+    target.commit()
+    return copied
+
+def move_users(moves: List[Tuple[int, int]], wait: float = SHARD_MAP_CACHE_TTL * 2) -> int:
+    """
+    Move each (user_id, target shard) pair. All users of the call are marked as moving together,
+    so the cache wait is paid once per call. Returns the number of users moved.
+    """
+    directory = SessionLocal()
+    try:
+        assignments = []
+        for user_id, target in moves:
+            assignment = directory.get(UserShard, user_id)
+            if assignment is None:
+                assignment = UserShard(user_id=user_id, shard=None)
+                directory.add(assignment)
+            if assignment.shard != target:
+                assignment.moving = True
+                assignments.append((assignment, target))
+        directory.commit()
+        if not assignments:
+            return 0
+        time.sleep(wait)
+
+        moved = 0
+        for assignment, target in assignments:
+            source_db = SessionLocal(info={"shard": assignment.shard})
+            target_db = SessionLocal(info={"shard": target})
+            try:
+                copied = _copy_user_data(source_db, target_db, assignment.user_id)
+                source = assignment.shard
+                assignment.shard = target
+                assignment.moving = False
+                directory.commit()
+                delete_user_data(source_db, assignment.user_id)
+                source_db.commit()
+                moved += 1
+                logging.info(f"使用者 {assignment.user_id} 已從 {source} 移至分片 {target}，共 {copied} 筆交易")
+            except Exception as e:
+                source_db.rollback()
+                target_db.rollback()
+                directory.rollback()
+                assignment.moving = False
+                directory.commit()
+                logging.error(f"移動使用者 {assignment.user_id} 失敗，資料仍保留在原位置: {e}")
+            finally:
+                source_db.close()
+                target_db.close()
+        return moved
+    finally:
+        directory.close()
+
+def _move_in_groups(moves: List[Tuple[int, int]]) -> int:
+    moved = 0
+    for start in range(0, len(moves), MOVE_GROUP_SIZE):
+        moved += move_users(moves[start:start + MOVE_GROUP_SIZE])
+    return moved
+
+def migrate_unassigned_users() -> int:
+    """
+    Move every user whose data is still in the directory database to the least loaded shard.
+    """
+    directory = SessionLocal()
+    try:
+        loads = _shard_loads(directory)
+        unassigned = directory.query(User.id).outerjoin(UserShard, UserShard.user_id == User.id).filter(
+            UserShard.shard == None
+        ).order_by(User.id).all()
+        moves = []
+        for (user_id,) in unassigned:
+            shard = _least_loaded(loads)
+            loads[shard] += 1
+            moves.append((user_id, shard))
+    finally:
+        directory.close()
+    return _move_in_groups(moves)
+
+def rebalance_shards() -> int:
+    """
+    Even out the number of users per shard, first moving users off shards beyond STASHUP_SHARDS.
+    """
+    directory = SessionLocal()
+    try:
+        loads = _shard_loads(directory)
+        users_by_shard = {}
+        for user_id, shard in directory.query(UserShard.user_id, UserShard.shard).filter(UserShard.shard != None).order_by(UserShard.user_id):
+            users_by_shard.setdefault(shard, []).append(user_id)
+    finally:
+        directory.close()
+    moves = []
+    for shard in [shard for shard in users_by_shard if shard >= SHARD_COUNT]:
+        for user_id in users_by_shard.pop(shard):
+            target = _least_loaded(loads)
+            loads[target] += 1
+            moves.append((user_id, target))
+        loads.pop(shard, None)
+    while True:
+        busiest = max(range(SHARD_COUNT), key=lambda shard: loads[shard])
+        idlest = _least_loaded(loads)
+        if loads[busiest] - loads[idlest] <= 1:
+            break
+        moves.append((users_by_shard[busiest].pop(), idlest))
+        loads[busiest] -= 1
+        loads[idlest] += 1
+    return _move_in_groups(moves)
+
+def shard_status() -> dict:
+    directory = SessionLocal()
+    try:
+        total = directory.query(func.count(User.id)).scalar()
+        loads = _shard_loads(directory)
+        return {"unassigned": total - sum(loads.values()), "shards": loads}
+    finally:
+        directory.close()
+
+if __name__ == "__main__":
+    # Usage: python -m app.crud.shards status|migrate|rebalance|move <user_id> <shard>
+    usage = "Usage: python -m app.crud.shards status|migrate|rebalance|move <user_id> <shard>"
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if SHARD_COUNT <= 0:
+        print("Sharding is disabled; set STASHUP_SHARDS to the number of shards.")
+        sys.exit(1)
+    create_schema()
+    for shard in data_shards():
+        # Transactions are copied by category name, so the system categories must exist on every shard
+        db = SessionLocal(info={"shard": shard})
+        try:
+            seed_default_categories(db)
+        finally:
+            db.close()
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "status":
+        print(shard_status())
+    elif command == "migrate":
+        print(f"Moved {migrate_unassigned_users()} users")
+    elif command == "rebalance":
+        print(f"Moved {rebalance_shards()} users")
+    elif command == "move" and len(sys.argv) == 4:
+        print(f"Moved {move_users([(int(sys.argv[2]), int(sys.argv[3]))])} users")
+    else:
+        print(usage)
+        sys.exit(1)
@@ -1,13 +1,202 @@
 import os
-from sqlalchemy import create_engine
+import asyncio
+import threading
+from typing import List, Optional
+from sqlalchemy import create_engine, event, make_url, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+from app.models.writer import GroupCommitWriter
+from app.core.metrics import instrument_engine
 
 # Database Setup
-DATABASE_URL = "sqlite:///./stashup.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The storage layer is configured through environment variables. For SQLite, every connection gets the
+# pragmas below on connect. WAL journaling lets readers and the writer work at the same time, so read-only
+# requests are served from a separate pool of query_only connections (see `get_async_db`).
+DATABASE_URL = os.getenv("STASHUP_DATABASE_URL", "sqlite:///./stashup.db")
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL") # NORMAL is durable across app crashes in WAL mode
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-20000")) # Negative values are KiB, so about 20 MB per connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+READ_POOL_SIZE = int(os.getenv("STASHUP_READ_POOL_SIZE", "8"))
+def apply_sqlite_pragmas(engine, readonly: bool = False):
+    """
+    Apply the configured pragmas to every new connection of a SQLite engine (sync or async).
+    Read-only connections skip journal_mode, which needs write access, and refuse writes with query_only.
+    """
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not readonly:
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        if readonly:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def to_async_url(url: str) -> str:
+    """
+    Derive the aiosqlite URL of a SQLite database URL.
+    """
+    return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+def create_storage_engine(url: str = DATABASE_URL, readonly: bool = False, **kwargs):
+    """
+    Create a sync engine for a database, with SQLite pragmas applied on connect and query instrumentation.
+    """
+    if not is_sqlite(url):
+        engine = create_engine(url, **kwargs)
+    else:
+        engine = create_engine(url, connect_args={"check_same_thread": False}, **kwargs)
+        apply_sqlite_pragmas(engine, readonly=readonly)
+    instrument_engine(engine)
+    return engine
+
+# Async Database Setup
+# STASHUP_DB_MODE=async serves API requests through an aiosqlite engine on the event loop;
+# the default "sync" mode runs each database call on Starlette's threadpool instead.
+DB_MODE = os.getenv("STASHUP_DB_MODE", "sync")
+ASYNC_DATABASE_URL = os.getenv("STASHUP_ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+# Group Commit
+# STASHUP_GROUP_COMMIT=1 sends API writes through a single writer thread that commits the writes
+# arriving within GROUP_COMMIT_WINDOW_MS of each other in one transaction (see app/models/writer.py).
+GROUP_COMMIT = os.getenv("STASHUP_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "128"))
+
+# Sharding
+# STASHUP_SHARDS=N spreads users over N SQLite files in STASHUP_SHARD_DIR, each with its own write lock.
+# Users and their shard assignments stay in the directory database (DATABASE_URL). Users without an
+# assignment (accounts created before sharding was enabled) keep their data in the directory database
+# until `python -m app.crud.shards migrate` moves them.
+SHARD_COUNT = int(os.getenv("STASHUP_SHARDS", "0"))
+SHARD_DIR = os.getenv("STASHUP_SHARD_DIR", "./shards")
+DIRECTORY_TABLES = ("users", "user_shards")
+
+class Storage:
+    """
+    The engines of one physical database: the writer, the read-only pool, their async counterparts
+    (async mode only) and the group-commit writer (group-commit mode only).
+    """
+    def __init__(self, url: str, async_url: str):
+        self.url = url
+        self.engine = create_storage_engine(url)
+        if is_sqlite(url):
+            self.read_engine = create_storage_engine(url, readonly=True, pool_size=READ_POOL_SIZE, max_overflow=READ_POOL_SIZE)
+        else:
+            self.read_engine = self.engine
+        if DB_MODE == "async":
+            self.async_engine = create_async_engine(async_url)
+            instrument_engine(self.async_engine.sync_engine)
+            if is_sqlite(url):
+                apply_sqlite_pragmas(self.async_engine.sync_engine)
+                self.async_read_engine = create_async_engine(async_url, pool_size=READ_POOL_SIZE, max_overflow=READ_POOL_SIZE)
+                instrument_engine(self.async_read_engine.sync_engine)
+                apply_sqlite_pragmas(self.async_read_engine.sync_engine, readonly=True)
+            else:
+                self.async_read_engine = self.async_engine
+        else:
+            self.async_engine = None
+            self.async_read_engine = None
+        if GROUP_COMMIT:
+            self.group_writer = GroupCommitWriter(create_storage_engine(url), GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH)
+        else:
+            self.group_writer = None
+
+    def bind(self, readonly: bool, use_async: bool):
+        """
+        Return the sync engine a session should use (for async sessions, the async engine's sync facade).
+        """
+        if use_async:
+            return (self.async_read_engine if readonly else self.async_engine).sync_engine
+        return self.read_engine if readonly else self.engine
+
+directory = Storage(DATABASE_URL, ASYNC_DATABASE_URL)
+engine = directory.engine
+read_engine = directory.read_engine
+async_engine = directory.async_engine
+group_writer = directory.group_writer
+
+_shards = {}
+_shards_lock = threading.Lock()
+
+def shard_url(shard: int) -> str:
+    return f"sqlite:///{os.path.join(SHARD_DIR, f'shard_{shard:03d}.db')}"
+
+def storage_for(shard: Optional[int]) -> Storage:
+    """
+    Return the storage of a shard, creating its engines on first use; None is the directory database.
+    """
+    if shard is None:
+        return directory
+    with _shards_lock:
+        if shard not in _shards:
+            os.makedirs(SHARD_DIR, exist_ok=True)
+            url = shard_url(shard)
+            _shards[shard] = Storage(url, to_async_url(url))
+        return _shards[shard]
+
+def data_shards() -> List[Optional[int]]:
+    """
+    Every location that may hold ledger data: the directory database, then each shard.
+    """
+    return [None] + list(range(SHARD_COUNT))
+
+def all_storages() -> List[Storage]:
+    return [directory] + list(_shards.values())
+
+class RoutingSession(Session):
+    """
+    Session that sends the directory tables (users, shard assignments) to the directory database
+    and every other statement to the shard in `info["shard"]`. Without sharding the shard is always
+    None and everything goes to the directory database.
+    """
+    def get_bind(self, mapper=None, clause=None, **kw):
+        shard = self.info.get("shard")
+        if mapper is not None and mapper.local_table.name in DIRECTORY_TABLES:
+            shard = None
+        return storage_for(shard).bind(self.info.get("readonly", False), self.info.get("async", False))
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, info={"readonly": False})
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, info={"readonly": True})
 Base = declarative_base()
+if DB_MODE == "async":
+    AsyncSessionLocal = async_sessionmaker(
+        sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False, info={"readonly": False, "async": True}
+    )
+    AsyncReadSessionLocal = async_sessionmaker(
+        sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False, info={"readonly": True, "async": True}
+    )
+else:
+    AsyncSessionLocal = None
+    AsyncReadSessionLocal = None
+
+def group_commit_stats() -> Optional[dict]:
+    """
+    Return the group-commit writer statistics per database, or None if group commit is disabled.
+    """
+    if not GROUP_COMMIT:
+        return None
+    return {("directory" if storage is directory else storage.url): storage.group_writer.stats() for storage in all_storages()}
+
+def shutdown_storage():
+    """
+    Flush pending group-commit writes of every database.
+    """
+    for storage in all_storages():
+        if storage.group_writer is not None:
+            storage.group_writer.shutdown()
 
 def get_db():
     """
@@ -17,4 +206,133 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def ensure_indexes(bind=engine, tables=None):
+    """
+    Create any index declared on the models that is missing from an existing database.
+    `Base.metadata.create_all` only creates indexes together with new tables.
+    """
+    for table in tables or Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+# Derived tables that may simply be dropped when their columns changed; they are recreated empty
+# and rebuilt on startup (see ensure_rollups in app/crud/crud.py).
+REBUILDABLE_TABLES = ("transaction_rollups",)
+
+def upgrade_schema(bind=engine):
+    """
+    Bring a database created by an older version up to the current models where `create_all` cannot:
+    add model columns missing from existing tables and drop rebuildable tables whose columns changed.
+    Data migrations for the new columns run on startup.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            if table.name in REBUILDABLE_TABLES and not columns.issuperset(table.columns.keys()):
+                conn.execute(text(f"DROP TABLE {table.name}"))
+                continue
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"))
+
+def create_schema():
+    """
+    Create missing tables and indexes. The directory database gets every table (it keeps the data of
+    users not yet assigned to a shard); each shard gets every table except the directory ones.
+    """
+    upgrade_schema()
+    Base.metadata.create_all(bind=engine)
+    ensure_indexes()
+    data_tables = [table for table in Base.metadata.sorted_tables if table.name not in DIRECTORY_TABLES]
+    for shard in range(SHARD_COUNT):
+        shard_engine = storage_for(shard).engine
+        upgrade_schema(shard_engine)
+        Base.metadata.create_all(bind=shard_engine, tables=data_tables)
+        ensure_indexes(shard_engine, data_tables)
+
+class AsyncDB:
+    """
+    Awaitable wrapper around a request's database session, used by the async API routers.
+    The CRUD functions are written against a sync `Session`; `run` executes one of them either
+    through `AsyncSession.run_sync` (async mode, no thread involved) or on the threadpool (sync mode),
+    so a request only occupies a worker thread while it is actually talking to the database.
+    Read-only requests get a session from the reader pool (`readonly=True`).
+    With sharding, `route` points the session's ledger queries at the current user's shard.
+    """
+    def __init__(self, session, readonly: bool = False):
+        self.session = session
+        self.readonly = readonly
+        self.shard = None
+
+    def route(self, shard: Optional[int]):
+        """
+        Send this request's ledger queries to a shard (None is the directory database).
+        """
+        self.shard = shard
+        sync_session = self.session.sync_session if isinstance(self.session, AsyncSession) else self.session
+        sync_session.info["shard"] = shard
+
+    def new_session(self, readonly: Optional[bool] = None) -> Session:
+        """
+        Open a separate sync session routed like this one, for work on another thread or outliving the request.
+        Pass `readonly=False` for a writable session in a read-only (GET) request.
+        """
+        readonly = self.readonly if readonly is None else readonly
+        return (ReadSessionLocal if readonly else SessionLocal)(info={"shard": self.shard})
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run `fn(session, *args, **kwargs)` and return its result.
+        """
+        if isinstance(self.session, AsyncSession):
+            return await self.session.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+    async def write(self, fn, *args, **kwargs):
+        """
+        Run a short mutating CRUD function. With group commit enabled it runs on the writer thread
+        and returns once the batch it joined has committed; otherwise it behaves like `run`.
+        """
+        writer = storage_for(self.shard).group_writer
+        if writer is None:
+            return await self.run(fn, *args, **kwargs)
+        return await asyncio.wrap_future(writer.submit(fn, *args, **kwargs))
+
+    async def run_blocking(self, fn, *args, readonly: Optional[bool] = None, **kwargs):
+        """
+        Run a long, CPU-heavy or file-reading CRUD function on the threadpool with its own sync session,
+        so it never stalls the event loop even in async mode. `readonly` is passed on to `new_session`.
+        """
+        def call():
+            db = self.new_session(readonly)
+            try:
+                return fn(db, *args, **kwargs)
+            finally:
+                db.close()
+        return await run_in_threadpool(call)
+
+READ_ONLY_METHODS = ("GET", "HEAD", "OPTIONS")
+
+async def get_async_db(request: Request):
+    """
+    Dependency to get an awaitable database session for async routers.
+    GET/HEAD/OPTIONS requests are routed to the read-only connection pool, so they never wait
+    behind a write and cannot take the write lock themselves.
+    """
+    readonly = request.method in READ_ONLY_METHODS
+    if AsyncSessionLocal is not None:
+        session_factory = AsyncReadSessionLocal if readonly else AsyncSessionLocal
+        async with session_factory() as session:
+            yield AsyncDB(session, readonly=readonly)
+    else:
+        db = (ReadSessionLocal if readonly else SessionLocal)()
+        try:
+            yield AsyncDB(db, readonly=readonly)
+        finally:
+            await run_in_threadpool(db.close)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date, UniqueConstraint, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Boolean, JSON, LargeBinary, UniqueConstraint, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from app.models.database import Base
 
@@ -12,10 +12,30 @@ class Transaction(Base):
     type = Column(String, index=True) # "income" or "expense"
     description = Column(String)
     amount = Column(Float)
-    category = Column(String, index=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), index=True)
     date = Column(Date)
+    # Identity of the transaction's content, used to skip duplicates when a backup is imported again.
+    # Identical transactions share the hash and are told apart by content_seq (0, 1, 2, ...).
+    content_hash = Column(String)
+    content_seq = Column(Integer)
+    __table_args__ = (
+        Index('ix_transactions_user_date_id', 'user_id', 'date', 'id'),
+        # Filtered transaction lists (see transaction_filter_conditions in app/crud/crud.py)
+        Index('ix_transactions_user_type_date_id', 'user_id', 'type', 'date', 'id'),
+        Index('ix_transactions_user_category_date_id', 'user_id', 'category_id', 'date', 'id'),
+        Index('ux_transactions_user_content', 'user_id', 'content_hash', 'content_seq', unique=True),
+        {'sqlite_autoincrement': True}, # Archived transactions leave the table but keep their ids (see app/crud/archive.py)
+    )
 
     owner = relationship("User", back_populates="transactions")
+    category_ref = relationship("Category", lazy="joined")
+
+    @property
+    def category(self):
+        """
+        The category name, which is what the API exposes.
+        """
+        return self.category_ref.name if self.category_ref is not None else None
 
 class Category(Base):
     """
@@ -30,6 +50,81 @@ class Category(Base):
 
     owner = relationship("User", back_populates="categories")
 
+class TransactionRollup(Base):
+    """
+    SQLAlchemy model for pre-aggregated transaction totals per day and per month.
+    """
+    __tablename__ = "transaction_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    period = Column(String) # "day" or "month"
+    bucket = Column(Date) # The day itself, or the first day of the month
+    type = Column(String)
+    category_id = Column(Integer)
+    total = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+    __table_args__ = (UniqueConstraint('user_id', 'period', 'bucket', 'type', 'category_id', name='_rollup_bucket_uc'),)
+
+class TransactionChange(Base):
+    """
+    SQLAlchemy model for the transaction change log used by delta sync.
+    The id doubles as the change version and only ever increases.
+    """
+    __tablename__ = "transaction_changes"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    transaction_id = Column(Integer) # None for "resync" entries
+    op = Column(String) # "upsert", "delete" or "resync"
+    created_at = Column(DateTime)
+    __table_args__ = (
+        Index('ix_transaction_changes_user_id_id', 'user_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+class ChangeLogHorizon(Base):
+    """
+    SQLAlchemy model recording, per user, the newest change version removed by compaction.
+    Clients that last synced before it must reload the full ledger.
+    """
+    __tablename__ = "change_log_horizons"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, default=0)
+
+class TransactionArchive(Base):
+    """
+    SQLAlchemy model for a compressed block of archived transactions: the transactions of one user and
+    calendar year that were moved out of the transactions table (see app/crud/archive.py).
+    """
+    __tablename__ = "transaction_archives"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    year = Column(Integer)
+    count = Column(Integer)
+    min_date = Column(Date)
+    max_date = Column(Date)
+    # Id range, so finding an archived transaction by id only decompresses the blocks that may hold it
+    min_id = Column(Integer)
+    max_id = Column(Integer)
+    # Row counts per [type, category_id] and the amount range, so filtered counts need not decompress the block
+    type_category_counts = Column(JSON)
+    min_amount = Column(Float)
+    max_amount = Column(Float)
+    data = Column(LargeBinary) # zlib-compressed JSON columns
+    __table_args__ = (UniqueConstraint('user_id', 'year', name='_archive_user_year_uc'),)
+
+class Budget(Base):
+    """
+    SQLAlchemy model for a monthly spending limit on one expense category.
+    The amount spent is not stored here: it is the category's month rollup bucket.
+    """
+    __tablename__ = "budgets"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    category_id = Column(Integer, ForeignKey("categories.id"))
+    amount = Column(Float) # Limit per calendar month
+    warn_percent = Column(Float) # Share of the limit at which a warning is raised
+    __table_args__ = (UniqueConstraint('user_id', 'category_id', name='_budget_user_category_uc'),)
+
 class User(Base):
     """
     SQLAlchemy model for users.
@@ -40,4 +135,42 @@ class User(Base):
     hashed_password = Column(String)
 
     transactions = relationship("Transaction", back_populates="owner")
-    categories = relationship("Category", back_populates="owner")
\ No newline at end of file
+    categories = relationship("Category", back_populates="owner")
+
+class UserShard(Base):
+    """
+    SQLAlchemy model mapping a user to the shard holding their ledger (directory database only).
+    A null shard means the user's data is still in the directory database.
+    """
+    __tablename__ = "user_shards"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    shard = Column(Integer, nullable=True)
+    moving = Column(Boolean, default=False) # Requests are refused while the user's data is being moved
+
+class Job(Base):
+    """
+    SQLAlchemy model for background jobs (imports, exports, account deletion; see app/crud/jobs.py).
+    Jobs are stored with the user's ledger, so a job's checkpoint commits together with the chunk of work it describes.
+    """
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer) # No foreign key: an account deletion job outlives the user row
+    kind = Column(String)
+    status = Column(String) # "queued", "running", "succeeded", "failed" or "cancelled"
+    params = Column(JSON)
+    state = Column(JSON) # Checkpoint a resumed job continues from
+    result = Column(JSON)
+    error = Column(String)
+    processed = Column(Integer, default=0)
+    total = Column(Integer, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    # Bumped each time a worker claims the job; a worker's checkpoints only apply while it still matches
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime) # Also the heartbeat of a running job
+    finished_at = Column(DateTime)
+    __table_args__ = (
+        Index('ix_jobs_status_id', 'status', 'id'),
+        Index('ix_jobs_user_id_id', 'user_id', 'id'),
+        {'sqlite_autoincrement': True}, # Never reuse the id of a purged job, whose result URL may still be around
+    )
\ No newline at end of file
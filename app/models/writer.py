@@ -0,0 +1,165 @@
+import time
+import queue
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Single-writer group commit for SQLite.
+# SQLite allows one writer at a time, and every commit pays for a full fsync. When many requests write
+# concurrently they queue on the database lock (or fail with "database is locked"). GroupCommitWriter
+# funnels those writes through one thread instead. The thread collects whatever mutations arrive within
+# a short window and runs each in its own SAVEPOINT on one shared connection, so a failing mutation only
+# rolls back its own work. It then commits them all in a single transaction. Each caller waits on a Future
+# that resolves once its write is durable.
+
+POST_COMMIT_HOOKS = "post_commit_hooks"
+
+def after_commit(db: Session, fn, *args):
+    """
+    Run `fn(*args)` once the session's committed work is durable.
+    Sessions handed out by GroupCommitWriter only release a savepoint on `commit()`, so the hook
+    is deferred until the shared transaction commits; for ordinary sessions it runs right away.
+    """
+    hooks = db.info.get(POST_COMMIT_HOOKS)
+    if hooks is None:
+        fn(*args)
+    else:
+        hooks.append((fn, args))
+
+def enable_sqlite_savepoints(engine):
+    """
+    Let SQLAlchemy manage transactions itself on a pysqlite engine, which is required for SAVEPOINT
+    to work (the driver otherwise issues its own BEGIN/COMMIT). BEGIN IMMEDIATE takes the write lock
+    up front so a batch never fails half-way on a lock upgrade.
+    """
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+class GroupCommitWriter:
+    """
+    A dedicated writer thread that commits the mutations of many requests together.
+    `submit(fn, *args, **kwargs)` queues `fn(session, *args, **kwargs)` and returns a Future for its result.
+    Each write runs in a copy of the submitter's context, so per-request instrumentation still applies.
+    """
+    def __init__(self, engine, window_ms: float = 2.0, max_batch: int = 128):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._writes = 0
+        self._failed = 0
+        enable_sqlite_savepoints(engine)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Queue a write and return a Future resolved after the batch containing it has committed.
+        """
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="stashup-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((fn, args, kwargs, future, contextvars.copy_context()))
+        return future
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "batches": self._batches,
+            "writes": self._writes,
+            "failed": self._failed,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+        }
+
+    def shutdown(self):
+        """
+        Commit everything already queued, then stop the writer thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(None)
+        thread.join()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, stop = self._collect(item)
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                # Never let a broken batch kill the writer; its callers have already been failed.
+                logging.exception(f"群組提交批次失敗: {e}")
+            if stop:
+                return
+
+    def _collect(self, first):
+        """
+        Gather queued writes until the window closes or the batch is full.
+        Returns the batch and whether a shutdown request was seen.
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run_batch(self, batch):
+        done = []
+        with self.engine.connect() as conn:
+            transaction = conn.begin()
+            for fn, args, kwargs, future, context in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                hooks = []
+                session = Session(
+                    bind=conn, join_transaction_mode="create_savepoint",
+                    autoflush=False, expire_on_commit=False, info={POST_COMMIT_HOOKS: hooks}
+                )
+                try:
+                    result = context.run(fn, session, *args, **kwargs)
+                except BaseException as e:
+                    session.close() # Rolls back this write's savepoint only
+                    self._failed += 1
+                    future.set_exception(e)
+                    continue
+                session.close()
+                done.append((future, result, hooks))
+            try:
+                transaction.commit()
+            except BaseException as e:
+                self._failed += len(done)
+                for future, _, _ in done:
+                    future.set_exception(e)
+                raise
+        self._batches += 1
+        self._writes += len(done)
+        for future, result, hooks in done:
+            for hook, args in hooks:
+                try:
+                    hook(*args)
+                except Exception as e:
+                    logging.exception(f"提交後處理失敗: {e}")
+            future.set_result(result)
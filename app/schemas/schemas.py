@@ -1,6 +1,6 @@
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any, Literal
 import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 # Pydantic Schemas
 class TransactionBase(BaseModel):
@@ -28,6 +28,92 @@ class TransactionModel(TransactionBase):
     class Config:
         from_attributes = True
 
+# Budget Schemas
+class BudgetAlert(BaseModel):
+    """
+    Schema for a budget threshold crossed by a write: the month's spending in the budget's category
+    reached its warning level ("warning") or its limit ("exceeded").
+    """
+    budget_id: int
+    category: str
+    month: str # "YYYY-MM"
+    level: Literal["warning", "exceeded"]
+    amount: float
+    spent: float
+    percent: Optional[float] = None
+
+class TransactionWriteResult(TransactionModel):
+    """
+    Schema for a created, updated or deleted transaction together with the budget alerts of the write.
+    """
+    budget_alerts: List[BudgetAlert] = []
+
+class BudgetCreate(BaseModel):
+    """
+    Schema for creating or changing a monthly budget on an expense category.
+    """
+    category: str
+    amount: float = Field(gt=0)
+    warn_percent: Optional[float] = Field(default=None, gt=0, le=100) # Defaults to BUDGET_WARN_PERCENT
+
+class BudgetModel(BaseModel):
+    """
+    Schema for a budget and its spending in the requested month.
+    """
+    id: int
+    category: str
+    amount: float
+    warn_percent: float
+    spent: float
+    remaining: float
+    percent: Optional[float] = None
+    level: Literal["ok", "warning", "exceeded"]
+
+class TransactionChanges(BaseModel):
+    """
+    Schema for the transactions changed since a client's last sync version.
+    """
+    version: int
+    reset: bool # True if the client's version was compacted away and it must reload everything
+    has_more: bool
+    upserts: List[TransactionModel]
+    deletes: List[int]
+
+class TransactionOperation(BaseModel):
+    """
+    Schema for one operation of a transaction batch: "create" needs `transaction`,
+    "update" needs `id` and `transaction`, "delete" needs `id`.
+    """
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    transaction: Optional[TransactionCreate] = None
+
+class TransactionBatch(BaseModel):
+    """
+    Schema for a batch of transaction operations applied atomically.
+    """
+    operations: List[TransactionOperation] = Field(min_length=1, max_length=1000)
+
+class TransactionOperationResult(BaseModel):
+    """
+    Schema for the outcome of one operation of a transaction batch.
+    """
+    index: int
+    op: str
+    id: Optional[int] = None
+    status: int # 200, 201 for creates; 404 or 422 for the operations that rejected the batch
+    transaction: Optional[TransactionModel] = None # The deleted transaction for deletes
+    detail: Optional[str] = None
+
+class TransactionBatchResult(BaseModel):
+    """
+    Schema for the result of a transaction batch.
+    """
+    applied: bool
+    version: Optional[int] = None # The change version after the batch, usable as `since`
+    results: List[TransactionOperationResult]
+    budget_alerts: List[BudgetAlert] = []
+
 class TransactionImport(BaseModel):
     """
     Schema for importing transactions from a file.
@@ -38,6 +124,120 @@ class TransactionImport(BaseModel):
     category: str
     date: str # For import, date might come as a string
 
+class SummaryBucket(BaseModel):
+    """
+    Schema for one aggregated bucket of a transaction summary.
+    """
+    type: Optional[str] = None
+    category: Optional[str] = None
+    period: Optional[str] = None # "YYYY-MM-DD", "YYYY-MM" or "YYYY" depending on the time grouping
+    total: float
+    count: int
+
+class Summary(BaseModel):
+    """
+    Schema for transaction totals over a date range.
+    """
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+    group_by: List[str]
+    income: float
+    expense: float
+    buckets: List[SummaryBucket]
+
+# Analytics Schemas
+class MonthlyTrend(BaseModel):
+    """
+    Schema for one month of the trend report. Changes are against the previous month; averages
+    cover the report's rolling window ending with this month. Ratios are None when undefined.
+    """
+    month: str # "YYYY-MM"
+    count: int
+    income: float
+    expense: float
+    net: float
+    income_change: float
+    income_change_pct: Optional[float] = None
+    expense_change: float
+    expense_change_pct: Optional[float] = None
+    net_change: float
+    income_average: float
+    expense_average: float
+    net_average: float
+    income_expense_ratio: Optional[float] = None
+
+class TrendReport(BaseModel):
+    """
+    Schema for monthly income and expense trends with totals over the whole report.
+    """
+    start_month: str
+    end_month: str
+    window: int
+    income: float
+    expense: float
+    net: float
+    average_income: float
+    average_expense: float
+    income_expense_ratio: Optional[float] = None
+    savings_rate: Optional[float] = None # Percent of income left after expenses
+    months: List[MonthlyTrend]
+
+class CategoryStats(BaseModel):
+    """
+    Schema for the amount distribution of one category.
+    """
+    category: Optional[str] = None
+    count: int
+    total: float
+    share: Optional[float] = None # Percent of the breakdown total
+    mean: float
+    min: float
+    max: float
+    p25: float
+    p50: float
+    p75: float
+    p90: float
+
+class CategoryBreakdown(BaseModel):
+    """
+    Schema for per-category statistics of one transaction type over a date range.
+    """
+    type: str
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+    count: int
+    total: float
+    categories: List[CategoryStats]
+
+class CurrentMonthForecast(BaseModel):
+    """
+    Schema for the projected expense of the current month.
+    """
+    month: str
+    spent: float
+    daily_average: float
+    projected: float
+
+class ForecastMonth(BaseModel):
+    """
+    Schema for the projected expense of a future month and its bounds.
+    """
+    month: str
+    expense: float
+    lower: float
+    upper: float
+
+class SpendingForecast(BaseModel):
+    """
+    Schema for the spending forecast. `method` is "linear", "mean" (one month of history) or "none".
+    """
+    as_of: datetime.date
+    method: str
+    history_months: int
+    trend_per_month: float
+    current_month: CurrentMonthForecast
+    months: List[ForecastMonth]
+
 class CategoryBase(BaseModel):
     """
     Base schema for a category.
@@ -60,6 +260,12 @@ class CategoryModel(CategoryBase):
     class Config:
         from_attributes = True
 
+class CategoryWriteResult(CategoryModel):
+    """
+    Schema for an updated or deleted category together with the budget alerts raised by moving its transactions.
+    """
+    budget_alerts: List[BudgetAlert] = []
+
 # User Schemas
 class UserBase(BaseModel):
     """
@@ -82,6 +288,16 @@ class UserInDB(UserBase):
     class Config:
         from_attributes = True
 
+class Principal(UserBase):
+    """
+    Schema for the authenticated user attached to a request.
+    """
+    id: int
+
+    class Config:
+        from_attributes = True
+        frozen = True
+
 class Token(BaseModel):
     """
     Schema for JWT token.
@@ -109,4 +325,23 @@ class UserDataImport(BaseModel):
     Schema for importing user data.
     """
     transactions: List[TransactionCreate]
-    custom_categories: List[CategoryCreate]
\ No newline at end of file
+    custom_categories: List[CategoryCreate]
+
+# Background Job Schemas
+class JobModel(BaseModel):
+    """
+    Schema for the status and progress of a background job.
+    `processed` and `total` count lines of the uploaded file for imports and transactions otherwise.
+    """
+    id: int
+    kind: str
+    status: str
+    processed: int
+    total: Optional[int] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    result_url: Optional[str] = None # Download link of a finished export
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+    finished_at: Optional[datetime.datetime] = None
\ No newline at end of file
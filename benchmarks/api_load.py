@@ -0,0 +1,258 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+
+# Load test of the HTTP API. Seeds synthetic users, custom categories and transactions into a throwaway
+# SQLite database, then drives the real FastAPI app in-process over ASGI (httpx.ASGITransport, no network)
+# with concurrent clients. Every scenario reports p50/p95/p99 latency and throughput; the results are
+# written as JSON, and --compare prints the change against an earlier result file.
+# The usual STASHUP_* variables (STASHUP_DB_MODE, STASHUP_GROUP_COMMIT, STASHUP_SHARDS, ...) apply.
+#
+# Usage: python -m benchmarks.api_load [--rows N] [--users N] [--concurrency N] [--requests N]
+#                                      [--scenarios a,b] [--output result.json] [--compare baseline.json]
+
+if __name__ == "__main__":
+    workdir = tempfile.mkdtemp(prefix="stashup-load-")
+    os.environ.setdefault("STASHUP_DATABASE_URL", f"sqlite:///{workdir}/load.db")
+    os.environ.setdefault("STASHUP_SHARD_DIR", f"{workdir}/shards")
+
+import logging
+import httpx
+
+import main
+from app.models.database import SessionLocal, DB_MODE, GROUP_COMMIT, SHARD_COUNT, all_storages
+from app.models.models import User
+from app.crud.crud import insert_transaction_batch
+from app.crud.shards import get_user_shard_assignment
+from app.core.responses import orjson
+
+PASSWORD = "load-test-password"
+WORDS = ["午餐", "晚餐", "咖啡", "捷運", "計程車", "電影", "書店", "超市", "房租", "水電", "coffee", "taxi", "grocery", "netflix", "gym"]
+EXPENSE_CATEGORIES = ["餐飲", "交通", "購物", "娛樂", "居家"]
+CUSTOM_CATEGORIES = ["健身", "寵物", "進修"]
+SEED_BATCH_SIZE = 5000
+CSV_IMPORT_ROWS = 200
+
+def synthetic_transaction(rng: random.Random, categories) -> dict:
+    return {
+        "type": "expense",
+        "description": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.randint(1, 9999)}",
+        "amount": round(rng.uniform(1, 2000), 2),
+        "category": rng.choice(categories),
+        "date": datetime.date(2020, 1, 1) + datetime.timedelta(days=rng.randint(0, 5 * 365)),
+    }
+
+async def seed(client: httpx.AsyncClient, rng: random.Random, users: int, rows: int) -> list:
+    """
+    Register the users and their custom categories through the API, then bulk-insert their
+    transactions directly. Returns one (username, auth headers) pair per user.
+    """
+    accounts = []
+    for index in range(users):
+        username = f"load{index}"
+        response = await client.post("/auth/register", json={"username": username, "password": PASSWORD})
+        response.raise_for_status()
+        token = (await client.post("/auth/token", data={"username": username, "password": PASSWORD})).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        for name in CUSTOM_CATEGORIES:
+            (await client.post("/api/categories", json={"name": name, "type": "expense"}, headers=headers)).raise_for_status()
+        accounts.append((username, headers))
+
+    directory = SessionLocal()
+    try:
+        user_ids = [directory.query(User.id).filter(User.username == username).scalar() for username, _ in accounts]
+        shards = [get_user_shard_assignment(directory, user_id)[0] for user_id in user_ids]
+    finally:
+        directory.close()
+    categories = EXPENSE_CATEGORIES + CUSTOM_CATEGORIES
+    for index, (user_id, shard) in enumerate(zip(user_ids, shards)):
+        remaining = rows // users + (1 if index < rows % users else 0)
+        db = SessionLocal(info={"shard": shard})
+        try:
+            while remaining > 0:
+                batch = [dict(synthetic_transaction(rng, categories), user_id=user_id) for _ in range(min(remaining, SEED_BATCH_SIZE))]
+                insert_transaction_batch(db, batch, user_id)
+                remaining -= len(batch)
+        finally:
+            db.close()
+    return accounts
+
+def csv_upload(rng: random.Random) -> bytes:
+    lines = ["type,description,amount,category,date"]
+    for _ in range(CSV_IMPORT_ROWS):
+        row = synthetic_transaction(rng, EXPENSE_CATEGORIES)
+        lines.append(f"{row['type']},{row['description']},{row['amount']},{row['category']},{row['date'].isoformat()}")
+    return "\n".join(lines).encode("utf-8")
+
+# name -> (request builder, heavy). A builder gets (rng, username, headers) and returns httpx.request kwargs.
+# Heavy scenarios move a whole ledger per request and run a tenth of the requests.
+SCENARIOS = {
+    "token": (lambda rng, username, headers: {
+        "method": "POST", "url": "/auth/token", "data": {"username": username, "password": PASSWORD}
+    }, False),
+    "list_transactions": (lambda rng, username, headers: {
+        "method": "GET", "url": "/api/transactions", "params": {"limit": 100}, "headers": headers
+    }, False),
+    "search_transactions": (lambda rng, username, headers: {
+        "method": "GET", "url": "/api/transactions", "params": {"query": rng.choice(WORDS), "limit": 100}, "headers": headers
+    }, False),
+    "create_transaction": (lambda rng, username, headers: {
+        "method": "POST", "url": "/api/transactions", "headers": headers,
+        "json": {**synthetic_transaction(rng, EXPENSE_CATEGORIES), "date": datetime.date.today().isoformat()}
+    }, False),
+    "categories": (lambda rng, username, headers: {
+        "method": "GET", "url": "/api/categories", "headers": headers
+    }, False),
+    "analytics_trends": (lambda rng, username, headers: {
+        "method": "GET", "url": "/api/analytics/trends", "params": {"months": 12}, "headers": headers
+    }, False),
+    "csv_import": (lambda rng, username, headers: {
+        "method": "POST", "url": "/api/transactions/import", "headers": headers,
+        "files": {"file": ("load.csv", csv_upload(rng), "text/csv")}
+    }, True),
+    "csv_export": (lambda rng, username, headers: {
+        "method": "GET", "url": "/api/transactions/export", "headers": headers
+    }, True),
+    "export_data": (lambda rng, username, headers: {
+        "method": "GET", "url": "/auth/export-data", "headers": headers
+    }, True),
+}
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+async def run_scenario(client: httpx.AsyncClient, accounts: list, build, requests: int, concurrency: int, seed: int) -> dict:
+    """
+    Send `requests` requests from `concurrency` clients, each cycling through the users.
+    """
+    latencies = []
+    errors = {}
+    next_request = iter(range(requests))
+
+    async def worker(worker_id: int):
+        rng = random.Random(seed * 1000 + worker_id)
+        for number in next_request:
+            username, headers = accounts[number % len(accounts)]
+            kwargs = build(rng, username, headers)
+            started = time.perf_counter()
+            response = await client.request(**kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(worker_id) for worker_id in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": {str(code): count for code, count in sorted(errors.items())},
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(result: dict, baseline: dict):
+    """
+    Print the change in p95 latency and throughput of every scenario present in both results.
+    """
+    print(f"\ncompared with commit {baseline['meta'].get('commit') or 'unknown'} ({baseline['meta'].get('started_at')}):")
+    for name, current in result["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if not previous or not previous["p95_ms"] or not previous["throughput_rps"]:
+            continue
+        p95 = (current["p95_ms"] / previous["p95_ms"] - 1) * 100
+        throughput = (current["throughput_rps"] / previous["throughput_rps"] - 1) * 100
+        print(f"{name:<20} p95 {p95:+7.1f}%   throughput {throughput:+7.1f}%")
+
+async def main_async(args) -> dict:
+    rng = random.Random(args.seed)
+    names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)} (available: {', '.join(SCENARIOS)})")
+
+    main.startup_event()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stashup.test", timeout=None) as client:
+        seeding_started = time.perf_counter()
+        accounts = await seed(client, rng, args.users, args.rows)
+        result = {
+            "meta": {
+                "commit": git_commit(),
+                "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "rows": args.rows, "users": args.users, "concurrency": args.concurrency,
+                "requests": args.requests, "seed": args.seed,
+                "db_mode": DB_MODE, "group_commit": GROUP_COMMIT, "shards": SHARD_COUNT,
+                "orjson": orjson is not None,
+                "seed_seconds": round(time.perf_counter() - seeding_started, 3),
+            },
+            "scenarios": {},
+        }
+        for index, name in enumerate(names):
+            build, heavy = SCENARIOS[name]
+            requests = max(args.requests // 10, 1) if heavy else args.requests
+            stats = await run_scenario(client, accounts, build, requests, min(args.concurrency, requests), args.seed + index)
+            result["scenarios"][name] = stats
+            print(
+                f"{name:<20} {stats['requests']:>6} req  {stats['throughput_rps']:>9.1f} req/s  "
+                f"p50 {stats['p50_ms']:>8.2f}  p95 {stats['p95_ms']:>8.2f}  p99 {stats['p99_ms']:>8.2f} ms"
+                + (f"  errors {stats['errors']}" if stats["errors"] else "")
+            )
+    main.shutdown_event()
+    for storage in all_storages():
+        # Pooled aiosqlite connections keep their worker threads (and the process) alive until disposed
+        for engine in {storage.async_engine, storage.async_read_engine} - {None}:
+            await engine.dispose()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the StashUp API in-process against a temporary SQLite database.")
+    parser.add_argument("--rows", type=int, default=10000, help="transactions to seed in total (1k to 1M)")
+    parser.add_argument("--users", type=int, default=10, help="users to spread the transactions over")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario (a tenth for import/export)")
+    parser.add_argument("--scenarios", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic data and requests")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING) # Per-request application and httpx logs would dominate the timings
+
+    print(f"database: {os.environ['STASHUP_DATABASE_URL']}, rows: {args.rows}, users: {args.users}, concurrency: {args.concurrency}")
+    result = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import datetime
+import statistics
+
+# Compare the two ways of serving a page of GET /api/transactions:
+#   orm:  ORM Transaction objects -> response_model validation -> jsonable_encoder -> json.dumps
+#         (what FastAPI does when the endpoint returns ORM objects)
+#   rows: row tuples from query_transaction_rows -> transaction_record -> FastJSONResponse
+# Runs against a throwaway SQLite database so it never touches real data.
+#
+# Usage: python -m benchmarks.list_transactions [rows] [page_size] [repeats]
+
+if __name__ == "__main__":
+    workdir = tempfile.mkdtemp(prefix="stashup-bench-")
+    os.environ.setdefault("STASHUP_DATABASE_URL", f"sqlite:///{workdir}/bench.db")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from typing import List
+
+from app.models.database import SessionLocal, create_schema
+from app.models.models import Transaction, User
+from app.schemas.schemas import TransactionModel
+from app.crud.crud import seed_default_categories, insert_transaction_batch, get_transactions, transaction_record
+from app.crud.search import ensure_search_index
+from app.core.responses import FastJSONResponse, orjson
+
+def populate(rows: int) -> int:
+    db = SessionLocal()
+    try:
+        seed_default_categories(db)
+        ensure_search_index(db)
+        user = User(username="bench", hashed_password="-")
+        db.add(user)
+        db.commit()
+        categories = ["餐飲", "交通", "購物", "娛樂", "居家"]
+        start = datetime.date(2020, 1, 1)
+        batch = []
+        for i in range(rows):
+            batch.append({
+                "type": "expense", "description": f"午餐便當 {i}", "amount": (i % 500) + 0.25,
+                "category": categories[i % len(categories)], "date": start + datetime.timedelta(days=i % 1500),
+                "user_id": user.id
+            })
+            if len(batch) == 5000:
+                insert_transaction_batch(db, batch, user.id)
+                batch = []
+        if batch:
+            insert_transaction_batch(db, batch, user.id)
+        return user.id
+    finally:
+        db.close()
+
+def serve_orm(db, user_id: int, page_size: int) -> bytes:
+    transactions = db.query(Transaction).filter(Transaction.user_id == user_id).order_by(
+        Transaction.date.desc(), Transaction.id.desc()
+    ).limit(page_size).all()
+    validated = TypeAdapter(List[TransactionModel]).validate_python(transactions, from_attributes=True)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+def serve_rows(db, user_id: int, page_size: int) -> bytes:
+    rows = get_transactions(db, user_id, limit=page_size)
+    return FastJSONResponse([transaction_record(row) for row in rows]).body
+
+def measure(serve, user_id: int, page_size: int, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            serve(db, user_id, page_size)
+            timings.append(time.perf_counter() - started)
+        finally:
+            db.close()
+    return statistics.median(timings)
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    page_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+    create_schema()
+    user_id = populate(rows)
+
+    db = SessionLocal()
+    try:
+        same = json.loads(serve_orm(db, user_id, page_size)) == json.loads(serve_rows(db, user_id, page_size))
+    finally:
+        db.close()
+
+    orm_time = measure(serve_orm, user_id, page_size, repeats)
+    rows_time = measure(serve_rows, user_id, page_size, repeats)
+    print(f"ledger rows: {rows}, page size: {page_size}, repeats: {repeats}, orjson: {'yes' if orjson else 'no'}")
+    print(f"same payload: {same}")
+    print(f"orm + validation: {orm_time * 1000:8.2f} ms/page")
+    print(f"row tuples:       {rows_time * 1000:8.2f} ms/page")
+    print(f"speedup:          {orm_time / rows_time:8.2f}x")
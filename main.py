@@ -3,17 +3,22 @@ import logging
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 
-from app.models.database import Base, engine, SessionLocal
-from app.crud.crud import seed_default_categories
-from app.api import auth, transactions, categories
+from app.models.database import SessionLocal, create_schema, data_shards, shutdown_storage
+from app.crud.crud import seed_default_categories, ensure_category_ids, ensure_content_hashes, ensure_rollups
+from app.crud.search import ensure_search_index
+from app.crud.changes import compact_change_log
+from app.api import auth, transactions, categories, summary, jobs, analytics, budgets
+from app.crud.jobs import job_workers
+from app.core.security import hashing_pool
+from app.core.metrics import MetricsMiddleware, render_metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Create database tables
-Base.metadata.create_all(bind=engine)
+create_schema()
 
 # FastAPI App
 app = FastAPI()
@@ -25,12 +30,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], # Allows all methods
     allow_headers=["*"], # Allows all headers
+    expose_headers=["X-Next-Cursor", "X-Change-Version", "X-Total-Count", "Location"], # Lets the browser read pagination cursors, sync versions and job URLs
 )
 
+# Request and SQL instrumentation (see app/core/metrics.py)
+app.add_middleware(MetricsMiddleware)
+
 # Include API routers
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(transactions.router, prefix="/api", tags=["transactions"])
 app.include_router(categories.router, prefix="/api", tags=["categories"])
+app.include_router(summary.router, prefix="/api", tags=["summary"])
+app.include_router(jobs.router, prefix="/api", tags=["jobs"])
+app.include_router(analytics.router, prefix="/api", tags=["analytics"])
+app.include_router(budgets.router, prefix="/api", tags=["budgets"])
 
 # Static Files and Root
 # Ensure the static directory exists
@@ -46,14 +59,41 @@ async def read_root():
     logging.info("接收到根路徑請求 '/'")
     return FileResponse('static/index.html')
 
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    """
+    Expose request and SQL metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Initial Data Seeding
 @app.on_event("startup")
 def startup_event():
     """
-    Seed default categories on application startup if the database is empty.
+    Seed default categories on application startup if the database is empty,
+    migrate free-text transaction categories to category ids, backfill content hashes,
+    rollups and the search index for databases created before they existed, and compact the transaction change log. With sharding this runs on every shard.
+    Then start the background job workers, which resume any job interrupted by the last shutdown.
+    """
+    for shard in data_shards():
+        db = SessionLocal(info={"shard": shard})
+        try:
+            seed_default_categories(db)
+            ensure_category_ids(db)
+            ensure_content_hashes(db)
+            ensure_rollups(db)
+            ensure_search_index(db)
+            compact_change_log(db)
+        finally:
+            db.close()
+    job_workers.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """
+    Stop the background job workers (running jobs pause after their current chunk) and the password
+    hashing worker processes, and flush pending group-commit writes.
     """
-    db = SessionLocal()
-    try:
-        seed_default_categories(db)
-    finally:
-        db.close()
+    job_workers.shutdown()
+    hashing_pool.shutdown()
+    shutdown_storage()
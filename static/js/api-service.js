@@ -28,14 +28,14 @@ export const clearAuthToken = () => {
 };
 
 /**
- * @function request
- * @description 發送 API 請求的通用函式。
+ * @function send
+ * @description 發送 API 請求並檢查狀態，回傳原始 Response (供需要讀取回應標頭的呼叫者使用)。
  * @param {string} url - 請求的 URL。
  * @param {Object} options - 請求選項，例如 method, body, headers 等。
- * @returns {Promise<Object>} - 包含響應資料的 Promise。
+ * @returns {Promise<Response>} - 成功的 Response。
  * @throws {Error} - 如果請求失敗或未經授權。
  */
-export const request = async (url, options = {}) => {
+const send = async (url, options = {}) => {
     const headers = {
         'Content-Type': 'application/json',
         ...options.headers
@@ -43,6 +43,9 @@ export const request = async (url, options = {}) => {
     if (authToken) {
         headers['Authorization'] = `Bearer ${authToken}`;
     }
+    if (options.body instanceof FormData) {
+        delete headers['Content-Type']; // 讓瀏覽器自行帶入 multipart boundary
+    }
 
     const response = await fetch(url, { ...options, headers });
     if (response.status === 401) {
@@ -54,6 +57,19 @@ export const request = async (url, options = {}) => {
         const errorData = await response.json();
         throw new Error(errorData.detail || 'API request failed');
     }
+    return response;
+};
+
+/**
+ * @function request
+ * @description 發送 API 請求的通用函式。
+ * @param {string} url - 請求的 URL。
+ * @param {Object} options - 請求選項，例如 method, body, headers 等。
+ * @returns {Promise<Object>} - 包含響應資料的 Promise。
+ * @throws {Error} - 如果請求失敗或未經授權。
+ */
+export const request = async (url, options = {}) => {
+    const response = await send(url, options);
     return response.json();
 };
 
@@ -103,6 +119,68 @@ export const getTransactions = (query = '') => {
     return request(url);
 };
 
+/**
+ * @function getTransactionsWithVersion
+ * @description 獲取交易紀錄以及目前的變更版本 (供之後增量同步使用)。
+ * @returns {Promise<Object>} - { transactions, version }。
+ */
+export const getTransactionsWithVersion = async () => {
+    const response = await send('/api/transactions');
+    const transactions = await response.json();
+    return { transactions, version: parseInt(response.headers.get('X-Change-Version') || '0', 10) };
+};
+
+/**
+ * @function getFilteredTransactions
+ * @description 由後端依篩選條件查詢交易紀錄，只下載符合條件的資料。
+ * @param {Object} filters - 篩選條件。
+ * @param {string|null} filters.startDate - 開始日期 (YYYY-MM-DD，可選)。
+ * @param {string|null} filters.endDate - 結束日期 (YYYY-MM-DD，可選)。
+ * @param {Array<string>} filters.categories - 分類名稱 (可多個，空陣列表示不限)。
+ * @param {string} filters.keyword - 關鍵字 (可選)。
+ * @param {number} filters.limit - 最多回傳筆數。
+ * @returns {Promise<Object>} - { transactions, total }，total 為符合條件的總筆數。
+ */
+export const getFilteredTransactions = async ({ startDate = null, endDate = null, categories = [], keyword = '', limit = 500 } = {}) => {
+    const params = new URLSearchParams({ limit });
+    if (startDate) params.append('start_date', startDate);
+    if (endDate) params.append('end_date', endDate);
+    categories.forEach(category => params.append('category', category));
+    if (keyword) params.append('query', keyword);
+    const response = await send(`/api/transactions?${params.toString()}`);
+    const transactions = await response.json();
+    return { transactions, total: parseInt(response.headers.get('X-Total-Count') || transactions.length, 10) };
+};
+
+/**
+ * @function getChanges
+ * @description 獲取自指定版本之後的交易變更。
+ * @param {number} since - 上次同步的變更版本。
+ * @returns {Promise<Object>} - { version, reset, has_more, upserts, deletes }。
+ */
+export const getChanges = (since) => request(`/api/transactions/changes?since=${since}`);
+
+/**
+ * @function getSummary
+ * @description 獲取後端彙總的收支統計 (不需下載全部交易紀錄)。
+ * @param {Object} params - 查詢參數。
+ * @param {string|null} params.startDate - 開始日期 (YYYY-MM-DD，可選)。
+ * @param {string|null} params.endDate - 結束日期 (YYYY-MM-DD，可選)。
+ * @param {Array<string>} params.groupBy - 分組維度 (type, category, day, month, year)。
+ * @param {string|null} params.type - 交易類型 (可選)。
+ * @param {string|null} params.category - 分類名稱 (可選)。
+ * @returns {Promise<Object>} - 包含 income、expense 與 buckets 的彙總結果。
+ */
+export const getSummary = ({ startDate = null, endDate = null, groupBy = ['type'], type = null, category = null } = {}) => {
+    const params = new URLSearchParams();
+    groupBy.forEach(dim => params.append('group_by', dim));
+    if (startDate) params.append('start_date', startDate);
+    if (endDate) params.append('end_date', endDate);
+    if (type) params.append('type', type);
+    if (category) params.append('category', category);
+    return request(`/api/summary?${params.toString()}`);
+};
+
 /**
  * @function getCategories
  * @description 獲取分類列表。
@@ -161,27 +239,69 @@ export const createCategory = (data) => request('/api/categories', {
  */
 export const deleteCategory = (type, name) => request(`/api/categories/${type}/${name}`, { method: 'DELETE' });
 
+/**
+ * @function waitForJob
+ * @description 輪詢背景工作直到完成，失敗或被取消時拋出錯誤。
+ * @param {Object} job - 回傳 202 的端點所建立的背景工作。
+ * @param {Function} [onProgress] - 每次輪詢時以最新的工作狀態呼叫。
+ * @returns {Promise<Object>} - 已完成的背景工作。
+ */
+export const waitForJob = async (job, onProgress) => {
+    while (job.status === 'queued' || job.status === 'running') {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        job = await request(`/api/jobs/${job.id}`);
+        if (onProgress) onProgress(job);
+    }
+    if (job.status !== 'succeeded') {
+        throw new Error(job.error || '背景工作已取消');
+    }
+    return job;
+};
+
 /**
  * @function deleteUserAccount
- * @description 刪除使用者帳號及所有相關資料。
- * @returns {Promise<Object>} - 刪除成功的響應。
+ * @description 刪除使用者帳號及所有相關資料。帳號會立即刪除，交易紀錄由背景工作分批刪除。
+ * @returns {Promise<Object>} - 已排入的背景工作。
  */
-export const deleteUserAccount = () => request('/auth/delete-account', { method: 'DELETE' });
+export const deleteUserAccount = () => request('/auth/delete-account?background=true', { method: 'DELETE' });
 
 /**
  * @function exportUserData
- * @description 匯出使用者所有資料（交易紀錄和自訂分類）。
- * @returns {Promise<Object>} - 包含使用者資料的物件。
+ * @description 以 NDJSON 格式匯出使用者所有資料（交易紀錄和自訂分類）。由背景工作產生檔案，完成後下載。
+ * @param {Function} [onProgress] - 匯出進行中時以工作狀態呼叫。
+ * @returns {Promise<Blob>} - 匯出檔案的內容。
  */
-export const exportUserData = () => request('/auth/export-data');
+export const exportUserData = async (onProgress) => {
+    const job = await waitForJob(await request('/auth/export-data?format=ndjson&background=true'), onProgress);
+    const response = await send(job.result_url);
+    return response.blob();
+};
 
 /**
  * @function importUserData
- * @description 匯入使用者資料（交易紀錄和自訂分類）。
+ * @description 匯入使用者資料（交易紀錄和自訂分類），由背景工作分批寫入。
  * @param {Object} data - 要匯入的使用者資料。
- * @returns {Promise<Object>} - 匯入結果的響應。
+ * @param {Function} [onProgress] - 匯入進行中時以工作狀態呼叫。
+ * @returns {Promise<Object>} - 匯入結果。
  */
-export const importUserData = (data) => request('/auth/import-data', {
-    method: 'POST',
-    body: JSON.stringify(data)
-});
\ No newline at end of file
+export const importUserData = async (data, onProgress) => {
+    const job = await request('/auth/import-data?background=true', {
+        method: 'POST',
+        body: JSON.stringify(data)
+    });
+    return (await waitForJob(job, onProgress)).result;
+};
+
+/**
+ * @function importUserDataFile
+ * @description 上傳 NDJSON 匯出檔（可為 gzip 壓縮），由背景工作逐行匯入。
+ * @param {File} file - 匯出檔案。
+ * @param {Function} [onProgress] - 匯入進行中時以工作狀態呼叫。
+ * @returns {Promise<Object>} - 匯入結果。
+ */
+export const importUserDataFile = async (file, onProgress) => {
+    const body = new FormData();
+    body.append('file', file);
+    const job = await request('/auth/import-data/ndjson?background=true', { method: 'POST', body });
+    return (await waitForJob(job, onProgress)).result;
+};
\ No newline at end of file
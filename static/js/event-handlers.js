@@ -6,7 +6,7 @@
 import * as DOM from './dom-elements.js';
 import * as API from './api-service.js';
 import * as UI from './render-ui.js';
-import { parseJwt } from './utils.js';
+import { parseJwt, getPeriodRange } from './utils.js';
 
 // 應用程式狀態 (由 main.js 管理，這裡只作為參考，實際操作會透過傳入的函式)
 // let allTransactions = [];
@@ -19,7 +19,7 @@ import { parseJwt } from './utils.js';
  * @function setupEventListeners
  * @description 設定所有主要的事件監聽器。
  * @param {Object} appState - 應用程式狀態物件，包含 allTransactions, categories, editingTransactionId, authToken, currentUsername。
- * @param {Function} refreshData - 刷新資料的回調函式。
+ * @param {Function} refreshData - 刷新資料的回調函式 (可傳入 { incremental: true } 只同步交易變更)。
  * @param {Function} updateAppState - 更新應用程式狀態的回調函式。
  */
 export const setupEventListeners = (getAppState, refreshData, updateAppState) => {
@@ -48,7 +48,7 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
             } else {
                 await API.createTransaction(transactionData);
             }
-            await refreshData();
+            await refreshData({ incremental: true });
             transactionModal.hide();
         } catch (error) {
             console.error('Failed to save transaction:', error);
@@ -96,7 +96,12 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
     DOM.startDateEl.addEventListener('change', refreshData);
     DOM.endDateEl.addEventListener('change', refreshData);
     DOM.filterCategoryEl.addEventListener('change', refreshData);
-    DOM.filterKeywordEl.addEventListener('input', refreshData);
+    // 關鍵字由後端搜尋，停止輸入一段時間後才送出查詢
+    let keywordTimer = null;
+    DOM.filterKeywordEl.addEventListener('input', () => {
+        clearTimeout(keywordTimer);
+        keywordTimer = setTimeout(refreshData, 300);
+    });
 
     DOM.toggleChartBtn.addEventListener('click', () => {
         UI.toggleSection(DOM.chartDisplaySection, DOM.toggleChartBtn, '圖表', '圖表', '<i class="bi bi-pie-chart"></i>', '<i class="bi bi-eye-slash"></i>');
@@ -105,7 +110,7 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
             if (DOM.userManagementSection.style.display === 'block') { // 只有當帳號管理是顯示狀態時才隱藏
                 UI.toggleSection(DOM.userManagementSection, DOM.toggleUserManagementBtn, '帳號', '帳號', '<i class="bi bi-person-gear"></i>', '<i class="bi bi-eye-slash"></i>');
             }
-            UI.updateChart(getFilteredTransactions(getAppState().allTransactions, DOM.filterPeriodEl.value, DOM.filterCategoryEl.value, DOM.filterKeywordEl.value, DOM.startDateEl.value, DOM.endDateEl.value));
+            refreshChart(getAppState().visibleTransactions);
         }
     });
 
@@ -119,11 +124,22 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
         }
     });
 
+    /**
+     * @function findTransaction
+     * @description 在目前顯示的 (可能由後端篩選的) 交易與最近的交易中尋找指定的交易。
+     * @param {number} id - 交易ID。
+     * @returns {Object|undefined} - 交易紀錄。
+     */
+    const findTransaction = (id) => {
+        const { visibleTransactions, allTransactions } = getAppState();
+        return [...visibleTransactions, ...allTransactions].find(t => parseInt(t.id) === id); // 確保兩邊都是數字進行嚴格比較
+    };
+
     // --- Global Functions for inline event handlers (需要掛載到 window) ---
     // 這些函式現在將透過事件委派處理，不再直接掛載到 window
     const showEditModal = (id) => {
         console.log('showEditModal called with id:', id);
-        const transaction = getAppState().allTransactions.find(t => parseInt(t.id) === id); // 確保兩邊都是數字進行嚴格比較
+        const transaction = findTransaction(id);
         if (!transaction) {
             console.error('Transaction not found for id:', id);
             return;
@@ -150,7 +166,7 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
      */
     const handleCopyTransaction = (id) => {
         console.log('handleCopyTransaction called with id:', id);
-        const transaction = getAppState().allTransactions.find(t => parseInt(t.id) === id); // 確保兩邊都是數字進行嚴格比較
+        const transaction = findTransaction(id);
         if (!transaction) {
             console.error('Transaction not found for id:', id);
             return;
@@ -186,7 +202,7 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
         if (confirm('確定要刪除這筆交易嗎？')) {
             try {
                 await API.deleteTransaction(id);
-                await refreshData();
+                await refreshData({ incremental: true });
             } catch (error) {
                 console.error('Failed to delete transaction:', error);
                 alert('刪除失敗');
@@ -291,7 +307,7 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
 
     DOM.logoutBtn.addEventListener('click', () => {
         API.clearAuthToken(); // 清除 API 服務中的 token
-        updateAppState({ authToken: null, currentUsername: null, allTransactions: [], categories: { expense: [], income: [] } });
+        updateAppState({ authToken: null, currentUsername: null, allTransactions: [], visibleTransactions: [], changeVersion: null, categories: { expense: [], income: [] } });
         UI.renderAuthUI(getAppState().currentUsername); // 直接傳入 null 確保 UI 渲染登出狀態
         UI.renderInitialMessageForLoggedOut();
     });
@@ -323,7 +339,7 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
                 alert('您的帳號已成功刪除');
                 deleteAccountModal.hide();
                 API.clearAuthToken();
-                updateAppState({ authToken: null, currentUsername: null, allTransactions: [], categories: { expense: [], income: [] } });
+                updateAppState({ authToken: null, currentUsername: null, allTransactions: [], visibleTransactions: [], changeVersion: null, categories: { expense: [], income: [] } });
                 UI.renderAuthUI(null);
                 UI.renderInitialMessageForLoggedOut();
             } catch (error) {
@@ -334,14 +350,15 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
     });
 
     document.getElementById('export-data-btn').addEventListener('click', async () => {
+        const exportButton = document.getElementById('export-data-btn');
+        const exportLabel = exportButton.innerHTML;
+        exportButton.disabled = true;
         try {
-            const userData = await API.exportUserData();
-            const dataStr = JSON.stringify(userData, null, 2);
-            const dataBlob = new Blob([dataStr], { type: 'application/json' });
+            const dataBlob = await API.exportUserData(showJobProgress(exportButton, '匯出中'));
             const url = URL.createObjectURL(dataBlob);
             const link = document.createElement('a');
             link.href = url;
-            link.download = `stashup-data-${getAppState().currentUsername}-${new Date().toISOString().split('T')[0]}.json`;
+            link.download = `stashup-data-${getAppState().currentUsername}-${new Date().toISOString().split('T')[0]}.ndjson`;
             document.body.appendChild(link);
             link.click();
             document.body.removeChild(link);
@@ -350,6 +367,9 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
         } catch (error) {
             console.error('Failed to export data:', error);
             alert('匯出資料失敗：' + error.message);
+        } finally {
+            exportButton.disabled = false;
+            exportButton.innerHTML = exportLabel;
         }
     });
 
@@ -361,91 +381,84 @@ export const setupEventListeners = (getAppState, refreshData, updateAppState) =>
 
     document.getElementById('import-file').addEventListener('change', (e) => {
         const file = e.target.files[0];
-        document.getElementById('confirm-import-btn').disabled = !file || !file.name.endsWith('.json');
+        document.getElementById('confirm-import-btn').disabled = !file || !/\.(json|ndjson|ndjson\.gz)$/.test(file.name);
     });
 
     document.getElementById('confirm-import-btn').addEventListener('click', async () => {
         const file = document.getElementById('import-file').files[0];
         if (!file) return;
+        const importButton = document.getElementById('confirm-import-btn');
+        const importLabel = importButton.textContent;
+        const onProgress = showJobProgress(importButton, '匯入中');
+        importButton.disabled = true;
 
         try {
-            const text = await file.text();
-            const data = JSON.parse(text);
-            
-            // 驗證資料格式
-            if (!data.transactions || !data.custom_categories) {
-                throw new Error('無效的資料格式');
+            let result;
+            if (file.name.endsWith('.json')) {
+                const text = await file.text();
+                const data = JSON.parse(text);
+
+                // 驗證資料格式
+                if (!data.transactions || !data.custom_categories) {
+                    throw new Error('無效的資料格式');
+                }
+                result = await API.importUserData(data, onProgress);
+            } else {
+                // NDJSON 匯出檔直接上傳，由伺服器逐行匯入
+                result = await API.importUserDataFile(file, onProgress);
             }
-
-            const result = await API.importUserData(data);
-            alert(`資料匯入成功！\n匯入交易：${result.imported_transactions} 筆\n匯入分類：${result.imported_categories} 個`);
+            alert(`資料匯入成功！\n匯入交易：${result.imported_transactions} 筆\n略過重複交易：${result.skipped_transactions} 筆\n匯入分類：${result.imported_categories} 個`);
             importDataModal.hide();
             await refreshData();
         } catch (error) {
             console.error('Failed to import data:', error);
             alert('匯入資料失敗：' + error.message);
+        } finally {
+            importButton.disabled = false;
+            importButton.textContent = importLabel;
         }
     });
 };
 
 /**
- * @function getFilteredTransactions
- * @description 根據篩選條件獲取過濾後的交易紀錄。
- * @param {Array} allTransactions - 所有的交易紀錄陣列。
- * @param {string} period - 篩選期間 (all, today, this-week, this-month, this-year, custom)。
- * @param {string} category - 篩選分類 (all 或特定分類名稱)。
- * @param {string} keyword - 篩選關鍵字。
- * @param {string} startDateStr - 自訂期間的開始日期字串 (YYYY-MM-DD)。
- * @param {string} endDateStr - 自訂期間的結束日期字串 (YYYY-MM-DD)。
- * @returns {Array} - 過濾後的交易紀錄陣列。
+ * @function showJobProgress
+ * @description 建立背景工作的進度回呼，將完成百分比顯示在按鈕上。
+ * @param {HTMLElement} button - 顯示進度的按鈕。
+ * @param {string} label - 進度前的文字。
+ * @returns {Function} - 以工作狀態呼叫的回呼。
  */
-export const getFilteredTransactions = (allTransactions, period, category, keyword, startDateStr, endDateStr) => {
-    const now = new Date();
-    now.setHours(0, 0, 0, 0); // 將時間歸零，以便進行日期比較
-
-    // Ensure allTransactions is an array before filtering
-    if (!Array.isArray(allTransactions)) {
-        console.warn('allTransactions is not an array, initializing to empty array.');
-        allTransactions = [];
-    }
+const showJobProgress = (button, label) => (job) => {
+    button.textContent = job.total ? `${label} ${Math.floor(job.processed / job.total * 100)}%` : label;
+};
 
-    return allTransactions.filter(t => {
-        const transactionDate = new Date(t.date + 'T00:00:00');
-        let periodMatch = false;
-
-        switch (period) {
-            case 'all':
-                periodMatch = true;
-                break;
-            case 'today':
-                periodMatch = transactionDate.toDateString() === now.toDateString();
-                break;
-            case 'this-week':
-                const tempNowWeek = new Date(now); // 複製 now
-                const firstDayOfWeek = new Date(tempNowWeek.setDate(tempNowWeek.getDate() - tempNowWeek.getDay())); // 假設週日為一週的第一天
-                const lastDayOfWeek = new Date(tempNowWeek.setDate(tempNowWeek.getDate() - tempNowWeek.getDay() + 6));
-                periodMatch = transactionDate >= firstDayOfWeek && transactionDate <= lastDayOfWeek;
-                break;
-            case 'this-month':
-                const tempNowMonth = new Date(now); // 複製 now
-                const firstDayOfMonth = new Date(tempNowMonth.getFullYear(), tempNowMonth.getMonth(), 1);
-                const lastDayOfMonth = new Date(tempNowMonth.getFullYear(), tempNowMonth.getMonth() + 1, 0);
-                periodMatch = transactionDate >= firstDayOfMonth && transactionDate <= lastDayOfMonth;
-                break;
-            case 'this-year':
-                const tempNowYear = new Date(now); // 複製 now
-                const firstDayOfYear = new Date(tempNowYear.getFullYear(), 0, 1);
-                const lastDayOfYear = new Date(tempNowYear.getFullYear(), 11, 31); // 今年最後一天
-                periodMatch = transactionDate >= firstDayOfYear && transactionDate <= lastDayOfYear;
-                break;
-            case 'custom':
-                const startDate = startDateStr ? new Date(startDateStr + 'T00:00:00') : null;
-                const endDate = endDateStr ? new Date(endDateStr + 'T00:00:00') : null;
-                periodMatch = (!startDate || transactionDate >= startDate) && (!endDate || transactionDate <= endDate);
-                break;
-        }
-        const categoryMatch = category === 'all' || t.category === category;
-        const keywordMatch = !keyword || t.description.toLowerCase().includes(keyword) || t.category.toLowerCase().includes(keyword);
-        return periodMatch && categoryMatch && keywordMatch;
-    });
+/**
+ * @function refreshChart
+ * @description 依目前的篩選條件更新支出圖表。一般情況由後端 /api/summary 彙總，
+ * 只有在使用關鍵字篩選時才退回前端加總。
+ * @param {Array} visibleTransactions - 目前顯示的 (已由後端篩選的) 交易紀錄陣列 (關鍵字篩選時使用)。
+ */
+export const refreshChart = async (visibleTransactions) => {
+    const keyword = DOM.filterKeywordEl.value.trim();
+    if (keyword) {
+        UI.updateChart(UI.summarizeExpenses(visibleTransactions));
+        return;
+    }
+    try {
+        const { startDate, endDate } = getPeriodRange(DOM.filterPeriodEl.value, DOM.startDateEl.value, DOM.endDateEl.value);
+        const category = DOM.filterCategoryEl.value;
+        const summary = await API.getSummary({
+            startDate,
+            endDate,
+            groupBy: ['category'],
+            type: 'expense',
+            category: category === 'all' ? null : category
+        });
+        const expenseData = summary.buckets.reduce((acc, bucket) => {
+            acc[bucket.category] = bucket.total;
+            return acc;
+        }, {});
+        UI.updateChart(expenseData);
+    } catch (error) {
+        console.error('Failed to load summary:', error);
+    }
 };
\ No newline at end of file
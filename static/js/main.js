@@ -7,11 +7,13 @@ import * as DOM from './dom-elements.js';
 import * as API from './api-service.js';
 import * as Utils from './utils.js';
 import * as UI from './render-ui.js';
-import { setupEventListeners, getFilteredTransactions } from './event-handlers.js';
+import { setupEventListeners, refreshChart } from './event-handlers.js';
 
 // --- Application State ---
 let appState = {
-    allTransactions: [],
+    allTransactions: [], // 最近的交易 (未篩選時顯示，並以增量同步維持最新)
+    visibleTransactions: [], // 目前列表顯示的交易 (有篩選條件時由後端查詢)
+    changeVersion: null, // 上次同步的交易變更版本
     categories: { expense: [], income: [] },
     editingTransactionId: null,
     authToken: null,
@@ -28,39 +30,79 @@ const updateAppState = (newState) => {
     appState = { ...appState, ...newState };
 };
 
+/**
+ * @function syncTransactions
+ * @description 以增量同步更新交易紀錄：只下載上次同步後的變更並合併到現有資料。
+ * @returns {Promise<boolean>} - 成功合併時為 true；版本已被壓縮而需要重新載入全部資料時為 false。
+ */
+const syncTransactions = async () => {
+    const byId = new Map(appState.allTransactions.map(t => [t.id, t]));
+    let version = appState.changeVersion;
+    let hasMore = true;
+    while (hasMore) {
+        const changes = await API.getChanges(version);
+        if (changes.reset) {
+            return false;
+        }
+        changes.deletes.forEach(id => byId.delete(id));
+        changes.upserts.forEach(t => byId.set(t.id, t));
+        version = changes.version;
+        hasMore = changes.has_more;
+    }
+    // 與後端相同的排序：日期由新到舊，同日期依 id 由新到舊
+    const allTransactions = [...byId.values()].sort((a, b) => (b.date.localeCompare(a.date) || b.id - a.id));
+    updateAppState({ allTransactions, changeVersion: version });
+    return true;
+};
+
 /**
  * @function refreshData
  * @description 刷新所有應用程式資料並重新渲染 UI。
+ * @param {Object} options - 選項。options.incremental 為 true 時只同步交易變更 (不重新下載全部交易與分類)。
  */
-const refreshData = async () => {
+const refreshData = async (options = {}) => {
     try {
         if (appState.authToken) {
-            const [transactionsData, categoriesData] = await Promise.all([
-                API.getTransactions(),
-                API.getCategories()
-            ]);
-            console.log('Transactions data from API:', transactionsData);
-            updateAppState({ allTransactions: transactionsData, categories: categoriesData });
-            console.log('Current appState.allTransactions:', appState.allTransactions);
+            const synced = options.incremental === true && appState.changeVersion !== null && await syncTransactions();
+            if (!synced) {
+                const [transactionsData, categoriesData] = await Promise.all([
+                    API.getTransactionsWithVersion(),
+                    API.getCategories()
+                ]);
+                updateAppState({
+                    allTransactions: transactionsData.transactions,
+                    changeVersion: transactionsData.version,
+                    categories: categoriesData
+                });
+            }
         } else {
-            updateAppState({ allTransactions: [], categories: { expense: [], income: [] } });
+            updateAppState({ allTransactions: [], changeVersion: null, categories: { expense: [], income: [] } });
         }
         
-        const filteredTransactions = getFilteredTransactions(
-            appState.allTransactions,
-            DOM.filterPeriodEl.value,
-            DOM.filterCategoryEl.value,
-            DOM.filterKeywordEl.value,
-            DOM.startDateEl.value,
-            DOM.endDateEl.value
-        );
+        // 篩選由後端處理：有篩選條件時只下載符合條件的交易，並以彙總 API 計算收支總額
+        const keyword = DOM.filterKeywordEl.value.trim();
+        const category = DOM.filterCategoryEl.value;
+        const { startDate, endDate } = Utils.getPeriodRange(DOM.filterPeriodEl.value, DOM.startDateEl.value, DOM.endDateEl.value);
+        const filtered = Boolean(keyword || startDate || endDate || category !== 'all');
+        let visibleTransactions = appState.allTransactions;
+        let total = null;
+        if (appState.authToken && filtered) {
+            const categories = category === 'all' ? [] : [category];
+            ({ transactions: visibleTransactions, total } = await API.getFilteredTransactions({ startDate, endDate, categories, keyword }));
+        }
+        updateAppState({ visibleTransactions });
 
         UI.renderCategories(appState.categories);
-        UI.updateDashboard(filteredTransactions);
-        UI.renderTransactions(filteredTransactions);
+        if (appState.authToken && !keyword) {
+            const summary = await API.getSummary({ startDate, endDate, category: category === 'all' ? null : category });
+            UI.updateDashboard(summary);
+        } else {
+            UI.updateDashboard(UI.summarizeTotals(visibleTransactions));
+        }
+        UI.renderTransactions(visibleTransactions, total);
         // 只有當 chartDisplaySection 存在且顯示時才更新圖表
         if (DOM.chartDisplaySection && DOM.chartDisplaySection.style.display !== 'none') {
-            UI.updateChart(filteredTransactions);
+            await refreshChart(appState.visibleTransactions);
         }
     } catch (error) {
         console.error('Failed to refresh data:', error);
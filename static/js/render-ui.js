@@ -65,11 +65,12 @@ export const updateTransactionCategoryDropdown = (categories) => {
  * @function renderTransactions
  * @description 渲染交易列表。
  * @param {Array} filteredTransactions - 經過篩選的交易紀錄陣列。
+ * @param {number|null} total - 符合條件的交易總筆數 (多於列表筆數時顯示提示)。
  * @param {Function} showEditModal - 顯示編輯模態框的回調函式。
  * @param {Function} handleCopyTransaction - 複製交易的回調函式。
  * @param {Function} handleDeleteTransaction - 刪除交易的回調函式。
  */
-export const renderTransactions = (filteredTransactions) => {
+export const renderTransactions = (filteredTransactions, total = null) => {
     DOM.transactionsListEl.innerHTML = '';
     if (filteredTransactions.length === 0) {
         DOM.transactionsListEl.innerHTML = '<li class="list-group-item text-center p-3">尚無符合條件的交易紀錄</li>';
@@ -99,16 +100,32 @@ export const renderTransactions = (filteredTransactions) => {
         `;
         DOM.transactionsListEl.appendChild(li);
     });
+
+    if (total !== null && total > filteredTransactions.length) {
+        const li = document.createElement('li');
+        li.className = 'list-group-item text-center text-muted small';
+        li.textContent = `顯示最近 ${filteredTransactions.length} 筆，共 ${total} 筆符合條件`;
+        DOM.transactionsListEl.appendChild(li);
+    }
 };
 
+/**
+ * @function summarizeTotals
+ * @description 在前端加總收入與支出 (僅用於後端無法彙總的關鍵字篩選)。
+ * @param {Array} filteredTransactions - 經過篩選的交易紀錄陣列。
+ * @returns {{income: number, expense: number}} - 收入與支出總額。
+ */
+export const summarizeTotals = (filteredTransactions) => ({
+    income: filteredTransactions.filter(t => t.type === 'income').reduce((sum, t) => sum + t.amount, 0),
+    expense: filteredTransactions.filter(t => t.type === 'expense').reduce((sum, t) => sum + t.amount, 0)
+});
+
 /**
  * @function updateDashboard
  * @description 更新儀表板上的收入、支出和餘額顯示。
- * @param {Array} filteredTransactions - 經過篩選的交易紀錄陣列。
+ * @param {{income: number, expense: number}} totals - 收入與支出總額 (後端彙總或 summarizeTotals 的結果)。
  */
-export const updateDashboard = (filteredTransactions) => {
-    const income = filteredTransactions.filter(t => t.type === 'income').reduce((sum, t) => sum + t.amount, 0);
-    const expense = filteredTransactions.filter(t => t.type === 'expense').reduce((sum, t) => sum + t.amount, 0);
+export const updateDashboard = ({ income, expense }) => {
     const balance = income - expense;
 
     DOM.totalIncomeEl.textContent = formatCurrency(income);
@@ -117,18 +134,24 @@ export const updateDashboard = (filteredTransactions) => {
 };
 
 /**
- * @function updateChart
- * @description 更新支出圓餅圖。
+ * @function summarizeExpenses
+ * @description 在前端依分類加總支出 (僅用於後端無法彙總的關鍵字篩選)。
  * @param {Array} filteredTransactions - 經過篩選的交易紀錄陣列。
+ * @returns {Object} - 以分類名稱為鍵、支出總額為值的物件。
  */
-export const updateChart = (filteredTransactions) => {
-    const expenseData = filteredTransactions
-        .filter(t => t.type === 'expense')
-        .reduce((acc, t) => {
-            acc[t.category] = (acc[t.category] || 0) + t.amount;
-            return acc;
-        }, {});
+export const summarizeExpenses = (filteredTransactions) => filteredTransactions
+    .filter(t => t.type === 'expense')
+    .reduce((acc, t) => {
+        acc[t.category] = (acc[t.category] || 0) + t.amount;
+        return acc;
+    }, {});
 
+/**
+ * @function updateChart
+ * @description 更新支出圓餅圖。
+ * @param {Object} expenseData - 以分類名稱為鍵、支出總額為值的物件。
+ */
+export const updateChart = (expenseData) => {
     const labels = Object.keys(expenseData);
     const data = Object.values(expenseData);
 
@@ -19,6 +19,54 @@ export const formatCurrency = (num) => `$${Math.round(Number(num))}`;
  */
 export const formatDate = (dateStr) => new Date(dateStr + 'T00:00:00').toLocaleDateString('zh-TW', { year: 'numeric', month: '2-digit', day: '2-digit' });
 
+/**
+ * @function toISODate
+ * @description 將 Date 物件格式化為 'YYYY-MM-DD' 字串 (使用本地時間)。
+ * @param {Date} date - 日期物件。
+ * @returns {string} - 'YYYY-MM-DD' 格式的日期字串。
+ */
+export const toISODate = (date) => {
+    const year = date.getFullYear();
+    const month = String(date.getMonth() + 1).padStart(2, '0');
+    const day = String(date.getDate()).padStart(2, '0');
+    return `${year}-${month}-${day}`;
+};
+
+/**
+ * @function getPeriodRange
+ * @description 將篩選期間轉換為起訖日期，供後端 API 查詢使用。
+ * @param {string} period - 篩選期間 (all, today, this-week, this-month, this-year, custom)。
+ * @param {string} startDateStr - 自訂期間的開始日期字串 (YYYY-MM-DD)。
+ * @param {string} endDateStr - 自訂期間的結束日期字串 (YYYY-MM-DD)。
+ * @returns {{startDate: (string|null), endDate: (string|null)}} - 起訖日期字串，null 表示不限。
+ */
+export const getPeriodRange = (period, startDateStr, endDateStr) => {
+    const now = new Date();
+    now.setHours(0, 0, 0, 0);
+    switch (period) {
+        case 'today':
+            return { startDate: toISODate(now), endDate: toISODate(now) };
+        case 'this-week': {
+            const firstDayOfWeek = new Date(now.getFullYear(), now.getMonth(), now.getDate() - now.getDay()); // 假設週日為一週的第一天
+            const lastDayOfWeek = new Date(now.getFullYear(), now.getMonth(), now.getDate() - now.getDay() + 6);
+            return { startDate: toISODate(firstDayOfWeek), endDate: toISODate(lastDayOfWeek) };
+        }
+        case 'this-month':
+            return {
+                startDate: toISODate(new Date(now.getFullYear(), now.getMonth(), 1)),
+                endDate: toISODate(new Date(now.getFullYear(), now.getMonth() + 1, 0))
+            };
+        case 'this-year':
+            return {
+                startDate: toISODate(new Date(now.getFullYear(), 0, 1)),
+                endDate: toISODate(new Date(now.getFullYear(), 11, 31))
+            };
+        case 'custom':
+            return { startDate: startDateStr || null, endDate: endDateStr || null };
+        default:
+            return { startDate: null, endDate: null };
+    }
+};
 
 /**
  * @function parseJwt